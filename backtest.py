@@ -0,0 +1,123 @@
+import argparse
+import json
+import sys
+import time
+from collections import Counter
+
+import numpy as np
+
+from classes import Thermometer, TemperatureUnit
+
+'''
+Evaluate many threshold/fluctuations configurations against the same history of readings in a single pass.
+
+Readings are converted to the stored unit once, and the readings crossing a threshold are found once for the thresholds
+of every configuration together. Each configuration then only looks at the readings crossing one of its own thresholds,
+giving the same triggers as reading the whole history with Thermometer.read_many.
+'''
+
+
+'''
+Run configurations = [(name, thresholds, fluctuations), ...] on the readings (arrays of values and units, timestamps is
+an optional array of their times in seconds). A configuration could have a cooldown in seconds as fourth item, see
+Thermometer.set_cooldown. Return a result per configuration, in the same order:
+    {'name', 'triggers': {threshold name: count}, 'sample_index', 'threshold_id', 'times'}
+sample_index/threshold_id are the arrays returned by read_many, times are the timestamps of the triggers (their sample
+index when timestamps are not given)
+'''
+def backtest(values, units, configurations, timestamps=None, store_unit=TemperatureUnit.CELCIUS, fixed_point=False):
+    thermometers = []
+    for configuration in configurations:
+        therm = Thermometer(configuration[1], configuration[2], store_unit, fixed_point)
+        if len(configuration) > 3:
+            therm.set_cooldown(configuration[3])
+        thermometers.append(therm)
+    if not thermometers:
+        return []
+    temps, samples = thermometers[0].convert_many(values, units)
+    times = np.asarray(timestamps) if timestamps is not None else None
+
+    prevs = np.empty_like(temps)
+    prevs[:1] = temps[:1]
+    prevs[1:] = temps[:-1]
+    keys = np.unique(np.concatenate([np.asarray(sorted(therm.thresholds), dtype=temps.dtype) for therm in thermometers]))
+    crossing, lo, hi = Thermometer.crossing_readings(keys, prevs, temps)
+    lo, hi = lo[crossing], hi[crossing]
+
+    results = []
+    for (name, thresholds, fluctuations, *_), therm in zip(configurations, thermometers):
+        # Number of keys of this configuration before every key, to know which crossings include one of them
+        own = np.concatenate([[0], np.cumsum(np.isin(keys, np.asarray(sorted(therm.thresholds), dtype=temps.dtype)))])
+        sample_index, threshold_id = therm.read_converted(temps, samples, crossing[own[hi] > own[lo]], times)
+
+        names = {thresh.id: thresh.name for thresh in thresholds}
+        threshold_names = [names[i] for i in threshold_id.tolist()]
+        results.append({
+            'name': name,
+            'triggers': Counter(threshold_names),
+            'sample_index': sample_index,
+            'threshold_id': threshold_id,
+            'threshold_names': threshold_names,
+            'times': times[sample_index] if times is not None else sample_index,
+        })
+    return results
+
+
+'''
+Format results of backtest as a text table, one line per configuration and threshold with its number of triggers
+and the times of its first and last triggers
+'''
+def format_table(results):
+    lines = ["%-20s %-20s %10s %16s %16s" % ('configuration', 'threshold', 'triggers', 'first', 'last')]
+    for result in results:
+        times = {}  # {threshold name: [first time, last time]}
+        for name, when in zip(result['threshold_names'], result['times'].tolist()):
+            times.setdefault(name, [when, when])[1] = when
+        for name, count in sorted(result['triggers'].items()):
+            lines.append("%-20s %-20s %10d %16s %16s" % (result['name'], name, count, times[name][0], times[name][1]))
+        if not result['triggers']:
+            lines.append("%-20s %-20s %10d %16s %16s" % (result['name'], '-', 0, '-', '-'))
+    return '\n'.join(lines) + '\n'
+
+
+'''
+Load configurations from a JSON file
+{name: {"thresholds": ["NAME:VALUE:UNIT[:DIRECTION]", ...], "fluctuations": "0.5C", "cooldown": seconds}}
+'''
+def load_configurations(path):
+    from main import parse_fluctuations, parse_threshold
+    with open(path) as f:
+        configurations = json.load(f)
+    return [(name, [parse_threshold(text) for text in config['thresholds']], parse_fluctuations(config.get('fluctuations', '0.0C')),
+             config.get('cooldown')) for name, config in configurations.items()]
+
+
+def main(argv=None, stdout=None, stderr=None):
+    stdout = stdout or sys.stdout
+    stderr = stderr or sys.stderr
+    parser = argparse.ArgumentParser(description="Backtest threshold configurations on a binary log of readings")
+    parser.add_argument('log', help="binary log of readings (see binlog.py)")
+    parser.add_argument('configurations', help="JSON file of configurations")
+    parser.add_argument('--sensor', type=int, help="only use the readings of this sensor")
+    args = parser.parse_args(argv)
+
+    from binlog import LogReader, select_sensor
+
+    configurations = load_configurations(args.configurations)
+    with LogReader(args.log) as reader:
+        try:
+            records = select_sensor(reader.records, args.sensor)
+        except ValueError as e:
+            stderr.write("%s with --sensor\n" % e)
+            return 2
+        start = time.perf_counter()
+        results = backtest(records['value'], records['unit'], configurations, records['timestamp'])
+        elapsed = time.perf_counter() - start
+        stdout.write(format_table(results))
+        stderr.write("%d configurations, %d readings in %.2fs\n" % (len(configurations), len(records), elapsed))
+        del records  # Release the view of the memory map before closing it
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
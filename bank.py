@@ -0,0 +1,200 @@
+from bisect import bisect_left
+
+import numpy as np
+
+from classes import Direction, Temperature, TemperatureUnit
+
+'''
+Monitor many sensors at once. Each sensor behaves like an independent Thermometer with the same thresholds,
+but the state of all sensors is kept in contiguous arrays and readings are processed in batches.
+
+Memory footprint per sensor is 34 bytes:
+    previous reading (float64), lowest and highest threshold values of the reached thresholds (2 float64),
+    fluctuations (float64), store mode (int8) and output unit (int8)
+Sensors that currently have reached thresholds also keep a set of those thresholds and a sorted list of the positions
+of their threshold values (~300 bytes + 16 bytes per threshold).
+Threshold definitions are shared by all sensors, so they cost nothing per sensor.
+'''
+class ThermometerBank:
+    __units = [TemperatureUnit.CELCIUS, TemperatureUnit.FAHRENHEIT]  # Unit of each store mode / output unit code
+
+    '''
+    size is the number of sensors, sensor ids are 0 to size-1.
+    output_unit is either one TemperatureUnit for all sensors, or a sequence with one TemperatureUnit per sensor.
+    Like Thermometer, the storing mode of a sensor is the output_unit it is created with.
+    '''
+    def __init__(self, size, thresholds=(), fluctuations=(0.0, 'C'), output_unit=TemperatureUnit.CELCIUS):
+        self.size = size
+        self.thresholds = list(thresholds)  # Shared by all sensors, events refer to a threshold by its index in this list
+
+        if isinstance(output_unit, TemperatureUnit):
+            output_unit = [output_unit] * size
+        self.output_unit = np.array([self.__units.index(unit) for unit in output_unit], dtype=np.int8)
+        self.__store_mode = self.output_unit.copy()
+
+        self.__prev_data = np.full(size, np.nan)  # NaN when sensor did not read anything yet
+        # Lowest and highest threshold values of reached thresholds, NaN when no threshold is reached.
+        # Used to find quickly the sensors that could release a reached threshold
+        self.__triggered_low = np.full(size, np.nan)
+        self.__triggered_high = np.full(size, np.nan)
+        self.__triggered = {}  # Sorted positions in __keys of reached threshold values {sensor_id: []}, like __reached
+        self.__fluctuations = np.zeros(size)
+        self.__reached = {}  # Indices of reached thresholds, only for sensors that have reached thresholds {sensor_id: set()}
+        self.set_fluctuations(fluctuations)
+
+        # Index thresholds for each store mode, same as Thermometer.thresholds but with sorted threshold values in an array
+        self.__keys = []  # Sorted threshold values for each store mode
+        self.__at_key = []  # Indices of thresholds with the threshold value at the same position in __keys
+        for unit in self.__units:
+            at_key = {}
+            for i, thresh in enumerate(self.thresholds):
+                key = thresh.thresh_val_c if unit == TemperatureUnit.CELCIUS else thresh.thresh_val_f
+                at_key.setdefault(key, []).append(i)
+            keys = sorted(at_key)
+            self.__keys.append(np.array(keys, dtype=np.float64))
+            self.__at_key.append([at_key[key] for key in keys])
+
+    '''
+    Set fluctuations = (temperature, unit) of the given sensors (all sensors by default), see Thermometer.set_fluctuations
+    '''
+    def set_fluctuations(self, fluctuations, sensor_ids=None):
+        unit = TemperatureUnit(fluctuations[1].upper())
+        if unit == TemperatureUnit.CELCIUS:
+            fluct_c = fluctuations[0]
+            fluct_f = Temperature.convert_celcius_to_fahrenheit(fluctuations[0]) - 32
+        else:
+            fluct_c = Temperature.convert_fahrenheit_to_celcius(32 + fluctuations[0])
+            fluct_f = fluctuations[0]
+
+        if sensor_ids is None:
+            sensor_ids = slice(None)
+        store_mode = self.__store_mode[sensor_ids]
+        self.__fluctuations[sensor_ids] = np.where(store_mode == 0, fluct_c, fluct_f)
+
+    '''
+    Read one batch of readings, reading i is (values[i], units[i]) from sensor sensor_ids[i].
+    units is an array of unit strings or bytes, or a single unit for the whole batch.
+    A sensor could appear more than once in a batch, its readings are processed in order.
+    Return 2 arrays (sample_index, threshold_index): thresholds[threshold_index[j]] has been triggered by reading sample_index[j],
+    ordered like the output of calling Thermometer.read on every reading in order
+    '''
+    def read(self, sensor_ids, values, units):
+        sensor_ids = np.asarray(sensor_ids, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+        is_c, is_f = Temperature.unit_masks(units, values.shape)
+
+        # Convert every reading to the store mode of its sensor, dropping invalid readings
+        store_mode = self.__store_mode[sensor_ids]
+        temps = values.copy()
+        to_c = (store_mode == 0) & is_f
+        to_f = (store_mode == 1) & is_c
+        temps[to_c] = Temperature.convert_fahrenheit_to_celcius(values[to_c])
+        temps[to_f] = Temperature.convert_celcius_to_fahrenheit(values[to_f])
+        samples = np.flatnonzero((is_c | is_f) & np.isfinite(values))  # Same invalid readings as Thermometer.read
+
+        # Readings of the same sensor are processed in separate rounds, so each round has at most 1 reading per sensor
+        rank = self.__occurrence_rank(sensor_ids[samples])
+        sample_index, threshold_index = [], []
+        for r in range(rank.max() + 1 if len(rank) else 0):
+            round_samples = samples[rank == r]
+            self.__read_round(round_samples, sensor_ids[round_samples], temps[round_samples], sample_index, threshold_index)
+
+        sample_index = np.array(sample_index, dtype=np.int64)
+        threshold_index = np.array(threshold_index, dtype=np.int64)
+        order = np.argsort(sample_index, kind='stable')
+        return sample_index[order], threshold_index[order]
+
+    '''
+    Number of earlier readings from the same sensor, for every reading
+    '''
+    @staticmethod
+    def __occurrence_rank(sensor_ids):
+        order = np.argsort(sensor_ids, kind='stable')
+        sorted_ids = sensor_ids[order]
+        group_start = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]]) if len(sorted_ids) else sorted_ids
+        starts = np.repeat(group_start, np.diff(np.r_[group_start, len(sorted_ids)]))
+        rank = np.empty(len(sensor_ids), dtype=np.int64)
+        rank[order] = np.arange(len(sensor_ids)) - starts
+        return rank
+
+    def __read_round(self, samples, sensors, temps, sample_index, threshold_index):
+        prevs = self.__prev_data[sensors]
+        prevs = np.where(np.isnan(prevs), temps, prevs)
+        triggered_low, triggered_high = self.__triggered_low[sensors], self.__triggered_high[sensors]
+        fluctuations = self.__fluctuations[sensors]
+        store_mode = self.__store_mode[sensors]
+
+        for mode in (0, 1):
+            in_mode = store_mode == mode
+            keys = self.__keys[mode]
+            # Same ranges as Thermometer.__crossed_keys
+            up, down = prevs < temps, prevs > temps
+            lo = np.where(up, np.searchsorted(keys, prevs, 'right'), np.searchsorted(keys, temps, 'left'))
+            hi = np.where(down, np.searchsorted(keys, prevs, 'left'), np.searchsorted(keys, temps, 'right'))
+            crossing = in_mode & (hi > lo)
+
+            # Sensors outside the fluctuations of one of their reached threshold values reset those thresholds,
+            # the lowest or highest value is the furthest one
+            with np.errstate(invalid='ignore'):
+                far = (np.abs(temps - triggered_low) - fluctuations > 1E-5) | (np.abs(temps - triggered_high) - fluctuations > 1E-5)
+            for i in np.flatnonzero(in_mode & far).tolist():
+                self.__release_triggered(sensors[i], mode, temps[i], fluctuations[i])
+
+            for i in np.flatnonzero(crossing).tolist():
+                self.__trigger(samples[i], sensors[i], mode, prevs[i], temps[i], lo[i], hi[i], fluctuations[i],
+                               sample_index, threshold_index)
+
+        self.__prev_data[sensors] = temps
+
+    '''
+    Same rules as Thermometer.read, for the thresholds at key positions lo to hi crossed by one sensor
+    '''
+    def __trigger(self, sample, sensor, mode, prev_temp, curr_temp, lo, hi, fluctuation, sample_index, threshold_index):
+        positions = range(lo, hi) if prev_temp <= curr_temp else range(hi - 1, lo - 1, -1)
+        reached = self.__reached.get(sensor, ())
+        for pos in positions:
+            for i in self.__at_key[mode][pos]:
+                thresh = self.thresholds[i]
+                #  If temperature is reached from the wrong direction, or is still in fluctuations, dont trigger
+                if (thresh.direction == Direction.GREATER and prev_temp < curr_temp) or \
+                    (thresh.direction == Direction.LESSER and prev_temp > curr_temp) or \
+                    i in reached:
+                    continue
+                sample_index.append(sample)
+                threshold_index.append(i)
+                reached = self.__reached.setdefault(sensor, set())
+                reached.add(i)
+                positions = self.__triggered.setdefault(sensor, [])
+                index = bisect_left(positions, pos)
+                if index == len(positions) or positions[index] != pos:
+                    positions.insert(index, pos)
+                key = self.__keys[mode][pos]
+                if not self.__triggered_low[sensor] <= key:  # Also when it is NaN
+                    self.__triggered_low[sensor] = key
+                if not self.__triggered_high[sensor] >= key:
+                    self.__triggered_high[sensor] = key
+
+    '''
+    Reset the state of the reached thresholds of a sensor whose threshold value is not within the fluctuations of temp.
+    Threshold values in [temp - fluctuation, temp + fluctuation] stay reached, only the positions outside are looked at
+    '''
+    def __release_triggered(self, sensor, mode, temp, fluctuation):
+        keys = self.__keys[mode]
+        positions = self.__triggered[sensor]
+        reached = self.__reached[sensor]
+        # Positions in __keys of the lowest and after the highest threshold values that stay reached
+        low_pos = int(np.searchsorted(keys, temp - fluctuation - 1E-5, 'left'))
+        high_pos = int(np.searchsorted(keys, temp + fluctuation + 1E-5, 'right'))
+        start, end = bisect_left(positions, low_pos), bisect_left(positions, high_pos)
+        for pos in positions[:start] + positions[end:]:
+            reached.difference_update(self.__at_key[mode][pos])
+        del positions[end:]
+        del positions[:start]
+
+        if positions:
+            self.__triggered_low[sensor] = keys[positions[0]]
+            self.__triggered_high[sensor] = keys[positions[-1]]
+        else:
+            del self.__triggered[sensor]
+            del self.__reached[sensor]
+            self.__triggered_low[sensor] = self.__triggered_high[sensor] = np.nan
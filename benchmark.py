@@ -0,0 +1,230 @@
+import argparse
+import gc
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from random import Random
+
+from classes import Temperature, TemperatureUnit, Thermometer, Threshold
+
+try:
+    import numpy as np
+except ImportError:  # read_many benchmarks are skipped without numpy
+    np = None
+
+'''
+Benchmarks of the threshold engine on synthetic workloads. Every case reports readings/sec, per-read latency percentiles
+and peak memory, results are saved as JSON so two runs could be compared:
+
+    python benchmark.py run -o before.json
+    python benchmark.py run -o after.json
+    python benchmark.py compare before.json after.json
+'''
+
+THRESHOLD_COUNTS = [1, 100, 10000, 100000]
+LATENCY_PERCENTILES = [50, 90, 99]
+
+
+'''
+Workloads, each one returns n readings (temperature, unit) and the fluctuations to use
+'''
+def ramp(n, rand):
+    return [(-50.0 + 200.0 * i / n, 'C') for i in range(n)], (0.5, 'C')
+
+
+# Noise around the freezing point smaller than the fluctuations, thresholds are only triggered once
+def oscillation_inside(n, rand):
+    return [(rand.uniform(-0.4, 0.4), 'C') for _ in range(n)], (0.5, 'C')
+
+
+# Noise around the freezing point larger than the fluctuations, thresholds are triggered again and again
+def oscillation_outside(n, rand):
+    return [(rand.uniform(-2.0, 2.0), 'C') for _ in range(n)], (0.5, 'C')
+
+
+def mixed_units(n, rand):
+    data_pts = []
+    temp = 20.0
+    for _ in range(n):
+        temp += rand.uniform(-1.0, 1.0)
+        if rand.random() < 0.5:
+            data_pts.append((temp, 'C'))
+        else:
+            data_pts.append((Temperature.convert_celcius_to_fahrenheit(temp), 'F'))
+    return data_pts, (0.9, 'F')
+
+
+WORKLOADS = {
+    'ramp': ramp,
+    'oscillation_inside': oscillation_inside,
+    'oscillation_outside': oscillation_outside,
+    'mixed_units': mixed_units,
+}
+
+
+'''
+count thresholds spread between -50C and 150C, always including the freezing point
+'''
+def make_thresholds(count):
+    return [Threshold('T%d' % i, 0.0 if i == 0 else -50.0 + 200.0 * i / count) for i in range(count)]
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    return {'p%d' % p: latencies[min(len(latencies) - 1, int(len(latencies) * p / 100.0))] for p in LATENCY_PERCENTILES}
+
+
+'''
+Run func() and return (result, peak memory allocated while running it in bytes)
+'''
+def peak_memory(func):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = func()
+        return result, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+'''
+Benchmark building a thermometer with add_threshold and reading data_pts one by one with read
+'''
+def bench_read(data_pts, thresholds, fluctuations):
+    # The constructor adds its thresholds in bulk, so add_threshold is timed on its own
+    thermometer = Thermometer(fluctuations=fluctuations)
+    start = time.perf_counter()
+    for threshold in thresholds:
+        thermometer.add_threshold(threshold)
+    add_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for data_pt in data_pts:
+        thermometer.read(data_pt)
+    elapsed = time.perf_counter() - start
+
+    # Time every read separately in another run, timing adds overhead so it is not used for the throughput
+    thermometer = Thermometer(thresholds, fluctuations)
+    clock = time.perf_counter_ns
+    latencies = []
+    for data_pt in data_pts:
+        start = clock()
+        thermometer.read(data_pt)
+        latencies.append((clock() - start) / 1000.0)
+
+    def run():
+        thermometer = Thermometer(thresholds, fluctuations)
+        for data_pt in data_pts:
+            thermometer.read(data_pt)
+    _, memory = peak_memory(run)
+
+    result = {'readings_per_sec': len(data_pts) / elapsed, 'add_threshold_us': add_seconds * 1E6 / max(len(thresholds), 1),
+              'peak_memory_bytes': memory}
+    result.update(('latency_%s_us' % p, value) for p, value in percentiles(latencies).items())
+    return result
+
+
+'''
+Benchmark reading data_pts as one block with read_many
+'''
+def bench_read_many(data_pts, thresholds, fluctuations):
+    values = np.array([data_pt[0] for data_pt in data_pts])
+    units = np.array([data_pt[1] for data_pt in data_pts])
+    thermometer = Thermometer(thresholds, fluctuations)
+    start = time.perf_counter()
+    thermometer.read_many(values, units)
+    elapsed = time.perf_counter() - start
+
+    _, memory = peak_memory(lambda: Thermometer(thresholds, fluctuations).read_many(values, units))
+    return {'readings_per_sec': len(data_pts) / elapsed, 'peak_memory_bytes': memory}
+
+
+def bench_format_temperature(n):
+    format_temperature = Temperature.format_temperature
+    celcius, fahrenheit = TemperatureUnit.CELCIUS, TemperatureUnit.FAHRENHEIT
+    start = time.perf_counter()
+    for i in range(n):
+        format_temperature(i, celcius, fahrenheit)
+    return {'readings_per_sec': n / (time.perf_counter() - start)}
+
+
+'''
+Run every benchmark case with n readings, return {case name: {metric: value}}
+'''
+def run_all(n, threshold_counts=THRESHOLD_COUNTS, seed=0, out=None):
+    results = {}
+    for count in threshold_counts:
+        thresholds = make_thresholds(count)
+        for name, workload in WORKLOADS.items():
+            data_pts, fluctuations = workload(n, Random(seed))
+            case = 'read/%s/%d' % (name, count)
+            results[case] = bench_read(data_pts, thresholds, fluctuations)
+            if np is not None:
+                results['read_many/%s/%d' % (name, count)] = bench_read_many(data_pts, thresholds, fluctuations)
+            if out:
+                out.write("%-40s %12.0f readings/sec\n" % (case, results[case]['readings_per_sec']))
+    results['format_temperature'] = bench_format_temperature(n)
+    return results
+
+
+'''
+Compare 2 runs, return [(case, metric, before, after, change)] for every metric that got worse by more than tolerance (a ratio).
+Higher is better for readings_per_sec, lower is better for every other metric
+'''
+def compare(before, after, tolerance=0.1):
+    regressions = []
+    for case, metrics in sorted(before['results'].items()):
+        for metric, old in sorted(metrics.items()):
+            new = after['results'].get(case, {}).get(metric)
+            if new is None or old == 0:
+                continue
+            change = (new - old) / old
+            worse = -change if metric == 'readings_per_sec' else change
+            if worse > tolerance:
+                regressions.append((case, metric, old, new, change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the threshold engine")
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help="run the benchmarks and save the results as JSON")
+    run_parser.add_argument('-o', '--output', default='-', help="output file (default: stdout)")
+    run_parser.add_argument('-n', '--readings', type=int, default=20000, help="readings per case")
+    run_parser.add_argument('--thresholds', type=int, nargs='+', default=THRESHOLD_COUNTS, help="threshold counts")
+    compare_parser = commands.add_parser('compare', help="compare 2 result files, fail if a metric got worse")
+    compare_parser.add_argument('before')
+    compare_parser.add_argument('after')
+    compare_parser.add_argument('--tolerance', type=float, default=10.0, help="allowed change in percent (default: 10)")
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        report = {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'readings': args.readings,
+            'results': run_all(args.readings, args.thresholds, out=sys.stderr),
+        }
+        if args.output == '-':
+            json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        else:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+        return 0
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    regressions = compare(before, after, args.tolerance / 100.0)
+    for case, metric, old, new, change in regressions:
+        sys.stdout.write("%-40s %-20s %14.2f -> %14.2f (%+.1f%%)\n" % (case, metric, old, new, change * 100))
+    sys.stdout.write("%d regressions\n" % len(regressions))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,217 @@
+import argparse
+import mmap
+import sys
+import time
+
+import numpy as np
+
+'''
+Compact binary log of readings, made of a HEADER followed by fixed size records:
+    timestamp (float64, seconds), sensor id (uint32), temperature (float32 or float64), unit (1 byte, b'C' or b'F')
+All numbers are little endian and records are packed without padding (21 bytes with float64 temperatures, 17 with float32).
+
+LogReader maps the file in memory and gives a NumPy structured array view of the records without copying or parsing them,
+so the columns could be fed directly to Thermometer.read_many or ThermometerBank.read.
+'''
+
+MAGIC = b'THERMLOG'
+HEADER = np.dtype([('magic', 'S8'), ('version', '<u1'), ('value_size', '<u1'), ('reserved', 'V6')])
+VERSION = 1
+
+
+'''
+Dtype of the records, value_size is the size in bytes of the temperature (4 or 8)
+'''
+def record_dtype(value_size=8):
+    if value_size not in (4, 8):
+        raise ValueError("value_size should be 4 or 8, not %r" % value_size)
+    return np.dtype([('timestamp', '<f8'), ('sensor', '<u4'), ('value', '<f%d' % value_size), ('unit', 'S1')])
+
+
+'''
+Append readings to a binary log. Readings are buffered and written in blocks of buffer_size records
+'''
+class LogWriter:
+    def __init__(self, path, value_size=8, buffer_size=65536):
+        self.dtype = record_dtype(value_size)
+        self.__file = open(path, 'wb')
+        header = np.zeros(1, dtype=HEADER)
+        header['magic'], header['version'], header['value_size'] = MAGIC, VERSION, value_size
+        self.__file.write(header.tobytes())
+
+        self.__buffer = np.empty(buffer_size, dtype=self.dtype)
+        self.__size = 0  # Number of records in __buffer
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    '''
+    Write one reading
+    '''
+    def write(self, timestamp, sensor_id, temperature, unit):
+        if self.__size == len(self.__buffer):
+            self.flush()
+        self.__buffer[self.__size] = (timestamp, sensor_id, temperature, unit)
+        self.__size += 1
+
+    '''
+    Write a block of readings given as arrays (or single values that are the same for the whole block)
+    '''
+    def write_many(self, timestamps, sensor_ids, temperatures, units):
+        temperatures = np.asarray(temperatures)
+        records = np.empty(temperatures.shape, dtype=self.dtype)
+        records['timestamp'] = timestamps
+        records['sensor'] = sensor_ids
+        records['value'] = temperatures
+        records['unit'] = np.char.encode(units, 'ascii') if np.asarray(units).dtype.kind == 'U' else units
+        self.flush()
+        self.__file.write(records.tobytes())
+
+    def flush(self):
+        if self.__size:
+            self.__file.write(self.__buffer[:self.__size].tobytes())
+            self.__size = 0
+        self.__file.flush()
+
+    def close(self):
+        if not self.__file.closed:
+            self.flush()
+            self.__file.close()
+
+
+'''
+Read a binary log through a memory map, records is a structured array view of all the records in the file
+'''
+class LogReader:
+    def __init__(self, path):
+        self.__file = open(path, 'rb')
+        self.__map = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        header = np.frombuffer(self.__map, dtype=HEADER, count=1)[0]
+        if header['magic'] != MAGIC or header['version'] != VERSION:
+            self.close()
+            raise ValueError("%s is not a thermometer log" % path)
+        self.dtype = record_dtype(int(header['value_size']))
+
+        count = (len(self.__map) - HEADER.itemsize) // self.dtype.itemsize
+        self.records = np.frombuffer(self.__map, dtype=self.dtype, count=count, offset=HEADER.itemsize)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self.records)
+
+    '''
+    Yield views of block_size records
+    '''
+    def blocks(self, block_size=1 << 20):
+        for start in range(0, len(self.records), block_size):
+            yield self.records[start:start + block_size]
+
+    def close(self):
+        # The map could only be closed once no view of it is used anymore, otherwise it is closed when garbage collected
+        self.records = None
+        try:
+            self.__map.close()
+        except BufferError:
+            pass
+        self.__file.close()
+
+
+'''
+Select the records of sensor in records. Without sensor, the records should all be of the same sensor: readings of
+several sensors could not be fed to a single thermometer, they would be mixed as if they were read by the same sensor
+'''
+def select_sensor(records, sensor=None):
+    if sensor is not None:
+        return records[records['sensor'] == sensor]
+    if len(records) and (records['sensor'] != records['sensor'][0]).any():
+        raise ValueError("the log has readings of %d sensors, select one of them"
+                         % len(np.unique(records['sensor'])))
+    return records
+
+
+'''
+Feed every reading of a log to a single thermometer with Thermometer.read_many, with their timestamps, in blocks of
+block_size readings. Yield (sample_index, threshold_id) arrays of every block, sample_index counting from the start of the log
+'''
+def replay(reader, thermometer, block_size=1 << 20):
+    offset = 0
+    for block in reader.blocks(block_size):
+        sample_index, threshold_id = thermometer.read_many(block['value'], block['unit'], block['timestamp'])
+        yield sample_index + offset, threshold_id
+        offset += len(block)
+
+
+'''
+Feed every reading of a log to a ThermometerBank, with the sensor id of each record, in blocks of block_size readings.
+Yield (sample_index, threshold_index) arrays of every block, sample_index counting from the start of the log
+'''
+def replay_bank(reader, bank, block_size=1 << 20):
+    offset = 0
+    for block in reader.blocks(block_size):
+        sample_index, threshold_index = bank.read(block['sensor'], block['value'], block['unit'])
+        yield sample_index + offset, threshold_index
+        offset += len(block)
+
+
+'''
+Convert a text log to a binary log. Lines are either temperature,unit or timestamp,sensor_id,temperature,unit,
+lines that could not be parsed are skipped. Return (number of records written, number of lines skipped)
+'''
+def convert(lines, writer):
+    written = skipped = 0
+    for line in lines:
+        fields = line.split(',')
+        try:
+            if len(fields) == 2:
+                writer.write(0.0, 0, float(fields[0]), fields[1].strip().encode('ascii'))
+            else:
+                writer.write(float(fields[0]), int(fields[1]), float(fields[2]), fields[3].strip().encode('ascii'))
+            written += 1
+        except (ValueError, IndexError, UnicodeEncodeError):
+            if line.strip():
+                skipped += 1
+    return written, skipped
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert and replay binary logs of readings")
+    commands = parser.add_subparsers(dest='command', required=True)
+    convert_parser = commands.add_parser('convert', help="convert a text log to a binary log")
+    convert_parser.add_argument('input')
+    convert_parser.add_argument('output')
+    convert_parser.add_argument('--float32', action='store_true', help="store temperatures as float32")
+    replay_parser = commands.add_parser('replay', help="replay a binary log through a thermometer per sensor")
+    replay_parser.add_argument('input')
+    args = parser.parse_args(argv)
+
+    if args.command == 'convert':
+        with open(args.input) as lines, LogWriter(args.output, 4 if args.float32 else 8) as writer:
+            written, skipped = convert(lines, writer)
+        sys.stderr.write("%d readings written, %d lines skipped\n" % (written, skipped))
+        return 0
+
+    from bank import ThermometerBank
+    from main import DEFAULT_THRESHOLDS
+
+    with LogReader(args.input) as reader:
+        size = int(reader.records['sensor'].max()) + 1 if len(reader) else 0
+        bank = ThermometerBank(size, DEFAULT_THRESHOLDS, (0.5, 'C'))
+        start = time.perf_counter()
+        events = sum(len(sample_index) for sample_index, _ in replay_bank(reader, bank))
+        elapsed = time.perf_counter() - start
+        sys.stderr.write("%d readings, %d events in %.2fs (%.0f readings/sec)\n" %
+                         (len(reader), events, elapsed, len(reader) / max(elapsed, 1E-9)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,15 @@
+from bisect import bisect_left, bisect_right, insort
 from enum import Enum
+from itertools import count
+from math import isfinite
+from threading import Lock
+
+from rolling import RollingStats
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed for batch reading
+    np = None
 
 '''
 Direction enum to indicate from which direction would a threshold be triggered
@@ -29,6 +40,21 @@ class Temperature:
     def convert_celcius_to_fahrenheit(temperature):
         return temperature * 9/5.0 + 32
 
+    '''
+    Return 2 boolean arrays of the given shape, indicating which units are celcius and which are fahrenheit.
+    units is an array of unit strings or bytes (i.e. 'C', b'f'), or a single unit for the whole shape
+    '''
+    @staticmethod
+    def unit_masks(units, shape):
+        units = np.asarray(units)
+        if units.dtype.kind == 'S':
+            is_c = (units == b'C') | (units == b'c')
+            is_f = (units == b'F') | (units == b'f')
+        else:
+            is_c = (units == 'C') | (units == 'c')
+            is_f = (units == 'F') | (units == 'f')
+        return np.broadcast_to(is_c, shape), np.broadcast_to(is_f, shape)
+
     '''
     Convert temperature to the appropriate format for storing
     '''
@@ -45,40 +71,134 @@ class Temperature:
 
 
 '''
-Represent a Threshold
+Represent a Threshold. Thresholds are immutable, so the same threshold could be shared by many thermometers,
+whether a threshold has been reached is kept by each Thermometer
 '''
 class Threshold:
+    __slots__ = ('id', 'name', 'thresh_val_c', 'thresh_val_f', 'direction')
+    __next_id = count()  # Used to give every threshold a unique id
+
     def __init__(self, name, thresh_val, unit=TemperatureUnit.CELCIUS, direction=Direction.ANY):
-        self.name = name
+        # Identify the threshold in compact outputs (i.e. Thermometer.read_many) and in the state of thermometers
+        object.__setattr__(self, 'id', next(Threshold.__next_id))
+        object.__setattr__(self, 'name', name)
 
         # Store threshold value in both celcius and fahrenheit. If there are more unit, should probably be changed to a dictionary
         if unit == TemperatureUnit.CELCIUS:
-            self.thresh_val_c = thresh_val
-            self.thresh_val_f = Temperature.convert_celcius_to_fahrenheit(thresh_val)
+            thresh_val_c = thresh_val
+            thresh_val_f = Temperature.convert_celcius_to_fahrenheit(thresh_val)
         else:
-            self.thresh_val_f = thresh_val
-            self.thresh_val_c = Temperature.convert_fahrenheit_to_celcius(thresh_val)
-                        
-        self.direction = direction
+            thresh_val_f = thresh_val
+            thresh_val_c = Temperature.convert_fahrenheit_to_celcius(thresh_val)
+        object.__setattr__(self, 'thresh_val_c', thresh_val_c)
+        object.__setattr__(self, 'thresh_val_f', thresh_val_f)
+
+        object.__setattr__(self, 'direction', direction)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Threshold is immutable")
 
-        # Indicate if threshold has been triggered recently
-        self.reached = False
+    def __delattr__(self, name):
+        raise AttributeError("Threshold is immutable")
+
+    # Needed by pickle/copy, since attributes could not be set normally
+    def __setstate__(self, state):
+        for name, value in state[1].items():
+            object.__setattr__(self, name, value)
+
+    '''
+    Recreate a threshold with the same id and values as a saved one (i.e. from a snapshot),
+    new thresholds created after it will get higher ids
+    '''
+    @staticmethod
+    def restore(threshold_id, name, thresh_val_c, thresh_val_f, direction):
+        threshold = object.__new__(Threshold)
+        for attr, value in (('id', threshold_id), ('name', name), ('thresh_val_c', thresh_val_c),
+                            ('thresh_val_f', thresh_val_f), ('direction', direction)):
+            object.__setattr__(threshold, attr, value)
+        Threshold.__next_id = count(max(next(Threshold.__next_id), threshold_id + 1))
+        return threshold
+
+
+'''
+Listing all kinds of output a thermometer could produce from a reading
+'''
+class EventKind(Enum):
+    READING = 0
+    THRESHOLD = 1
+    INVALID_UNIT = 2
+    INVALID_TEMPERATURE = 3  # NaN or infinite temperature
+
+
+'''
+Represent an output of a reading. The temperature is kept in the unit the thermometer stores it,
+and only converted and formatted to a string when it is printed
+'''
+class Event:
+    __slots__ = ('kind', 'temperature', 'store_unit', 'output_unit', 'threshold', 'count')
+
+    def __init__(self, kind, temperature=None, store_unit=None, output_unit=None, threshold=None, count=1):
+        self.kind = kind
+        self.temperature = temperature
+        self.store_unit = store_unit
+        self.output_unit = output_unit
+        self.threshold = threshold  # Threshold that has been triggered, only for EventKind.THRESHOLD
+        self.count = count  # Number of triggers merged in this event, see coalesce.EventCoalescer
+
+    def __str__(self):
+        if self.kind == EventKind.INVALID_UNIT:
+            return "Invalid Unit"
+        if self.kind == EventKind.INVALID_TEMPERATURE:
+            return "Invalid Temperature"
+
+        # Convert temperature to the output unit
+        output_temp = Temperature.format_temperature(self.temperature, self.output_unit, self.store_unit)
+        if self.kind == EventKind.THRESHOLD:
+            if self.count > 1:
+                return "%s threshold has been reached at %.1f%s %d times" % (self.threshold.name, output_temp,
+                                                                            self.output_unit.value, self.count)
+            return "%s threshold has been reached at %.1f%s" % (self.threshold.name, output_temp, self.output_unit.value)
+        return "%.1f%s" % (output_temp, self.output_unit.value)
+
+    def __repr__(self):
+        return "Event(%s, %r)" % (self.kind.name, str(self))
 
 
 class Thermometer:
-    def __init__(self, thresholds=[], fluctuations=(0.0, 'C'), output_unit=TemperatureUnit.CELCIUS,):
+    FIXED_POINT_SCALE = 1000  # Stored temperatures are in milli-degrees in fixed point mode
+    # Unit of the unit strings accepted by read, looked up instead of calling upper() and TemperatureUnit() on every reading
+    READ_UNITS = {'C': TemperatureUnit.CELCIUS, 'c': TemperatureUnit.CELCIUS, 'F': TemperatureUnit.FAHRENHEIT, 'f': TemperatureUnit.FAHRENHEIT}
+
+    '''
+    In fixed point mode (fixed_point=True), every temperature is stored as an integer number of milli-degrees in the
+    storing unit, so threshold values, fluctuations and readings are compared exactly (i.e. 212F and 100C are the same key)
+    '''
+    def __init__(self, thresholds=(), fluctuations=(0.0, 'C'), output_unit=TemperatureUnit.CELCIUS, fixed_point=False):
+        self.__scale = Thermometer.FIXED_POINT_SCALE if fixed_point else None
+        self.__tolerance = 0 if fixed_point else 1E-5  # Differences of stored temperatures within tolerance are considered 0
         self.__prev_data = None  # Used to store previuos data
-        self.__prev_triggered = None  # Used to store the temperature that previouly get triggered
+        self.__triggered = []  # Sorted threshold values of the reached thresholds
+        self.__reached = set()  # Ids of thresholds that have been triggered recently
         self.__store_mode = output_unit  # Indicate the storing mode of thermometer, it is set to the first output_unit that was indicated
         
         self.output_unit = output_unit  # Indicate the output unit, this can be change
+        self.metrics = None  # metrics.ThermometerCounters of this thermometer, see metrics.ThermometerMetrics.attach
+        self.rolling = None  # RollingStats of the stored temperatures, see enable_rolling_stats
+        self.dispatcher = None  # dispatcher.CallbackDispatcher running the callbacks of triggered thresholds, if any
+        self.lock = None  # Lock held while reading, see enable_locking
+        self.__last_order = None  # Order (sequence number or timestamp) of the last reading that had one
+        self.__now = None  # Timestamp of the reading being read, if any
+        self.__cooldown = None  # Seconds before a threshold could be triggered again, see set_cooldown
+        self.__last_triggered = {}  # {threshold id: timestamp of its last trigger}, only with a cooldown
     
         self.set_fluctuations(fluctuations)
 
         # Thresholds is in the form of {threshold_value: [All threshold with the same threhold value], ...}
         self.thresholds = {}
-        for thresh in thresholds:
-            self.add_threshold(thresh)
+        self.__keys = []  # Sorted threshold values, used to find every threshold crossed between two readings
+        self.__names = {}  # {threshold name: [All thresholds with this name]}, used to find thresholds to remove
+        self.__shared_thresholds = False  # Indicate if thresholds, __keys and __names are shared with a copy of this thermometer
+        self.add_thresholds(thresholds)
 
     '''
     Setting fluctuations temperature, while taking account the unit
@@ -97,87 +217,548 @@ class Thermometer:
         # Storing mode is in Farenheit, but input unit is in Celcius
         elif self.__store_mode == TemperatureUnit.FAHRENHEIT and self.__fluctuations_unit == TemperatureUnit.CELCIUS:
             self.__fluctuations_temp = Temperature.convert_celcius_to_fahrenheit(self.__fluctuations_temp) - 32
+
+        if self.__scale:
+            self.__fluctuations_temp = round(self.__fluctuations_temp * self.__scale)
+
+    '''
+    Convert temperature in unit to the stored unit, and to milli-degrees in fixed point mode
+    '''
+    def __store(self, temperature, unit):
+        temperature = Temperature.format_temperature(temperature, self.__store_mode, unit)
+        if self.__scale:
+            return round(temperature * self.__scale)
+        return temperature
+
+    '''
+    Convert a stored temperature back to degrees in the stored unit
+    '''
+    def __unscale(self, temperature):
+        if self.__scale:
+            return temperature / self.__scale
+        return temperature
                                        
+    '''
+    Return a new thermometer with the same thresholds, fluctuations and units, but without any reading.
+    The thresholds are shared with the copy until one of them adds or removes a threshold,
+    so creating many thermometers from one template costs O(1) memory per thermometer
+    '''
+    def copy(self):
+        therm = Thermometer(output_unit=self.__store_mode, fixed_point=self.__scale is not None)
+        therm.output_unit = self.output_unit
+        therm.__fluctuations_unit = self.__fluctuations_unit
+        therm.__fluctuations_temp = self.__fluctuations_temp
+        therm.dispatcher = self.dispatcher
+        therm.lock = Lock() if self.lock is not None else None
+        therm.__cooldown = self.__cooldown
+
+        therm.thresholds = self.thresholds
+        therm.__keys = self.__keys
+        therm.__names = self.__names
+        self.__shared_thresholds = therm.__shared_thresholds = True
+        return therm
+
+    '''
+    Keep rolling statistics over the last size readings, and only readings of the last seconds if seconds is given.
+    The time of a reading is its timestamp (see read and read_many), or the time it is read if it has none
+    '''
+    def enable_rolling_stats(self, size, seconds=None):
+        self.rolling = RollingStats(size, seconds)
+
+    '''
+    Do not trigger a threshold again less than seconds after its last trigger, even if the temperature went out of
+    the fluctuations and came back. The cooldown only applies to timestamped readings: the timestamp argument of read
+    and read_events, or the timestamps of read_many, in seconds. None disables it
+    '''
+    def set_cooldown(self, seconds):
+        self.__cooldown = seconds
+        self.__last_triggered = {}
+
+    '''
+    Make reads safe from several threads: read, read_events, read_many and get_state hold lock (a new Lock by default,
+    or i.e. a lock shared by several thermometers) while using the state of the thermometer.
+    Changes of the thresholds are not locked, they should be done while holding thermometer.lock
+    '''
+    def enable_locking(self, lock=None):
+        self.lock = lock if lock is not None else Lock()
+
+    '''
+    Return the rolling statistics {'count', 'min', 'max', 'mean', 'stddev'} in the output unit,
+    None if rolling statistics are not enabled or there is no reading yet
+    '''
+    def rolling_stats(self):
+        if self.rolling is None or not self.rolling.count:
+            return None
+
+        # Standard deviation is a difference between 2 temperatures, so the constant 32 should not be taken into the conversion
+        spread = 1.0
+        if self.__store_mode == TemperatureUnit.CELCIUS and self.output_unit == TemperatureUnit.FAHRENHEIT:
+            spread = 9/5.0
+        elif self.__store_mode == TemperatureUnit.FAHRENHEIT and self.output_unit == TemperatureUnit.CELCIUS:
+            spread = 5/9.0
+
+        def output(temperature):
+            return Temperature.format_temperature(self.__unscale(temperature), self.output_unit, self.__store_mode)
+        return {
+            'count': self.rolling.count,
+            'min': output(self.rolling.min),
+            'max': output(self.rolling.max),
+            'mean': output(self.rolling.mean),
+            'stddev': self.__unscale(self.rolling.stddev) * spread,
+        }
+
+    '''
+    Return the units, fluctuations and trigger state of the thermometer as plain values, used to save it (i.e. snapshot):
+    (store unit, output unit, fluctuations unit, stored fluctuations, fixed point, previous reading, threshold values
+    of the reached thresholds, ids of reached thresholds, cooldown, {threshold id: timestamp of its last trigger},
+    order of the last ordered reading). Temperatures are stored ones (in milli-degrees in fixed point mode)
+    '''
+    def get_state(self):
+        if self.lock is not None:
+            with self.lock:
+                return self.__get_state()
+        return self.__get_state()
+
+    def __get_state(self):
+        return (self.__store_mode, self.output_unit, self.__fluctuations_unit, self.__fluctuations_temp, self.__scale is not None,
+                self.__prev_data, list(self.__triggered), list(self.__reached), self.__cooldown, dict(self.__last_triggered),
+                self.__last_order)
+
+    '''
+    Set the state returned by get_state, the store unit and fixed point mode should be the ones of this thermometer
+    '''
+    def set_state(self, state):
+        store_mode, self.output_unit, self.__fluctuations_unit, self.__fluctuations_temp, fixed_point, \
+            self.__prev_data, triggered, reached, self.__cooldown, last_triggered, self.__last_order = state
+        if store_mode != self.__store_mode or fixed_point != (self.__scale is not None):
+            raise ValueError("state of a thermometer with another store unit or fixed point mode")
+        self.__triggered = sorted(set(triggered))
+        self.__reached = set(reached)
+        self.__last_triggered = dict(last_triggered)
+
+    '''
+    Indicate if threshold has been triggered recently by this thermometer
+    '''
+    def is_reached(self, threshold):
+        return threshold.id in self.__reached
+
+    '''
+    Stop sharing thresholds before changing them, see copy
+    '''
+    def __own_thresholds(self):
+        if self.__shared_thresholds:
+            self.thresholds = {key: list(thresholds_at_key) for key, thresholds_at_key in self.thresholds.items()}
+            self.__keys = list(self.__keys)
+            self.__names = {name: list(thresholds_at_name) for name, thresholds_at_name in self.__names.items()}
+            self.__shared_thresholds = False
+
+    '''
+    Key of threshold in thresholds, its value in the storing unit
+    '''
+    def __key(self, threshold):
+        key = threshold.thresh_val_c if self.__store_mode == TemperatureUnit.CELCIUS else threshold.thresh_val_f
+        return round(key * self.__scale) if self.__scale else key
+
     def add_threshold(self, threshold):
-        # Set key based on storing mode
-        if self.__store_mode == TemperatureUnit.CELCIUS:
-            key = threshold.thresh_val_c
-        else:
-            key = threshold.thresh_val_f
-            
-        if key not in self.thresholds:
-            self.thresholds[key] = [threshold]
-        else:
-            self.thresholds[key].append(threshold)
+        self.add_thresholds([threshold])
+
+    '''
+    Add many thresholds at once, the sorted threshold values are rebuilt once instead of inserting every new value
+    '''
+    def add_thresholds(self, thresholds):
+        self.__own_thresholds()
+        new_keys = []
+        for threshold in thresholds:
+            key = self.__key(threshold)
+            if key not in self.thresholds:
+                self.thresholds[key] = [threshold]
+                new_keys.append(key)
+            else:
+                self.thresholds[key].append(threshold)
+            self.__names.setdefault(threshold.name, []).append(threshold)
+
+        if len(new_keys) == 1:
+            insort(self.__keys, new_keys[0])
+        elif new_keys:
+            self.__keys = sorted(self.__keys + sorted(new_keys))  # Merging 2 sorted runs takes linear time
 
     '''
     Remove Threshold based on threshold value and name of threshold
     '''
     def remove_thershold(self, thresh_val, unit, name):
-        key = Temperature.format_temperature(thresh_val, self.__store_mode, unit)
-        if key not in self.thresholds:
-            return False
-        else:
-            thresholds_at_key =self.thresholds[key]
-            for i in range(0, len(thresholds_at_key)):
-                threshold = thresholds_at_key[i]
-                if threshold.name == name:
-                    thresholds_at_key.pop(i)
-                    return True
-            return False
+        key = self.__store(thresh_val, unit)
+        for threshold in self.__names.get(name, ()):
+            if self.__key(threshold) == key:
+                self.__remove([threshold])
+                return True
+        return False
+
+    '''
+    Remove every threshold with one of the names, return the number of thresholds removed.
+    The thresholds are found with the name index, removing them costs a pass over the thresholds with the same name or
+    threshold value, and over the sorted threshold values if a threshold value has no threshold left
+    '''
+    def remove_thresholds(self, names):
+        removed = [threshold for name in set(names) for threshold in self.__names.get(name, ())]
+        self.__remove(removed)
+        return len(removed)
+
+    '''
+    Replace the thresholds by the given ones (i.e. a catalog reloaded from a configuration), only touching the changed ones.
+    A current threshold with the same name, value and direction as a given one is replaced by the given one in place,
+    and its reached state is moved to the id of the given one, so ids reported afterwards are those of the new catalog.
+    Finding the removed thresholds takes a pass over the current thresholds.
+    Return (number of thresholds added, number of thresholds removed)
+    '''
+    def replace_thresholds(self, thresholds):
+        kept = {}  # {id of a current threshold that is kept: the given threshold replacing it}
+        added = []
+        for threshold in thresholds:
+            for current in self.__names.get(threshold.name, ()):
+                if current.id not in kept and current.thresh_val_c == threshold.thresh_val_c and \
+                        current.thresh_val_f == threshold.thresh_val_f and current.direction == threshold.direction:
+                    kept[current.id] = threshold
+                    break
+            else:
+                added.append(threshold)
+        removed = [current for at_name in self.__names.values() for current in at_name if current.id not in kept]
+
+        self.__remove(removed)
+        self.__swap(kept)
+        self.add_thresholds(added)
+        return len(added), len(removed)
+
+    '''
+    Replace kept thresholds by their new objects ({current id: new threshold}), moving their reached state to the new ids
+    '''
+    def __swap(self, kept):
+        kept = {current_id: threshold for current_id, threshold in kept.items() if threshold.id != current_id}
+        if not kept:
+            return
+        self.__own_thresholds()
+        for key in set(self.__key(threshold) for threshold in kept.values()):
+            self.thresholds[key][:] = [kept.get(threshold.id, threshold) for threshold in self.thresholds[key]]
+        for name in set(threshold.name for threshold in kept.values()):
+            self.__names[name][:] = [kept.get(threshold.id, threshold) for threshold in self.__names[name]]
+        for current_id, threshold in kept.items():
+            if current_id in self.__reached:
+                self.__reached.discard(current_id)
+                self.__reached.add(threshold.id)
+            if current_id in self.__last_triggered:
+                self.__last_triggered[threshold.id] = self.__last_triggered.pop(current_id)
+
+    def __remove(self, thresholds):
+        if not thresholds:
+            return
+        self.__own_thresholds()
+        removed_ids = set(threshold.id for threshold in thresholds)
+        # Filter every changed list once, instead of removing thresholds one at a time
+        empty_keys = []
+        for key in set(self.__key(threshold) for threshold in thresholds):
+            thresholds_at_key = self.thresholds[key]
+            thresholds_at_key[:] = [threshold for threshold in thresholds_at_key if threshold.id not in removed_ids]
+            # Drop empty threshold value from the index, so it is not searched anymore
+            if not thresholds_at_key:
+                del self.thresholds[key]
+                empty_keys.append(key)
+        for name in set(threshold.name for threshold in thresholds):
+            at_name = self.__names[name]
+            at_name[:] = [threshold for threshold in at_name if threshold.id not in removed_ids]
+            if not at_name:
+                del self.__names[name]
+        self.__reached -= removed_ids
+        for threshold_id in removed_ids:
+            self.__last_triggered.pop(threshold_id, None)
+
+        if len(empty_keys) == 1:
+            del self.__keys[bisect_left(self.__keys, empty_keys[0])]
+        elif empty_keys:
+            empty_keys = set(empty_keys)
+            self.__keys = [key for key in self.__keys if key not in empty_keys]
+
+    '''
+    Find all threshold values that are reached when temperature moves from prev_temp to curr_temp, in the order they are crossed.
+    Going up covers (prev_temp, curr_temp], going down covers [curr_temp, prev_temp), so the threshold value that
+    the temperature is leaving is not reached again. If the temperature does not move, only curr_temp itself is covered
+    '''
+    def __crossed_keys(self, prev_temp, curr_temp):
+        keys = self.__keys
+        if prev_temp < curr_temp:
+            return keys[bisect_right(keys, prev_temp):bisect_right(keys, curr_temp)]
+        elif prev_temp > curr_temp:
+            return keys[bisect_left(keys, curr_temp):bisect_left(keys, prev_temp)][::-1]
+        return keys[bisect_left(keys, curr_temp):bisect_right(keys, curr_temp)]
             
+    '''
+    Trigger thresholds at the crossed threshold values, unless reached from the wrong direction or still in fluctuations.
+    Reached thresholds that are still reached are within the fluctuations of their threshold value, see __release_triggered
+    '''
+    def __trigger(self, crossed, curr_temp):
+        triggered = []  # (threshold value, threshold) of every threshold that is triggered
+        for key in crossed:
+            for thresh in self.thresholds[key]:
+                #  If temperature is reached from the wrong direction, or is still in fluctuations, dont trigger
+                if (thresh.direction == Direction.GREATER and self.__prev_data < curr_temp) or \
+                    (thresh.direction == Direction.LESSER and self.__prev_data > curr_temp):
+                     continue
+                elif thresh.id in self.__reached:
+                    if self.metrics is not None:
+                        self.metrics.suppressed += 1
+                    continue
+                # If the threshold has been triggered less than the cooldown ago, dont trigger. It is still reached by
+                # this crossing, so it is not triggered once the cooldown is over unless the temperature crosses it again
+                elif self.__cooldown is not None and self.__now is not None and thresh.id in self.__last_triggered and \
+                        self.__now - self.__last_triggered[thresh.id] < self.__cooldown:
+                    if self.metrics is not None:
+                        self.metrics.suppressed += 1
+                    self.__reach(key, thresh)
+                    continue
+                else:  # Triggering Threshold
+                    triggered.append((key, thresh))
+                    self.__reach(key, thresh)
+                    if self.__cooldown is not None and self.__now is not None:
+                        self.__last_triggered[thresh.id] = self.__now
+        return triggered
+
+    def __reach(self, key, thresh):
+        self.__reached.add(thresh.id)
+        pos = bisect_left(self.__triggered, key)
+        if pos == len(self.__triggered) or self.__triggered[pos] != key:
+            self.__triggered.insert(pos, key)
+
+    '''
+    Reset the state of reached thresholds whose threshold value is not within the fluctuations of every temperature
+    between low and high, so they could be triggered again. The threshold values that stay reached are the ones in
+    [high - fluctuations, low + fluctuations], only the values outside of it are looked at
+    '''
+    def __release_triggered(self, low, high):
+        triggered = self.__triggered
+        margin = self.__fluctuations_temp + self.__tolerance
+        start, end = bisect_left(triggered, high - margin), bisect_right(triggered, low + margin)
+        if start == 0 and end == len(triggered):
+            return
+        for key in triggered[:start] + triggered[end:]:
+            for thresh in self.thresholds.get(key, ()):
+                self.__reached.discard(thresh.id)
+        del triggered[end:]
+        del triggered[:start]
+
     '''
     Read data_pt and produce output accordingly
     data_pt is in the form (temperature, unit)
+    timestamp is the time of the reading in seconds, used by the rolling statistics and the cooldown (see set_cooldown)
     '''
-    def read(self, data_pt):
+    def read(self, data_pt, timestamp=None):
+        # Callbacks need Event objects, otherwise the strings are formatted directly
+        if self.dispatcher is not None:
+            return [str(event) for event in self.read_events(data_pt, timestamp=timestamp)]
+        if self.lock is not None:
+            with self.lock:
+                kind, curr_temp, triggered = self.__apply(data_pt, timestamp)
+        else:
+            kind, curr_temp, triggered = self.__apply(data_pt, timestamp)
+
         result = []  # Array of strings that would be printed
-        curr_unit = data_pt[1].upper()
-        
-        if curr_unit not in ['C', 'F']:
-            result.append("Invalid Unit")
-            return result
+        if kind is EventKind.READING:
+            unit = self.output_unit.value
+            for key, thresh in triggered:
+                result.append("%s threshold has been reached at %.1f%s" % (thresh.name, self.__output(key), unit))
+            if not result:
+                result.append("%.1f%s" % (self.__output(curr_temp), unit))
+        elif kind is not None:
+            result.append(str(Event(kind)))
+        return result
+
+    '''
+    Convert a stored temperature to the output unit
+    '''
+    def __output(self, temperature):
+        if self.__scale:
+            temperature /= self.__scale
+        if self.output_unit is self.__store_mode:
+            return temperature
+        return Temperature.format_temperature(temperature, self.output_unit, self.__store_mode)
+
+    '''
+    Read data_pt like read, but return Event objects instead of strings, they are only formatted when printed.
+    If readings is False, a plain reading (no threshold triggered) does not return anything.
+
+    data_pt could be (temperature, unit, order), order being a sequence number or a timestamp of the reading.
+    Readings are then applied in increasing order: a reading whose order is not greater than the order of the last
+    applied reading arrived late (or twice, i.e. from redundant collectors), it is ignored and nothing is returned.
+    The order is only used to sort readings, the time of a reading is given separately as timestamp, see read
+    '''
+    def read_events(self, data_pt, readings=True, timestamp=None):
+        if self.lock is not None:
+            with self.lock:
+                return self.__read_events(data_pt, readings, timestamp)
+        return self.__read_events(data_pt, readings, timestamp)
+
+    def __read_events(self, data_pt, readings, timestamp):
+        kind, curr_temp, triggered = self.__apply(data_pt, timestamp)
+        if kind is not EventKind.READING:
+            return [] if kind is None else [Event(kind)]
+
+        # Report the threshold values that were reached
+        result = [Event(EventKind.THRESHOLD, self.__unscale(key), self.__store_mode, self.output_unit, thresh)
+                  for key, thresh in triggered]
+        if result and self.dispatcher is not None:
+            for event in result:
+                self.dispatcher.dispatch(event)
+
+        # If no threshold has been triggered, just report the temperature that was read
+        if not result and readings:
+            result.append(Event(EventKind.READING, self.__unscale(curr_temp), self.__store_mode, self.output_unit))
+        return result
+
+    '''
+    Apply data_pt to the state of the thermometer, return (kind, stored temperature, [(threshold value, threshold), ...]).
+    kind is EventKind.READING with the thresholds it triggered for a valid reading, the EventKind of the error for an
+    invalid one, and None for a reading ignored because it is out of order
+    '''
+    def __apply(self, data_pt, timestamp):
+        if self.metrics is not None:
+            return self.metrics.count(self.__apply_reading, data_pt, timestamp)
+        return self.__apply_reading(data_pt, timestamp)
+
+    def __apply_reading(self, data_pt, timestamp):
+        if len(data_pt) > 2:
+            if self.__last_order is not None and data_pt[2] <= self.__last_order:
+                if self.metrics is not None:
+                    self.metrics.out_of_order += 1
+                return None, None, None
+            self.__last_order = data_pt[2]
+        self.__now = timestamp
+
+        curr_unit = Thermometer.READ_UNITS.get(data_pt[1])
+        if curr_unit is None:
+            return EventKind.INVALID_UNIT, None, None
+        curr_temp = data_pt[0]
+        # A NaN would not be ordered with the threshold values, and would be reported as crossing all of them
+        if not isfinite(curr_temp):
+            return EventKind.INVALID_TEMPERATURE, None, None
 
         # Convert current temperature to the stored unit
-        curr_unit = TemperatureUnit(curr_unit)
-        curr_temp = Temperature.format_temperature(data_pt[0], self.__store_mode, curr_unit)
-        
-        if self.__prev_data is None:
-            self.__prev_data = curr_temp
+        if curr_unit is not self.__store_mode or self.__scale:
+            curr_temp = self.__store(curr_temp, curr_unit)
+
+        prev_temp = self.__prev_data
+        if prev_temp is None:
+            prev_temp = curr_temp
+        if self.rolling is not None:
+            self.rolling.add(curr_temp, timestamp)
+
+        # When curr temperature is not within the fluctuations area of a reached threshold value,
+        # reset the state of its thresholds for the next trigger
+        if self.__triggered:
+            self.__release_triggered(curr_temp, curr_temp)
+
+        triggered = ()
+        crossed = self.__crossed_keys(prev_temp, curr_temp)
+        if crossed:  # Trigger thresholds that are reached or jumped over
+            self.__prev_data = prev_temp
+            triggered = self.__trigger(crossed, curr_temp)
 
-        # Convert output temperature to the output unit
-        output_temp = Temperature.format_temperature(curr_temp, self.output_unit, self.__store_mode)
-        if curr_temp in self.thresholds:  # Trigger threshold
-            for thresh in self.thresholds[curr_temp]:
-                #  If temperature is reached from the wrong direction, or is still in fluctuations, dont trigger
-                if (thresh.direction == Direction.GREATER and self.__prev_data < curr_temp) or \
-                    (thresh.direction == Direction.LESSER and self.__prev_data > curr_temp) or \
-                    (thresh.reached and abs(curr_temp-self.__prev_data) - self.__fluctuations_temp <= 1E-5):
-                     continue
-                else:  # Triggering Threshold
-                    s = "%s threshold has been reached at %.1f%s" % (thresh.name, output_temp, self.output_unit.value)
-                    result.append(s)
-                    thresh.reached = True
-                    self.__prev_triggered = curr_temp
-
-        # When curr temperature is not within the fluctuations area of the previously triggered temperature,
-        # reset the state of threshold for the next trigger
-        elif self.__prev_triggered is not None and abs(curr_temp-self.__prev_triggered) - self.__fluctuations_temp>1E-5:
-            for thresh in self.thresholds[self.__prev_triggered]:
-                thresh.reached = False
-            self.__prev_triggered = None
-
-        # If nothing has been printed, just print the temperature that was read
-        if not result:
-            s = "%.1f%s" % (output_temp, self.output_unit.value)
-            result.append(s)
-    
         self.__prev_data = curr_temp  # Update previous data variable
-        return result
+        return EventKind.READING, curr_temp, triggered
+
+    '''
+    Read a block of readings at once, giving the same result as calling read on every (values[i], units[i]) in order.
+    values is an array of temperatures, units is an array of unit strings or bytes (or a single unit for the whole block).
+    Readings with an invalid unit or a NaN or infinite temperature are skipped, just like read does. timestamps is an
+    optional array of the times of the readings in seconds, used by the rolling statistics and the cooldown.
+    Return 2 arrays (sample_index, threshold_id): threshold with Threshold.id threshold_id[j] has been triggered at values[sample_index[j]]
+    '''
+    def read_many(self, values, units, timestamps=None):
+        temps, samples = self.convert_many(values, units)
+        if self.lock is not None:
+            with self.lock:
+                return self.__read_many(values, units, temps, samples, timestamps)
+        return self.__read_many(values, units, temps, samples, timestamps)
+
+    def __read_many(self, values, units, temps, samples, timestamps):
+        if self.metrics is not None:
+            is_c, is_f = Temperature.unit_masks(units, np.shape(values))
+            self.metrics.readings += len(is_c)
+            self.metrics.invalid_units += len(is_c) - int((is_c | is_f).sum())
+        return self.read_converted(temps, samples, timestamps=timestamps)
+
+    '''
+    Convert a block of readings to stored temperatures, as read_many does.
+    Return (temps, samples): temps are the stored temperatures of the readings with a valid unit, samples their indices in values
+    '''
+    def convert_many(self, values, units):
+        if np is None:
+            raise ImportError("numpy is required for read_many")
+
+        values = np.asarray(values, dtype=np.float64)
+        is_c, is_f = Temperature.unit_masks(units, values.shape)
 
+        # Convert every reading to the stored unit in one pass, dropping invalid readings
+        temps = values.copy()
+        if self.__store_mode == TemperatureUnit.CELCIUS:
+            temps[is_f] = Temperature.convert_fahrenheit_to_celcius(values[is_f])
+        else:
+            temps[is_c] = Temperature.convert_celcius_to_fahrenheit(values[is_c])
+        samples = np.flatnonzero((is_c | is_f) & np.isfinite(values))
+        temps = temps[samples]
+        if self.__scale:
+            temps = np.rint(temps * self.__scale).astype(np.int64)
+        return temps, samples
+
+    '''
+    Find readings that cross at least one of the sorted keys, same ranges as __crossed_keys.
+    Return (crossing, lo, hi): indices of these readings, and for every reading the range keys[lo:hi] it crosses
+    '''
+    @staticmethod
+    def crossing_readings(keys, prevs, temps):
+        keys = np.asarray(keys, dtype=temps.dtype)
+        up, down = prevs < temps, prevs > temps
+        lo = np.where(up, np.searchsorted(keys, prevs, 'right'), np.searchsorted(keys, temps, 'left'))
+        hi = np.where(down, np.searchsorted(keys, prevs, 'left'), np.searchsorted(keys, temps, 'right'))
+        return np.flatnonzero(hi > lo), lo, hi
+
+    '''
+    Read stored temperatures returned by convert_many, return the same arrays as read_many.
+    crossing could be given as the sorted indices in temps of the readings crossing at least one threshold of this
+    thermometer, when they are already known (i.e. shared between configurations by backtest)
+    '''
+    def read_converted(self, temps, samples, crossing=None, timestamps=None):
+        if self.rolling is not None:
+            self.rolling.add_many(temps, np.asarray(timestamps)[samples] if timestamps is not None else None)
 
+        sample_index, threshold_id = [], []
+        if len(temps) == 0:
+            return np.array(sample_index, dtype=np.int64), np.array(threshold_id, dtype=np.int64)
 
+        prevs = np.empty_like(temps)
+        prevs[0] = temps[0] if self.__prev_data is None else self.__prev_data
+        prevs[1:] = temps[:-1]
 
+        if crossing is None:
+            crossing = Thermometer.crossing_readings(self.__keys, prevs, temps)[0]
 
+        start = 0
+        for i in crossing.tolist() + [len(temps)]:
+            # Readings between crossings could only reset the reached thresholds, the lowest and highest ones decide
+            if self.__triggered and start < i:
+                self.__release_triggered(temps[start:i].min().item(), temps[start:i].max().item())
+            if i == len(temps):
+                break
 
+            self.__prev_data = prevs[i].item()
+            curr_temp = temps[i].item()
+            self.__now = float(timestamps[samples[i]]) if timestamps is not None else None
+            if self.__triggered:
+                self.__release_triggered(curr_temp, curr_temp)
+            for key, thresh in self.__trigger(self.__crossed_keys(self.__prev_data, curr_temp), curr_temp):
+                sample_index.append(samples[i])
+                threshold_id.append(thresh.id)
+                if self.metrics is not None:
+                    self.metrics.triggers[thresh.name] += 1
+                if self.dispatcher is not None:
+                    self.dispatcher.dispatch(Event(EventKind.THRESHOLD, self.__unscale(key), self.__store_mode, self.output_unit, thresh))
+            start = i + 1
 
+        self.__prev_data = temps[-1].item()
+        return np.array(sample_index, dtype=np.int64), np.array(threshold_id, dtype=np.int64)
@@ -0,0 +1,46 @@
+from classes import Event, EventKind
+
+'''
+Merge repeated triggers of the same threshold into one event, to cut the number of events of noisy sensors.
+
+The first trigger of a threshold opens a window of window seconds, the following triggers of that threshold in the
+window are merged into it, and the window is emitted as a single Event when it ends, with count the number of triggers.
+Windows end when a later event (or flush) shows that their time has passed, so an event is delayed by at most window
+seconds. Other events (readings, invalid units) are not merged and returned at once.
+
+Triggers of different thermometers could be merged separately by giving a key (i.e. the sensor id) to add.
+'''
+class EventCoalescer:
+    def __init__(self, window):
+        self.window = window
+        self.__windows = {}  # {(key, threshold id): [end time, first event, count]}, in the order they were opened
+
+    '''
+    Add an event that happened at timestamp (in seconds), return the events ready to be emitted
+    '''
+    def add(self, event, timestamp, key=None):
+        ready = self.flush(timestamp)
+        if event.kind != EventKind.THRESHOLD:
+            ready.append(event)
+            return ready
+
+        window = self.__windows.get((key, event.threshold.id))
+        if window is None:
+            self.__windows[(key, event.threshold.id)] = [timestamp + self.window, event, 1]
+        else:
+            window[2] += 1
+        return ready
+
+    '''
+    Return the merged events of the windows ended at now, or of every window if now is None
+    '''
+    def flush(self, now=None):
+        ready = []
+        while self.__windows:
+            window_key = next(iter(self.__windows))
+            end, event, count = self.__windows[window_key]
+            if now is not None and end > now:
+                break  # Windows are opened in the order of the timestamps, the next ones are not ended either
+            del self.__windows[window_key]
+            ready.append(Event(event.kind, event.temperature, event.store_unit, event.output_unit, event.threshold, count))
+        return ready
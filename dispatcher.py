@@ -0,0 +1,142 @@
+import threading
+from collections import deque
+from enum import Enum
+
+'''
+What to do with a triggered threshold when the queue of its worker is full
+'''
+class OverflowPolicy(Enum):
+    DROP = 'drop'  # Forget the new event
+    COALESCE = 'coalesce'  # Replace the event of the same threshold waiting in the queue by the new one, drop it if there is none
+    BLOCK = 'block'  # Wait for room in the queue, this slows down read until the callbacks catch up
+
+
+'''
+Run callbacks of thresholds on a pool of worker threads, so slow callbacks (paging, writing to a database...)
+do not block the thermometers reading temperatures.
+
+Thresholds are immutable and shared by many thermometers, so callbacks are registered here with subscribe(threshold, callback),
+and a thermometer dispatches its triggered thresholds to the dispatcher attached to it (see attach).
+Callbacks are called with the Event of the trigger. Every threshold is always handled by the same worker,
+so the callbacks of a threshold are called in the order of its triggers, one at a time.
+
+Each worker has a queue of at most queue_size events, the overflow policy decides what happens when it is full.
+Exceptions raised by callbacks are counted in errors, the last one is kept in error.
+'''
+class CallbackDispatcher:
+    def __init__(self, workers=4, queue_size=1024, policy=OverflowPolicy.DROP):
+        self.queue_size = queue_size
+        self.policy = OverflowPolicy(policy)
+
+        self.dispatched = 0  # Events put in a queue
+        self.dropped = 0  # Events forgotten because a queue was full
+        self.coalesced = 0  # Events that replaced a waiting event of the same threshold
+        self.errors = 0  # Exceptions raised by callbacks
+        self.error = None
+
+        self.__callbacks = {}  # {threshold id: (callbacks, ...)}
+        self.__conditions = [threading.Condition() for _ in range(workers)]
+        self.__queues = [deque() for _ in range(workers)]  # [[threshold id, event], ...] of every worker
+        self.__waiting = [{} for _ in range(workers)]  # {threshold id: its last entry in the queue} of every worker, to coalesce
+        self.__busy = [0] * workers  # Number of events a worker is handling (0 or 1)
+        self.__stopped = False
+        self.__threads = [threading.Thread(target=self.__work, args=(i,), name='threshold-callbacks-%d' % i, daemon=True)
+                          for i in range(workers)]
+        for thread in self.__threads:
+            thread.start()
+
+    def subscribe(self, threshold, callback):
+        self.__callbacks[threshold.id] = self.__callbacks.get(threshold.id, ()) + (callback,)
+
+    def unsubscribe(self, threshold, callback):
+        callbacks = tuple(c for c in self.__callbacks.get(threshold.id, ()) if c != callback)
+        if callbacks:
+            self.__callbacks[threshold.id] = callbacks
+        else:
+            self.__callbacks.pop(threshold.id, None)
+
+    '''
+    Dispatch the triggered thresholds of thermometer to this dispatcher
+    '''
+    def attach(self, thermometer):
+        thermometer.dispatcher = self
+        return thermometer
+
+    @staticmethod
+    def detach(thermometer):
+        thermometer.dispatcher = None
+        return thermometer
+
+    '''
+    Queue a threshold Event for the callbacks of its threshold, called by the thermometers
+    '''
+    def dispatch(self, event):
+        threshold_id = event.threshold.id
+        if threshold_id not in self.__callbacks:
+            return
+        worker = threshold_id % len(self.__queues)
+        queue, waiting, condition = self.__queues[worker], self.__waiting[worker], self.__conditions[worker]
+        with condition:
+            if len(queue) >= self.queue_size:
+                if self.policy == OverflowPolicy.BLOCK:
+                    while len(queue) >= self.queue_size and not self.__stopped:
+                        condition.wait()
+                elif self.policy == OverflowPolicy.COALESCE and threshold_id in waiting:
+                    waiting[threshold_id][1] = event
+                    self.coalesced += 1
+                    return
+                else:
+                    self.dropped += 1
+                    return
+            entry = [threshold_id, event]
+            queue.append(entry)
+            waiting[threshold_id] = entry
+            self.dispatched += 1
+            condition.notify_all()
+
+    '''
+    Wait until every queued event has been handled
+    '''
+    def join(self):
+        for worker, condition in enumerate(self.__conditions):
+            with condition:
+                while self.__queues[worker] or self.__busy[worker]:
+                    condition.wait()
+
+    '''
+    Handle the queued events, then stop the workers
+    '''
+    def stop(self):
+        self.join()
+        self.__stopped = True
+        for condition in self.__conditions:
+            with condition:
+                condition.notify_all()
+        for thread in self.__threads:
+            thread.join()
+
+    def __work(self, worker):
+        queue, waiting, condition = self.__queues[worker], self.__waiting[worker], self.__conditions[worker]
+        while True:
+            with condition:
+                while not queue and not self.__stopped:
+                    condition.wait()
+                if not queue:
+                    return
+                entry = queue.popleft()
+                threshold_id, event = entry
+                if waiting.get(threshold_id) is entry:
+                    del waiting[threshold_id]
+                self.__busy[worker] = 1
+                condition.notify_all()  # Room for a blocked dispatch
+
+            for callback in self.__callbacks.get(threshold_id, ()):
+                try:
+                    callback(event)
+                except Exception as e:  # A failing callback should not stop the worker
+                    self.errors += 1
+                    self.error = e
+
+            with condition:
+                self.__busy[worker] = 0
+                condition.notify_all()
@@ -1,33 +1,27 @@
+import argparse
+import struct
+import sys
+import time
+
 from classes import Direction, Thermometer, Threshold, TemperatureUnit
 
-data_array = [
-    (1.5,'C'),
-    (1.0,'C'),
-    (0.5,'C'),
-    (0.0,'C'),
-    (-0.5,'C'),
-    (0.0,'C'),
-    (-0.5,'C'),
-    (32,'F'),
-    (0.5,'C'),
-    (0.0,'C'),
-    (1.0,'C'),
-    (0.5,'C'),
-    (0.0,'C'),
-    (-1.0,'C'),
-    (0.0,'C'),
-    (1.5,'C'),
-    (90.0,'C'),
-    (95.5,'C'),
-    (212.0,'F'),
-    (105.5,'C'),
-    (100.0,'C'),
-    (99.5,'C'),
-    (212.0,'F'),
-    (99,'C'),
-    (100.0,'C')]
-
-thresholds = [
+'''
+Read temperatures from stdin, a CSV file, a binary log or a legacy binary file, and print the output of the thermometer.
+Readings are streamed through a pipeline of generators (parse -> Thermometer.read_events -> format -> write),
+so memory use does not depend on the size of the input.
+
+CSV input has one reading per line: temperature,unit (i.e. 1.5,C)
+Binary log input (--format binlog) is a file written by binlog.LogWriter, the format of the other tools (see binlog.py)
+Legacy binary input (--format binary) is a headerless sequence of BINARY_RECORD records: temperature as little endian
+float64, followed by the unit character. It has no timestamp nor sensor id, and could not be read by binlog.LogReader
+'''
+
+BINARY_RECORD = struct.Struct('<dc')  # Legacy binary input, see binlog.py for the binary log
+READ_BLOCK = 1 << 20  # Number of bytes read from the input at once
+WRITE_BLOCK = 4096  # Number of output lines written at once
+
+# Thresholds used when none is given
+DEFAULT_THRESHOLDS = [
     Threshold('Freezing', 0.0, unit=TemperatureUnit.CELCIUS),
     Threshold('Boiling', 100.0,  unit=TemperatureUnit.CELCIUS),
     Threshold('Freezing 2', 0.0,  unit=TemperatureUnit.CELCIUS),
@@ -37,9 +31,174 @@ thresholds = [
     Threshold('Freezing Fahrenheit', 32.0, unit=TemperatureUnit.FAHRENHEIT, direction=Direction.LESSER)
     ]
 
-therm = Thermometer(thresholds, (0.5, 'C'), output_unit=TemperatureUnit.FAHRENHEIT)
 
-for data_pt in data_array:
-    result = therm.read(data_pt)
-    for r in result:
-        print (r)
+'''
+Parse CSV lines into (temperature, unit), lines that could not be parsed are counted in stats['skipped']
+'''
+def parse_csv(lines, stats):
+    for line in lines:
+        fields = line.split(',')
+        try:
+            yield (float(fields[0]), fields[1].strip())
+        except (ValueError, IndexError):
+            if line.strip():
+                stats['skipped'] += 1
+
+
+'''
+Parse a legacy binary file into (temperature, unit), see BINARY_RECORD
+'''
+def parse_binary(stream, stats):
+    rest = b''
+    while True:
+        block = stream.read(READ_BLOCK)
+        if not block:
+            break
+        block = rest + block
+        end = len(block) - len(block) % BINARY_RECORD.size
+        for temperature, unit in BINARY_RECORD.iter_unpack(block[:end]):
+            yield (temperature, unit.decode('ascii', 'replace'))
+        rest = block[end:]
+    if rest:
+        stats['skipped'] += 1
+
+
+'''
+Read the records of a binary log (see binlog.py) into ((temperature, unit), timestamp), READ_BLOCK records at a time
+'''
+def parse_binlog(records, stats):
+    for start in range(0, len(records), READ_BLOCK):
+        block = records[start:start + READ_BLOCK]
+        for temperature, unit, timestamp in zip(block['value'].tolist(), block['unit'].tolist(), block['timestamp'].tolist()):
+            yield (temperature, unit.decode('ascii', 'replace')), timestamp
+
+
+'''
+Feed readings to the thermometer and produce the output events, plain readings are only produced if readings is True.
+If timestamped is True, data_pts are (data_pt, timestamp)
+'''
+def read_all(thermometer, data_pts, stats, readings=True, timestamped=False):
+    if timestamped:
+        for data_pt, timestamp in data_pts:
+            stats['readings'] += 1
+            for event in thermometer.read_events(data_pt, readings, timestamp):
+                yield event
+        return
+    for data_pt in data_pts:
+        stats['readings'] += 1
+        for event in thermometer.read_events(data_pt, readings):
+            yield event
+
+
+def format_events(events):
+    for event in events:
+        yield str(event) + '\n'
+
+
+'''
+Write lines to out in blocks of WRITE_BLOCK lines
+'''
+def write_lines(lines, out):
+    buffer = []
+    for line in lines:
+        buffer.append(line)
+        if len(buffer) == WRITE_BLOCK:
+            out.write(''.join(buffer))
+            buffer = []
+    if buffer:
+        out.write(''.join(buffer))
+
+
+'''
+Parse a threshold given as NAME:VALUE:UNIT[:DIRECTION], i.e. Boiling:100:C:GREATER
+'''
+def parse_threshold(text):
+    fields = text.split(':')
+    if len(fields) not in (3, 4):
+        raise argparse.ArgumentTypeError("threshold should be NAME:VALUE:UNIT[:DIRECTION]")
+    try:
+        direction = Direction[fields[3].upper()] if len(fields) == 4 else Direction.ANY
+        return Threshold(fields[0], float(fields[1]), TemperatureUnit(fields[2].upper()), direction)
+    except (KeyError, ValueError):
+        raise argparse.ArgumentTypeError("invalid threshold %r" % text)
+
+
+'''
+Parse a temperature given as VALUEUNIT, i.e. 0.5C
+'''
+def parse_fluctuations(text):
+    try:
+        return (float(text[:-1]), TemperatureUnit(text[-1:].upper()).value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid fluctuations %r" % text)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Read temperatures and report when thresholds are reached")
+    parser.add_argument('input', nargs='?', default='-', help="input file, stdin when omitted or -")
+    parser.add_argument('--format', choices=['csv', 'binlog', 'binary'], default='csv',
+                        help="format of the input: csv, binlog (binary log of binlog.py, not from stdin) or binary "
+                             "(legacy float64 + unit records) (default: csv)")
+    parser.add_argument('--sensor', type=int, help="only read the readings of this sensor from a binary log, required "
+                                                  "if the log has readings of several sensors")
+    parser.add_argument('--threshold', type=parse_threshold, action='append', dest='thresholds', metavar='NAME:VALUE:UNIT[:DIRECTION]',
+                        help="threshold to monitor, could be repeated (default: freezing and boiling thresholds)")
+    parser.add_argument('--fluctuations', type=parse_fluctuations, default=(0.5, 'C'), metavar='VALUEUNIT',
+                        help="insignificant fluctuations (default: 0.5C)")
+    parser.add_argument('--output-unit', choices=['C', 'F'], default='F', type=str.upper, help="output unit (default: F)")
+    parser.add_argument('--events-only', action='store_true', help="only output triggered thresholds and invalid readings")
+    parser.add_argument('--quiet', action='store_true', help="do not report throughput")
+    args = parser.parse_args(argv)
+    if args.format == 'binlog' and args.input == '-':
+        parser.error("a binary log is memory mapped, it could not be read from stdin")
+    if args.sensor is not None and args.format != 'binlog':
+        parser.error("--sensor is only supported with --format binlog")
+    return args
+
+
+def main(argv=None, stdin=None, stdout=None, stderr=None):
+    args = parse_args(argv)
+    stdin = stdin or sys.stdin
+    stdout = stdout or sys.stdout
+    stderr = stderr or sys.stderr
+
+    thermometer = Thermometer(args.thresholds or DEFAULT_THRESHOLDS, args.fluctuations,
+                              output_unit=TemperatureUnit(args.output_unit))
+    stats = {'readings': 0, 'skipped': 0}
+
+    if args.format == 'binlog':
+        from binlog import LogReader, select_sensor
+        stream = LogReader(args.input)
+        try:
+            records = select_sensor(stream.records, args.sensor)
+        except ValueError as e:
+            stream.close()
+            stderr.write("%s with --sensor\n" % e)
+            return 2
+        data_pts = parse_binlog(records, stats)
+        del records  # Only the generator should hold a view of the memory map when it is closed
+    elif args.format == 'binary':
+        stream = stdin.buffer if args.input == '-' else open(args.input, 'rb')
+        data_pts = parse_binary(stream, stats)
+    else:
+        stream = stdin if args.input == '-' else open(args.input, buffering=READ_BLOCK)
+        data_pts = parse_csv(stream, stats)
+
+    start = time.perf_counter()
+    try:
+        events = read_all(thermometer, data_pts, stats, readings=not args.events_only, timestamped=args.format == 'binlog')
+        write_lines(format_events(events), stdout)
+    finally:
+        if args.input != '-':
+            stream.close()
+    elapsed = time.perf_counter() - start
+
+    if not args.quiet:
+        stderr.write("%d readings in %.2fs (%.0f readings/sec)\n" % (stats['readings'], elapsed, stats['readings'] / max(elapsed, 1E-9)))
+    if stats['skipped']:
+        stderr.write("%d lines could not be parsed\n" % stats['skipped'])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
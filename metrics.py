@@ -0,0 +1,185 @@
+import os
+import threading
+import time
+from collections import Counter
+
+from classes import EventKind
+
+'''
+Optional metrics of thermometers: number of readings, invalid units, triggers per threshold, triggers suppressed by
+the fluctuations, and a histogram of the time taken by read, measured on 1 of every sample_every readings.
+
+Thermometers count their readings themselves in the ThermometerCounters attached to them, while holding their own lock
+if locking is enabled, so a thermometer without metrics only checks that it has none.
+The same ThermometerMetrics could be attached to several thermometers to count them together: every thermometer gets
+its own counters, and they are added up when the metrics are read (i.e. exported).
+'''
+class ThermometerMetrics:
+    # Upper bounds of the latency histogram buckets, in seconds
+    BUCKETS = (1E-6, 2.5E-6, 5E-6, 1E-5, 2.5E-5, 5E-5, 1E-4, 2.5E-4, 1E-3, float('inf'))
+
+    def __init__(self, name='', sample_every=64):
+        self.name = name  # Exported as the thermometer label
+        self.sample_every = sample_every
+        self.__counters = []  # ThermometerCounters of every attached thermometer
+        self.__lock = threading.Lock()  # Only held to attach a thermometer, readings update their own counters
+
+    def attach(self, thermometer):
+        counters = ThermometerCounters(self.name, self.sample_every)
+        with self.__lock:
+            self.__counters.append(counters)
+        thermometer.metrics = counters
+        return thermometer
+
+    @staticmethod
+    def detach(thermometer):
+        thermometer.metrics = None
+        return thermometer
+
+    def __all_counters(self):
+        with self.__lock:
+            return list(self.__counters)
+
+    @property
+    def readings(self):
+        return sum(counters.readings for counters in self.__all_counters())
+
+    @property
+    def invalid_units(self):
+        return sum(counters.invalid_units for counters in self.__all_counters())
+
+    @property
+    def suppressed(self):
+        return sum(counters.suppressed for counters in self.__all_counters())
+
+    @property
+    def out_of_order(self):
+        return sum(counters.out_of_order for counters in self.__all_counters())
+
+    @property
+    def triggers(self):
+        triggers = Counter()
+        for counters in self.__all_counters():
+            triggers.update(dict(counters.triggers))  # Copying the dict is atomic, a reading could add a threshold meanwhile
+        return triggers
+
+    @property
+    def latency_buckets(self):
+        buckets = [0] * len(self.BUCKETS)
+        for counters in self.__all_counters():
+            for i, count in enumerate(counters.latency_buckets):
+                buckets[i] += count
+        return buckets
+
+    @property
+    def latency_sum(self):
+        return sum(counters.latency_sum for counters in self.__all_counters())
+
+    @property
+    def latency_count(self):
+        return sum(counters.latency_count for counters in self.__all_counters())
+
+
+'''
+Counters of one thermometer, updated by the thermometer itself while it reads (see Thermometer.read_events and read_many).
+They could be exported like ThermometerMetrics
+'''
+class ThermometerCounters:
+    BUCKETS = ThermometerMetrics.BUCKETS
+
+    def __init__(self, name='', sample_every=64):
+        self.name = name
+        self.sample_every = sample_every
+
+        self.readings = 0
+        self.invalid_units = 0
+        self.triggers = Counter()  # {threshold name: number of triggers}
+        self.suppressed = 0  # Thresholds not triggered again because the temperature is still in fluctuations
+        self.out_of_order = 0  # Readings ignored because a later reading was already applied
+        self.latency_buckets = [0] * len(self.BUCKETS)  # Number of sampled reads that took at most BUCKETS[i] seconds
+        self.latency_sum = 0.0
+        self.latency_count = 0
+
+    def observe_latency(self, seconds):
+        for i, bound in enumerate(self.BUCKETS):
+            if seconds <= bound:
+                self.latency_buckets[i] += 1
+                break
+        self.latency_sum += seconds
+        self.latency_count += 1
+
+    '''
+    Count a reading applied by apply(data_pt, timestamp), which returns (kind, stored temperature, triggered thresholds)
+    '''
+    def count(self, apply, data_pt, timestamp):
+        self.readings += 1
+        if self.readings % self.sample_every:
+            kind, temperature, triggered = apply(data_pt, timestamp)
+        else:
+            start = time.perf_counter()
+            kind, temperature, triggered = apply(data_pt, timestamp)
+            self.observe_latency(time.perf_counter() - start)
+        if triggered:
+            for _, thresh in triggered:
+                self.triggers[thresh.name] += 1
+        elif kind is EventKind.INVALID_UNIT:
+            self.invalid_units += 1
+        return kind, temperature, triggered
+
+
+'''
+Export metrics in the Prometheus text format to a file, the file is replaced at once so readers never see a partial dump.
+metrics_list could hold ThermometerMetrics and ThermometerCounters.
+Any object with an export(metrics_list) method could be used instead
+'''
+class PrometheusExporter:
+    def __init__(self, path, prefix='thermometer'):
+        self.path = path
+        self.prefix = prefix
+
+    @staticmethod
+    def __label(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    def format(self, metrics_list):
+        lines = []
+        def family(name, kind, description):
+            lines.append("# HELP %s_%s %s" % (self.prefix, name, description))
+            lines.append("# TYPE %s_%s %s" % (self.prefix, name, kind))
+
+        def sample(name, metrics, value, **labels):
+            labels = dict(thermometer=metrics.name, **labels)
+            text = ','.join('%s="%s"' % (key, self.__label(label)) for key, label in labels.items())
+            lines.append("%s_%s{%s} %s" % (self.prefix, name, text, value))
+
+        family('readings_total', 'counter', "Readings processed")
+        for metrics in metrics_list:
+            sample('readings_total', metrics, metrics.readings)
+        family('invalid_units_total', 'counter', "Readings with an invalid unit")
+        for metrics in metrics_list:
+            sample('invalid_units_total', metrics, metrics.invalid_units)
+        family('triggers_total', 'counter', "Thresholds triggered")
+        for metrics in metrics_list:
+            for threshold, count in sorted(dict(metrics.triggers).items()):
+                sample('triggers_total', metrics, count, threshold=threshold)
+        family('suppressed_total', 'counter', "Thresholds not triggered again because the temperature is still in fluctuations")
+        for metrics in metrics_list:
+            sample('suppressed_total', metrics, metrics.suppressed)
+        family('out_of_order_total', 'counter', "Readings ignored because a later reading was already applied")
+        for metrics in metrics_list:
+            sample('out_of_order_total', metrics, metrics.out_of_order)
+        family('read_seconds', 'histogram', "Time taken by sampled reads")
+        for metrics in metrics_list:
+            cumulative = 0
+            for bound, count in zip(metrics.BUCKETS, metrics.latency_buckets):
+                cumulative += count
+                sample('read_seconds_bucket', metrics, cumulative, le='+Inf' if bound == float('inf') else repr(bound))
+            sample('read_seconds_sum', metrics, repr(metrics.latency_sum))
+            sample('read_seconds_count', metrics, metrics.latency_count)
+        return '\n'.join(lines) + '\n'
+
+    def export(self, metrics_list):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            f.write(self.format(metrics_list))
+        os.replace(temp_path, self.path)
@@ -0,0 +1,144 @@
+import time
+from collections import deque
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed for add_many
+    np = None
+
+'''
+Statistics (min, max, mean, standard deviation) of the latest readings, updated in O(1) amortized time per reading.
+The window holds at most size readings, and if seconds is given, only readings of the last seconds.
+
+Readings are kept in a preallocated ring buffer. Mean and variance are updated with Welford's algorithm when a reading
+enters or leaves the window, min and max with monotonic deques of (sequence number, value).
+'''
+class RollingStats:
+    def __init__(self, size, seconds=None):
+        if size < 1:
+            raise ValueError("size should be at least 1")
+        self.size = size
+        self.seconds = seconds
+
+        self.__values = [0.0] * size  # Ring buffer, the reading with sequence number seq is at seq % size
+        self.__timestamps = [0.0] * size if seconds is not None else None
+        self.__seq = 0  # Sequence number of the next reading
+        self.count = 0  # Number of readings in the window, they are sequence numbers __seq-count to __seq-1
+
+        self.__mean = 0.0
+        self.__m2 = 0.0  # Sum of squared differences from the mean
+        self.__min = deque()  # Increasing values, the front is the minimum of the window
+        self.__max = deque()  # Decreasing values, the front is the maximum of the window
+
+    '''
+    Add a reading, timestamp (in seconds) is only used for time windows, it is time.monotonic() by default
+    '''
+    def add(self, value, timestamp=None):
+        if self.__timestamps is not None:
+            if timestamp is None:
+                timestamp = time.monotonic()
+            self.__expire(timestamp)
+            self.__timestamps[self.__seq % self.size] = timestamp
+        if self.count == self.size:
+            self.__remove_oldest()
+
+        seq = self.__seq
+        self.__values[seq % self.size] = value
+        self.__seq += 1
+        self.count += 1
+
+        delta = value - self.__mean
+        self.__mean += delta / self.count
+        self.__m2 += delta * (value - self.__mean)
+
+        while self.__min and self.__min[-1][1] >= value:
+            self.__min.pop()
+        self.__min.append((seq, value))
+        while self.__max and self.__max[-1][1] <= value:
+            self.__max.pop()
+        self.__max.append((seq, value))
+
+    '''
+    Add a block of readings (NumPy arrays). The window is rebuilt from its last readings with array operations,
+    so the cost does not depend on the number of readings in the block beyond the window size
+    '''
+    def add_many(self, values, timestamps=None):
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return
+        if self.__timestamps is not None:
+            if timestamps is None:
+                timestamps = np.full(len(values), time.monotonic())
+            timestamps = np.asarray(timestamps, dtype=np.float64)
+            self.__expire(float(timestamps[-1]))
+
+        # Readings of the window that could stay in it, followed by the block, keeping at most size readings
+        keep = max(0, min(self.count, self.size - len(values)))
+        old_seqs = range(self.__seq - keep, self.__seq)
+        seqs = np.arange(self.__seq - keep, self.__seq + len(values))[-self.size:]
+        window = np.concatenate([[self.__values[seq % self.size] for seq in old_seqs], values])[-self.size:]
+        if self.__timestamps is not None:
+            old_timestamps = [self.__timestamps[seq % self.size] for seq in old_seqs]
+            window_timestamps = np.concatenate([old_timestamps, timestamps])[-self.size:]
+            recent = window_timestamps > window_timestamps[-1] - self.seconds
+            seqs, window, window_timestamps = seqs[recent], window[recent], window_timestamps[recent]
+            for seq, timestamp in zip(seqs.tolist(), window_timestamps.tolist()):
+                self.__timestamps[seq % self.size] = timestamp
+
+        self.__seq += len(values)
+        self.count = len(window)
+        for seq, value in zip(seqs.tolist(), window.tolist()):
+            self.__values[seq % self.size] = value
+
+        self.__mean = float(window.mean())
+        self.__m2 = float(((window - self.__mean) ** 2).sum())
+        # A reading stays in the min deque while no later reading is smaller or equal (greater or equal for max)
+        later_min = np.append(np.minimum.accumulate(window[::-1])[::-1][1:], np.inf)
+        later_max = np.append(np.maximum.accumulate(window[::-1])[::-1][1:], -np.inf)
+        self.__min = deque(zip(seqs[window < later_min].tolist(), window[window < later_min].tolist()))
+        self.__max = deque(zip(seqs[window > later_max].tolist(), window[window > later_max].tolist()))
+
+    '''
+    Drop readings older than seconds before now
+    '''
+    def __expire(self, now):
+        while self.count and self.__timestamps[(self.__seq - self.count) % self.size] <= now - self.seconds:
+            self.__remove_oldest()
+
+    def __remove_oldest(self):
+        seq = self.__seq - self.count
+        value = self.__values[seq % self.size]
+        self.count -= 1
+        if self.count == 0:
+            self.__mean = self.__m2 = 0.0
+        else:
+            delta = value - self.__mean
+            self.__mean -= delta / self.count
+            self.__m2 -= delta * (value - self.__mean)
+        if self.__min[0][0] == seq:
+            self.__min.popleft()
+        if self.__max[0][0] == seq:
+            self.__max.popleft()
+
+    @property
+    def min(self):
+        return self.__min[0][1] if self.count else None
+
+    @property
+    def max(self):
+        return self.__max[0][1] if self.count else None
+
+    @property
+    def mean(self):
+        return self.__mean if self.count else None
+
+    '''
+    Population variance of the readings in the window
+    '''
+    @property
+    def variance(self):
+        return max(self.__m2, 0.0) / self.count if self.count else None
+
+    @property
+    def stddev(self):
+        return self.variance ** 0.5 if self.count else None
@@ -0,0 +1,262 @@
+import argparse
+import asyncio
+import sys
+import time
+import zlib
+from collections import deque
+from random import Random
+
+from classes import EventKind, Thermometer, TemperatureUnit
+from main import DEFAULT_THRESHOLDS
+
+'''
+asyncio service that receives readings from live sensor feeds and reports triggered thresholds.
+
+Readings are text lines sensor_id,temperature,unit (i.e. boiler-1,99.5,C), sent over TCP, a Unix socket or UDP
+(a datagram could hold several lines). Each sensor gets its own Thermometer, copied from a template thermometer.
+
+Readings are routed to a fixed number of shards by sensor id. Every shard has a bounded input queue and a single worker,
+so the readings of a sensor are processed in the order they arrived. Triggered thresholds are put on the bounded
+events queue as (sensor_id, Event). When a queue is full, stream connections stop being read until there is room again
+(backpressure), while UDP readings are dropped and counted, since UDP senders could not be slowed down.
+'''
+class IngestionService:
+    def __init__(self, template, shards=4, queue_size=1024, events_size=1024, latency_samples=100000):
+        self.template = template  # Thermometer copied for every new sensor
+        self.thermometers = {}  # {sensor_id: Thermometer}
+        self.events = asyncio.Queue(events_size)  # (sensor_id, Event) of triggered thresholds
+
+        self.__inputs = [asyncio.Queue(queue_size) for _ in range(shards)]
+        self.__workers = []
+        self.__servers = []
+        self.stats = {'readings': 0, 'events': 0, 'invalid': 0, 'dropped': 0}
+        # Seconds from arrival of a reading to its events being put on the events queue, for the latest events
+        self.latencies = deque(maxlen=latency_samples)
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self.__workers = [loop.create_task(self.__work(queue)) for queue in self.__inputs]
+
+    async def stop(self):
+        for server in self.__servers:
+            server.close()
+            if hasattr(server, 'wait_closed'):
+                await server.wait_closed()
+        for worker in self.__workers:
+            worker.cancel()
+        await asyncio.gather(*self.__workers, return_exceptions=True)
+        self.__servers, self.__workers = [], []
+
+    '''
+    Wait until every reading received so far has been processed
+    '''
+    async def join(self):
+        for queue in self.__inputs:
+            await queue.join()
+
+    def __shard(self, sensor_id):
+        return self.__inputs[zlib.crc32(sensor_id.encode()) % len(self.__inputs)]
+
+    '''
+    Feed one reading data_pt = (temperature, unit) of a sensor, waiting while its shard is full
+    '''
+    async def feed(self, sensor_id, data_pt, arrival=None):
+        await self.__shard(sensor_id).put((sensor_id, data_pt, arrival or time.perf_counter()))
+
+    '''
+    Feed one reading without waiting, return False and drop the reading if its shard is full
+    '''
+    def feed_nowait(self, sensor_id, data_pt, arrival=None):
+        try:
+            self.__shard(sensor_id).put_nowait((sensor_id, data_pt, arrival or time.perf_counter()))
+            return True
+        except asyncio.QueueFull:
+            self.stats['dropped'] += 1
+            return False
+
+    '''
+    Parse a line sensor_id,temperature,unit into (sensor_id, (temperature, unit)), None if it could not be parsed
+    '''
+    def parse(self, line):
+        fields = line.split(',')
+        try:
+            return fields[0].strip(), (float(fields[1]), fields[2].strip())
+        except (ValueError, IndexError):
+            if line.strip():
+                self.stats['invalid'] += 1
+            return None
+
+    async def __work(self, queue):
+        while True:
+            sensor_id, data_pt, arrival = await queue.get()
+            try:
+                thermometer = self.thermometers.get(sensor_id)
+                if thermometer is None:
+                    thermometer = self.thermometers[sensor_id] = self.template.copy()
+                self.stats['readings'] += 1
+                for event in thermometer.read_events(data_pt, readings=False):
+                    if event.kind in (EventKind.INVALID_UNIT, EventKind.INVALID_TEMPERATURE):
+                        self.stats['invalid'] += 1
+                        continue
+                    await self.events.put((sensor_id, event))
+                    self.stats['events'] += 1
+                    self.latencies.append(time.perf_counter() - arrival)
+            finally:
+                queue.task_done()
+
+    async def __handle_stream(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                reading = self.parse(line.decode('ascii', 'replace'))
+                if reading is not None:
+                    await self.feed(*reading)
+        finally:
+            writer.close()
+
+    async def serve_tcp(self, host, port):
+        server = await asyncio.start_server(self.__handle_stream, host, port)
+        self.__servers.append(server)
+        return server
+
+    async def serve_unix(self, path):
+        server = await asyncio.start_unix_server(self.__handle_stream, path)
+        self.__servers.append(server)
+        return server
+
+    async def serve_udp(self, host, port):
+        service = self
+
+        class Protocol(asyncio.DatagramProtocol):
+            def datagram_received(self, data, addr):
+                arrival = time.perf_counter()
+                for line in data.decode('ascii', 'replace').splitlines():
+                    reading = service.parse(line)
+                    if reading is not None:
+                        service.feed_nowait(*reading, arrival)
+
+        transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(Protocol, local_addr=(host, port))
+        self.__servers.append(transport)
+        return transport
+
+
+'''
+Return the p-th percentile (0 to 100) of values
+'''
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return float('nan')
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+'''
+Generate readings for a number of sensors, each one oscillating around the freezing point so thresholds are triggered.
+Yield (sensor number, line sensor_id,temperature,unit)
+'''
+def generate_readings(sensors, count, seed=0):
+    rand = Random(seed)
+    temps = [rand.uniform(-5.0, 5.0) for _ in range(sensors)]
+    for i in range(count):
+        sensor = i % sensors
+        temps[sensor] += rand.uniform(-1.0, 1.0)
+        if abs(temps[sensor]) > 5.0:
+            temps[sensor] /= 2
+        yield sensor, "sensor-%d,%.2f,C\n" % (sensor, temps[sensor])
+
+
+'''
+Send count readings of the given number of sensors over a number of connections made with open_connection,
+a sensor always uses the same connection so its readings stay in order
+'''
+async def generate_load(open_connection, sensors=1000, count=100000, connections=10, batch=100):
+    writers = [(await open_connection())[1] for _ in range(connections)]
+    buffers = [[] for _ in range(connections)]
+    for sensor, line in generate_readings(sensors, count):
+        buffer = buffers[sensor % connections]
+        buffer.append(line)
+        if len(buffer) == batch:
+            writers[sensor % connections].write(''.join(buffer).encode())
+            buffer.clear()
+            await writers[sensor % connections].drain()
+    for writer, buffer in zip(writers, buffers):
+        writer.write(''.join(buffer).encode())
+        await writer.drain()
+        writer.close()
+        await writer.wait_closed()
+
+
+'''
+Run the service on a local TCP port, send it load from the load generator, and report throughput and latency
+'''
+async def run_load(sensors, count, connections, out):
+    service = IngestionService(Thermometer(DEFAULT_THRESHOLDS, (0.5, 'C')))
+    await service.start()
+    server = await service.serve_tcp('127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+
+    async def consume():
+        while True:
+            await service.events.get()
+
+    consumer = asyncio.get_running_loop().create_task(consume())
+    start = time.perf_counter()
+    await generate_load(lambda: asyncio.open_connection('127.0.0.1', port), sensors, count, connections)
+    # Readings could still be in the socket buffers after the generator is done
+    while service.stats['readings'] < count:
+        await asyncio.sleep(0.01)
+    await service.join()
+    elapsed = time.perf_counter() - start
+    consumer.cancel()
+    await service.stop()
+
+    out.write("%d readings, %d events in %.2fs (%.0f readings/sec)\n" %
+              (service.stats['readings'], service.stats['events'], elapsed, service.stats['readings'] / elapsed))
+    out.write("latency p50 %.3fms, p99 %.3fms\n" %
+              (percentile(service.latencies, 50) * 1000, percentile(service.latencies, 99) * 1000))
+    return service
+
+
+async def serve(args, out):
+    service = IngestionService(Thermometer(DEFAULT_THRESHOLDS, (0.5, 'C'), output_unit=TemperatureUnit(args.output_unit)))
+    await service.start()
+    if args.tcp:
+        host, port = args.tcp.rsplit(':', 1)
+        await service.serve_tcp(host, int(port))
+    if args.udp:
+        host, port = args.udp.rsplit(':', 1)
+        await service.serve_udp(host, int(port))
+    if args.unix:
+        await service.serve_unix(args.unix)
+
+    while True:
+        sensor_id, event = await service.events.get()
+        out.write("%s: %s\n" % (sensor_id, event))
+        out.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Receive live sensor readings and report triggered thresholds")
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve_parser = commands.add_parser('serve', help="receive readings and print triggered thresholds")
+    serve_parser.add_argument('--tcp', metavar='HOST:PORT')
+    serve_parser.add_argument('--udp', metavar='HOST:PORT')
+    serve_parser.add_argument('--unix', metavar='PATH')
+    serve_parser.add_argument('--output-unit', choices=['C', 'F'], default='C', type=str.upper)
+    load_parser = commands.add_parser('load', help="run the service locally under generated load and report latency")
+    load_parser.add_argument('--sensors', type=int, default=1000)
+    load_parser.add_argument('--readings', type=int, default=200000)
+    load_parser.add_argument('--connections', type=int, default=10)
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        asyncio.run(serve(args, sys.stdout))
+    else:
+        asyncio.run(run_load(args.sensors, args.readings, args.connections, sys.stdout))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,213 @@
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+import zlib
+
+import numpy as np
+
+from classes import Event, EventKind, Thermometer
+from main import DEFAULT_THRESHOLDS
+
+'''
+Evaluate readings of many sensors on several processes. Sensors are partitioned across worker processes by sensor id,
+every worker owns the Thermometer of its sensors (copied from a template thermometer), so their state stays in the worker
+between batches. Readings are sent to the workers in batches, and the triggered thresholds are merged back in the order
+of the readings, which keeps the events of every sensor in order.
+
+Batches are partitioned and merged with array operations, and sent as arrays, so the parent process only does Python
+work per distinct sensor and per event, not per reading.
+'''
+class ShardedExecutor:
+    def __init__(self, template, workers=None):
+        self.template = template
+        self.workers = workers or os.cpu_count() or 1
+        # Thresholds of the template by id, used to rebuild the events sent back by the workers
+        self.__thresholds = {thresh.id: thresh for thresholds in template.thresholds.values() for thresh in thresholds}
+        self.__shards = {}  # {sensor_id: worker}, cache of shard
+
+        self.__connections = []
+        self.__processes = []
+        for _ in range(self.workers):
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_work, args=(template, child), daemon=True)
+            process.start()
+            child.close()
+            self.__connections.append(parent)
+            self.__processes.append(process)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for connection in self.__connections:
+            connection.send(None)
+            connection.close()
+        for process in self.__processes:
+            process.join()
+        self.__connections, self.__processes = [], []
+
+    '''
+    Worker owning a sensor id
+    '''
+    def shard(self, sensor_id):
+        return zlib.crc32(str(sensor_id).encode()) % self.workers
+
+    '''
+    Read a batch of readings, readings[i] is (sensor_id, (temperature, unit)).
+    Return the triggered thresholds and invalid readings as a list of (i, sensor_id, Event), in the order of the readings
+    '''
+    def read(self, readings):
+        return self.read_arrays([sensor_id for sensor_id, _ in readings], [data_pt[0] for _, data_pt in readings],
+                                [data_pt[1] for _, data_pt in readings])
+
+    '''
+    Read a batch of readings given as arrays (i.e. the columns of a binary log): reading i is (values[i], units[i])
+    of sensor sensor_ids[i]. Return the same list as read
+    '''
+    def read_arrays(self, sensor_ids, values, units):
+        sensor_ids = np.asarray(sensor_ids)
+        values = np.asarray(values, dtype=np.float64)
+        units = np.asarray(units)
+        if units.dtype.kind == 'S':
+            units = units.astype('U')  # Thermometer.read_events only accepts str units
+
+        # Find the worker of every distinct sensor once, then of every reading with an array lookup
+        sensors, inverse = np.unique(sensor_ids, return_inverse=True)
+        shards = np.array([self.__shard(sensor_id) for sensor_id in sensors.tolist()], dtype=np.intp)
+        reading_shards = shards[inverse.reshape(-1)]
+        # A stable sort keeps the readings of every worker in order
+        order = np.argsort(reading_shards, kind='stable')
+        bounds = np.cumsum(np.bincount(reading_shards, minlength=self.workers))
+
+        # Send every batch first so the workers run in parallel, then collect the results
+        start = 0
+        for connection, end in zip(self.__connections, bounds.tolist()):
+            indices = order[start:end]
+            connection.send((indices, sensor_ids[indices], values[indices], units[indices]))
+            start = end
+        results = [connection.recv() for connection in self.__connections]
+
+        indices = np.concatenate([result[0] for result in results])
+        kinds = np.concatenate([result[1] for result in results])
+        temperatures = np.concatenate([result[2] for result in results])
+        threshold_ids = np.concatenate([result[3] for result in results])
+        event_units = next((result[4] for result in results if result[4] is not None), None)
+        # Events of a reading all come from the same worker, in order, so a stable sort keeps them in order
+        order = np.argsort(indices, kind='stable')
+
+        events = []
+        threshold_kind = EventKind.THRESHOLD.value
+        for i, sensor_id, kind, temperature, threshold_id in zip(indices[order].tolist(), sensor_ids[indices[order]].tolist(),
+                                                                 kinds[order].tolist(), temperatures[order].tolist(),
+                                                                 threshold_ids[order].tolist()):
+            if kind != threshold_kind:
+                events.append((i, sensor_id, Event(EventKind(kind))))
+            else:
+                events.append((i, sensor_id, Event(EventKind.THRESHOLD, temperature, event_units[0], event_units[1],
+                                                   self.__thresholds[threshold_id])))
+        return events
+
+    def __shard(self, sensor_id):
+        shard = self.__shards.get(sensor_id)
+        if shard is None:
+            shard = self.__shards[sensor_id] = self.shard(sensor_id)
+        return shard
+
+    '''
+    Read an iterable of (sensor_id, (temperature, unit)) in batches of batch_size readings,
+    yield (i, sensor_id, Event) like read, i counting from the start of the iterable
+    '''
+    def read_stream(self, readings, batch_size=10000):
+        batch = []
+        offset = 0
+        for reading in readings:
+            batch.append(reading)
+            if len(batch) == batch_size:
+                for i, sensor_id, event in self.read(batch):
+                    yield offset + i, sensor_id, event
+                offset += len(batch)
+                batch = []
+        if batch:
+            for i, sensor_id, event in self.read(batch):
+                yield offset + i, sensor_id, event
+
+
+'''
+Worker process, reads batches of arrays (indices, sensor_ids, values, units) from connection and sends back its events as
+arrays (indices, kinds, temperatures, threshold ids) with the (store unit, output unit) of the threshold events, which
+are much cheaper to send than Event objects
+'''
+def _work(template, connection):
+    thermometers = {}
+    while True:
+        batch = connection.recv()
+        if batch is None:
+            break
+        indices, kinds, temperatures, threshold_ids = [], [], [], []
+        event_units = None
+        for i, sensor_id, value, unit in zip(*(array.tolist() for array in batch)):
+            thermometer = thermometers.get(sensor_id)
+            if thermometer is None:
+                thermometer = thermometers[sensor_id] = template.copy()
+            for event in thermometer.read_events((value, unit), readings=False):
+                indices.append(i)
+                kinds.append(event.kind.value)
+                if event.kind != EventKind.THRESHOLD:
+                    temperatures.append(0.0)
+                    threshold_ids.append(-1)
+                else:
+                    temperatures.append(event.temperature)
+                    threshold_ids.append(event.threshold.id)
+                    event_units = (event.store_unit, event.output_unit)
+        connection.send((np.array(indices, dtype=np.intp), np.array(kinds, dtype=np.int8),
+                         np.array(temperatures, dtype=np.float64), np.array(threshold_ids, dtype=np.int64), event_units))
+    connection.close()
+
+
+'''
+Generate readings for a fleet of sensors, each sensor slowly oscillating around the freezing point
+'''
+def generate_readings(sensors, count):
+    for i in range(count):
+        sensor = i % sensors
+        yield sensor, (((i // sensors) % 20 - 10) / 4.0 + sensor % 3, 'C')
+
+
+'''
+Measure readings/sec with 1 worker up to the given number of workers
+'''
+def benchmark(max_workers, sensors, count, batch_size, out):
+    template = Thermometer(DEFAULT_THRESHOLDS, (0.5, 'C'))
+    sensor_ids, data_pts = zip(*generate_readings(sensors, count))
+    sensor_ids = np.array(sensor_ids)
+    values, units = np.array([data_pt[0] for data_pt in data_pts]), np.array([data_pt[1] for data_pt in data_pts])
+    base = None
+    for workers in range(1, max_workers + 1):
+        with ShardedExecutor(template, workers) as executor:
+            start = time.perf_counter()
+            for i in range(0, count, batch_size):
+                executor.read_arrays(sensor_ids[i:i + batch_size], values[i:i + batch_size], units[i:i + batch_size])
+            elapsed = time.perf_counter() - start
+        rate = count / elapsed
+        base = base or rate
+        out.write("%2d workers: %10.0f readings/sec, speedup %.2fx\n" % (workers, rate, rate / base))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark sharded evaluation of readings across processes")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="maximum number of workers")
+    parser.add_argument('--sensors', type=int, default=10000)
+    parser.add_argument('--readings', type=int, default=1000000)
+    parser.add_argument('--batch-size', type=int, default=50000)
+    args = parser.parse_args(argv)
+    benchmark(args.workers, args.sensors, args.readings, args.batch_size, sys.stdout)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
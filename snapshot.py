@@ -0,0 +1,295 @@
+import os
+import threading
+
+import numpy as np
+
+from classes import Direction, Thermometer, Threshold, TemperatureUnit
+
+'''
+Save the thresholds, units, fluctuations and trigger state of many thermometers in one compact binary file,
+and restore them quickly after a restart.
+
+The file is a HEADER followed by NumPy arrays: the threshold catalog (every distinct threshold once), the threshold
+lists (every distinct list of thresholds once, as indices in the catalog), the thermometers, the reached thresholds
+of every thermometer, their threshold values, the last triggers of thresholds with a cooldown, and the utf-8 names
+of thresholds and thermometers. Thermometers using the same thresholds are restored as copies of each other (see
+Thermometer.copy), so restoring thousands of them takes milliseconds.
+'''
+
+MAGIC = b'THERMSNP'
+VERSION = 3
+HEADER = np.dtype([('magic', 'S8'), ('version', '<u1'), ('reserved', 'V7'), ('thresholds', '<u8'), ('lists', '<u8'),
+                   ('members', '<u8'), ('thermometers', '<u8'), ('reached', '<u8'), ('triggered', '<u8'),
+                   ('last_triggered', '<u8'), ('names_size', '<u8')])
+THRESHOLD = np.dtype([('id', '<i8'), ('direction', '<i1'), ('thresh_val_c', '<f8'), ('thresh_val_f', '<f8'),
+                      ('name_offset', '<u8'), ('name_size', '<u4')])
+THRESHOLD_LIST = np.dtype([('start', '<u8'), ('count', '<u4')])
+THERMOMETER = np.dtype([('key_offset', '<u8'), ('key_size', '<u4'), ('key_is_int', '<u1'), ('store_unit', '<u1'),
+                        ('output_unit', '<u1'), ('fluctuations_unit', '<u1'), ('fixed_point', '<u1'),
+                        ('fluctuations', '<f8'), ('prev_data', '<f8'), ('thresholds', '<u4'), ('reached_start', '<u8'),
+                        ('reached_count', '<u4'), ('triggered_start', '<u8'), ('triggered_count', '<u4'),
+                        ('cooldown', '<f8'), ('last_triggered_start', '<u8'), ('last_triggered_count', '<u4'),
+                        ('last_order', '<i8'), ('last_order_kind', '<u1')])
+LAST_TRIGGER = np.dtype([('threshold', '<i4'), ('timestamp', '<f8')])
+UNITS = [TemperatureUnit.CELCIUS, TemperatureUnit.FAHRENHEIT]
+# Kinds of last_order: sequence numbers are saved as integers, so they keep their precision above 2**53,
+# timestamps are saved as the bits of their float64
+ORDER_NONE, ORDER_INT, ORDER_FLOAT = 0, 1, 2
+
+
+def _encode_order(order):
+    if order is None:
+        return 0, ORDER_NONE
+    if isinstance(order, float):
+        return np.array(order, dtype='<f8').view('<i8').item(), ORDER_FLOAT
+    return int(order), ORDER_INT
+
+
+def _decode_order(order, kind):
+    if kind == ORDER_NONE:
+        return None
+    if kind == ORDER_FLOAT:
+        return np.array(order, dtype='<i8').view('<f8').item()
+    return order
+
+
+'''
+Capture the state of thermometers = {key: Thermometer}, keys are strings or integers.
+This is quick, so it could be done between readings, the slower serialization could then be done on another thread
+'''
+def capture(thermometers):
+    captured = []
+    thresholds_of = {}  # Flattened thresholds of every distinct thresholds dict, shared by copies of a thermometer
+    # Thermometers could be added while capturing (i.e. by the readers of a Checkpointer), iterate over a copy
+    for key, thermometer in list(thermometers.items()):
+        thresholds = thresholds_of.get(id(thermometer.thresholds))
+        if thresholds is None:
+            thresholds = [thresh for at_key in thermometer.thresholds.values() for thresh in at_key]
+            thresholds_of[id(thermometer.thresholds)] = thresholds
+        captured.append((key, thresholds, thermometer.get_state()))
+    return captured
+
+
+'''
+Serialize captured thermometers (see capture) to bytes
+'''
+def serialize(captured):
+    catalog = {}  # {threshold id: index in the catalog}
+    catalog_thresholds = []
+    lists = {}  # {tuple of catalog indices: index of the threshold list}
+    list_of = {}  # {id of a flattened list from capture: index of the threshold list}
+    members, reached, triggered, last_triggered, names = [], [], [], [], []
+    names_size = [0]
+
+    def add_name(name):
+        data = str(name).encode('utf-8')
+        names.append(data)
+        names_size[0] += len(data)
+        return names_size[0] - len(data), len(data)
+
+    thermometers = np.zeros(len(captured), dtype=THERMOMETER)
+    for i, (key, thresholds, state) in enumerate(captured):
+        index = list_of.get(id(thresholds))
+        if index is None:
+            indices = []
+            for thresh in thresholds:
+                if thresh.id not in catalog:
+                    catalog[thresh.id] = len(catalog_thresholds)
+                    catalog_thresholds.append(thresh)
+                indices.append(catalog[thresh.id])
+            index = lists.setdefault(tuple(indices), len(lists))
+            list_of[id(thresholds)] = index
+
+        store_unit, output_unit, fluctuations_unit, fluctuations, fixed_point, prev_data, triggered_keys, reached_ids, \
+            cooldown, last_triggers, last_order = state
+        reached_start, triggered_start, last_triggered_start = len(reached), len(triggered), len(last_triggered)
+        reached.extend(catalog[threshold_id] for threshold_id in reached_ids if threshold_id in catalog)
+        triggered.extend(triggered_keys)
+        last_triggered.extend((catalog[threshold_id], timestamp) for threshold_id, timestamp in last_triggers.items()
+                              if threshold_id in catalog)
+        key_offset, key_size = add_name(key)
+        thermometers[i] = (key_offset, key_size, isinstance(key, int), UNITS.index(store_unit), UNITS.index(output_unit),
+                           UNITS.index(fluctuations_unit), fixed_point, fluctuations, np.nan if prev_data is None else prev_data,
+                           index, reached_start, len(reached) - reached_start, triggered_start, len(triggered) - triggered_start,
+                           np.nan if cooldown is None else cooldown, last_triggered_start, len(last_triggered) - last_triggered_start,
+                           *_encode_order(last_order))
+
+    threshold_table = np.zeros(len(catalog_thresholds), dtype=THRESHOLD)
+    for i, thresh in enumerate(catalog_thresholds):
+        name_offset, name_size = add_name(thresh.name)
+        threshold_table[i] = (thresh.id, thresh.direction.value, thresh.thresh_val_c, thresh.thresh_val_f, name_offset, name_size)
+
+    list_table = np.zeros(len(lists), dtype=THRESHOLD_LIST)
+    for indices, index in lists.items():
+        list_table[index] = (len(members), len(indices))
+        members.extend(indices)
+
+    header = np.zeros(1, dtype=HEADER)
+    header[0] = (MAGIC, VERSION, b'\0' * 7, len(threshold_table), len(list_table), len(members), len(thermometers),
+                 len(reached), len(triggered), len(last_triggered), names_size[0])
+    return b''.join([header.tobytes(), threshold_table.tobytes(), list_table.tobytes(),
+                     np.array(members, dtype='<i4').tobytes(), thermometers.tobytes(),
+                     np.array(reached, dtype='<i4').tobytes(), np.array(triggered, dtype='<f8').tobytes(),
+                     np.array(last_triggered, dtype=LAST_TRIGGER).tobytes()] + names)
+
+
+'''
+Write data to path at once, readers see either the previous file or the new one
+'''
+def write_file(data, path):
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+'''
+Save thermometers = {key: Thermometer} to path
+'''
+def save(thermometers, path):
+    write_file(serialize(capture(thermometers)), path)
+
+
+'''
+Restore thermometers from bytes returned by serialize, return {key: Thermometer}.
+Thresholds with the same id as one of the given thresholds are replaced by it, so thermometers restored in the process
+that saved them use the same threshold objects, other thresholds are recreated with their saved id
+'''
+def deserialize(data, thresholds=()):
+    header = np.frombuffer(data, dtype=HEADER, count=1)[0]
+    if header['magic'] != MAGIC or header['version'] != VERSION:
+        raise ValueError("not a thermometer snapshot")
+
+    offset = HEADER.itemsize
+    def table(dtype, count):
+        nonlocal offset
+        array = np.frombuffer(data, dtype=dtype, count=int(count), offset=offset)
+        offset += array.nbytes
+        return array
+    threshold_table = table(THRESHOLD, header['thresholds'])
+    list_table = table(THRESHOLD_LIST, header['lists'])
+    members = table('<i4', header['members']).tolist()
+    thermometer_table = table(THERMOMETER, header['thermometers'])
+    reached = table('<i4', header['reached']).tolist()
+    triggered = table('<f8', header['triggered']).tolist()
+    last_triggered = table(LAST_TRIGGER, header['last_triggered']).tolist()
+    names = bytes(data[offset:offset + int(header['names_size'])])
+
+    existing = {thresh.id: thresh for thresh in thresholds}
+    catalog = []
+    for threshold_id, direction, thresh_val_c, thresh_val_f, name_offset, name_size in threshold_table.tolist():
+        thresh = existing.get(threshold_id)
+        if thresh is None:
+            name = names[name_offset:name_offset + name_size].decode('utf-8')
+            thresh = Threshold.restore(threshold_id, name, thresh_val_c, thresh_val_f, Direction(direction))
+        catalog.append(thresh)
+
+    templates = {}  # {(threshold list, store unit, fixed point): Thermometer}, restored thermometers are copies of them
+    thermometers = {}
+    for (key_offset, key_size, key_is_int, store_unit, output_unit, fluctuations_unit, fixed_point, fluctuations,
+         prev_data, list_index, reached_start, reached_count, triggered_start, triggered_count, cooldown,
+         last_triggered_start, last_triggered_count, last_order, last_order_kind) in thermometer_table.tolist():
+        template = templates.get((list_index, store_unit, fixed_point))
+        if template is None:
+            start, count = list_table[list_index].tolist()
+            template = Thermometer([catalog[i] for i in members[start:start + count]], output_unit=UNITS[store_unit],
+                                   fixed_point=bool(fixed_point))
+            templates[(list_index, store_unit, fixed_point)] = template
+
+        # Temperatures are integers in fixed point mode
+        convert = int if fixed_point else float
+        state = (UNITS[store_unit], UNITS[output_unit], UNITS[fluctuations_unit], convert(fluctuations), bool(fixed_point),
+                 None if prev_data != prev_data else convert(prev_data),
+                 [convert(key) for key in triggered[triggered_start:triggered_start + triggered_count]],
+                 [catalog[i].id for i in reached[reached_start:reached_start + reached_count]],
+                 None if cooldown != cooldown else cooldown,
+                 {catalog[i].id: timestamp for i, timestamp in last_triggered[last_triggered_start:last_triggered_start + last_triggered_count]},
+                 _decode_order(last_order, last_order_kind))
+        thermometer = template.copy()
+        thermometer.set_state(state)
+
+        key = names[key_offset:key_offset + key_size].decode('utf-8')
+        thermometers[int(key) if key_is_int else key] = thermometer
+    return thermometers
+
+
+'''
+Restore thermometers saved to path with save, see deserialize
+'''
+def load(path, thresholds=()):
+    with open(path, 'rb') as f:
+        return deserialize(f.read(), thresholds)
+
+
+'''
+Save thermometers = {key: Thermometer} to path every interval seconds on a background thread,
+so readings are not paused while the snapshot is serialized and written.
+
+The periodic snapshots capture each thermometer from the background thread, a thermometer being read at the same time
+could be captured in the middle of a reading. Calling checkpoint() between readings captures a consistent state
+and only leaves the serialization and writing to the background thread.
+'''
+class Checkpointer:
+    def __init__(self, thermometers, path, interval=60.0):
+        self.thermometers = thermometers
+        self.path = path
+        self.interval = interval
+        self.checkpoints = 0  # Number of snapshots written
+        self.error = None  # Last exception raised while writing a snapshot
+
+        self.__condition = threading.Condition()
+        self.__pending = None  # State captured by checkpoint(), waiting to be written
+        self.__stopped = False
+        self.__thread = None
+
+    def start(self):
+        self.__stopped = False
+        self.__thread = threading.Thread(target=self.__run, name='thermometer-checkpointer', daemon=True)
+        self.__thread.start()
+
+    '''
+    Stop the background thread, after writing a last snapshot
+    '''
+    def stop(self):
+        with self.__condition:
+            self.__stopped = True
+            self.__condition.notify()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+    '''
+    Capture the thermometers now, and write them on the background thread
+    '''
+    def checkpoint(self):
+        captured = capture(self.thermometers)
+        with self.__condition:
+            self.__pending = captured
+            self.__condition.notify()
+
+    def __run(self):
+        while True:
+            with self.__condition:
+                if self.__pending is None and not self.__stopped:
+                    self.__condition.wait(self.interval)
+                captured, self.__pending = self.__pending, None
+                stopped = self.__stopped
+            if captured is not None:
+                self.__write(captured)
+            if stopped:
+                self.__write()
+                break
+            if captured is None:
+                self.__write()
+
+    '''
+    Write captured thermometers, or capture them now if captured is None
+    '''
+    def __write(self, captured=None):
+        try:
+            if captured is None:
+                captured = capture(self.thermometers)
+            write_file(serialize(captured), self.path)
+            self.checkpoints += 1
+        except Exception as e:  # Keep checkpointing, the error is reported in self.error
+            self.error = e
@@ -0,0 +1,107 @@
+import argparse
+import sys
+import threading
+import time
+from random import Random
+
+from classes import Thermometer
+from main import DEFAULT_THRESHOLDS
+
+'''
+Thermometers of many sensors read from several threads. Every sensor has its own Thermometer (copied from a template),
+and the thermometers are protected by stripes locks: a sensor always uses lock hash(sensor_id) % stripes, so threads
+reading different sensors rarely wait for each other, and there is no lock per sensor to allocate.
+
+Readings of the same sensor are applied one at a time. When several threads feed the same sensor (i.e. redundant
+collectors), readings should be (temperature, unit, order) with a sequence number or timestamp as order: a reading
+older than (or as old as) the last applied one is ignored, see Thermometer.read_events.
+
+Threads only run Python code in parallel on a Python build without the global interpreter lock, with the GIL the locks
+keep the state consistent but the readings are still evaluated one at a time.
+'''
+class StripedThermometers:
+    def __init__(self, template, stripes=64):
+        self.template = template
+        self.thermometers = {}  # {sensor id: Thermometer}
+        self.__locks = [threading.Lock() for _ in range(stripes)]
+
+    '''
+    Return the thermometer of sensor_id, creating it from the template on its first reading
+    '''
+    def get(self, sensor_id):
+        therm = self.thermometers.get(sensor_id)
+        if therm is None:
+            lock = self.__locks[hash(sensor_id) % len(self.__locks)]
+            with lock:
+                therm = self.thermometers.get(sensor_id)
+                if therm is None:
+                    therm = self.template.copy()
+                    therm.enable_locking(lock)
+                    self.thermometers[sensor_id] = therm
+        return therm
+
+    def read(self, sensor_id, data_pt, timestamp=None):
+        return self.get(sensor_id).read(data_pt, timestamp)
+
+    def read_events(self, sensor_id, data_pt, readings=True, timestamp=None):
+        return self.get(sensor_id).read_events(data_pt, readings, timestamp)
+
+
+'''
+Yield count readings (sensor_id, (temperature, unit, sequence number)) of random walks around the freezing point,
+sequence numbers are increasing for every sensor
+'''
+def generate_readings(sensors, count, seed=0):
+    rand = Random(seed)
+    temps = [rand.uniform(-5.0, 5.0) for _ in range(sensors)]
+    sequences = [0] * sensors
+    for _ in range(count):
+        sensor = rand.randrange(sensors)
+        temps[sensor] += rand.uniform(-1.0, 1.0)
+        sequences[sensor] += 1
+        yield sensor, (temps[sensor], 'C', sequences[sensor])
+
+
+'''
+Feed readings to striped thermometers from threads threads, every thread getting an equal part of the readings.
+Return the elapsed time in seconds
+'''
+def run_threads(striped, readings, threads):
+    parts = [readings[i::threads] for i in range(threads)]
+    def feed(part):
+        read_events = striped.read_events
+        for sensor_id, data_pt in part:
+            read_events(sensor_id, data_pt, False)
+    workers = [threading.Thread(target=feed, args=(part,)) for part in parts]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - start
+
+
+def benchmark(max_threads, sensors, count, stripes, out):
+    template = Thermometer(DEFAULT_THRESHOLDS, (0.5, 'C'))
+    readings = list(generate_readings(sensors, count))
+    base = None
+    for threads in range(1, max_threads + 1):
+        elapsed = run_threads(StripedThermometers(template, stripes), readings, threads)
+        rate = count / elapsed
+        base = base or rate
+        out.write("%2d threads: %10.0f readings/sec, speedup %.2fx\n" % (threads, rate, rate / base))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark reading thermometers from several threads")
+    parser.add_argument('--threads', type=int, default=4, help="maximum number of threads")
+    parser.add_argument('--sensors', type=int, default=10000)
+    parser.add_argument('--readings', type=int, default=1000000)
+    parser.add_argument('--stripes', type=int, default=64)
+    args = parser.parse_args(argv)
+    benchmark(args.threads, args.sensors, args.readings, args.stripes, sys.stdout)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,8 +1,18 @@
-from classes import Temperature, Threshold, Thermometer, TemperatureUnit, Direction
+from classes import Temperature, Threshold, Thermometer, TemperatureUnit, Direction, Event, EventKind
 import unittest
 import sys
 import io
-from random import randrange
+import os
+import tempfile
+import threading
+import time
+from random import randrange, Random
+
+try:
+    import numpy as np
+    from bank import ThermometerBank
+except ImportError:
+    np = None
 
 
 class TemperatureUnitTest(unittest.TestCase):
@@ -61,7 +71,6 @@ class ThresholdTest(unittest.TestCase):
         self.assertEqual(threshold_1.thresh_val_c, thresh_val)
         self.assertEqual(threshold_1.thresh_val_f, Temperature.convert_celcius_to_fahrenheit(thresh_val))
         self.assertEqual(threshold_1.direction, Direction.ANY)
-        self.assertFalse(threshold_1.reached)
 
     def test_init_2(self):
         name = 'test1'
@@ -74,7 +83,23 @@ class ThresholdTest(unittest.TestCase):
         self.assertEqual(threshold_1.thresh_val_f, thresh_val)
         self.assertEqual(threshold_1.thresh_val_c, Temperature.convert_fahrenheit_to_celcius(thresh_val))
         self.assertEqual(threshold_1.direction, direction)
-        self.assertFalse(threshold_1.reached)
+
+    def test_immutable(self):
+        threshold_1 = Threshold('test1', 0.0)
+        with self.assertRaises(AttributeError):
+            threshold_1.name = 'test2'
+        with self.assertRaises(AttributeError):
+            threshold_1.reached = True
+
+    def test_unique_id(self):
+        self.assertNotEqual(Threshold('test1', 0.0).id, Threshold('test1', 0.0).id)
+
+    def test_pickle(self):
+        import pickle
+        threshold_1 = Threshold('test1', 0.0, direction=Direction.LESSER)
+        threshold_2 = pickle.loads(pickle.dumps(threshold_1))
+        self.assertEqual((threshold_1.id, threshold_1.name, threshold_1.thresh_val_f, threshold_1.direction),
+                         (threshold_2.id, threshold_2.name, threshold_2.thresh_val_f, threshold_2.direction))
 
 
 class ThermometerTest(unittest.TestCase):
@@ -208,6 +233,13 @@ class ThermometerTest(unittest.TestCase):
         for res in result[9:]:
             self.assertIn('threshold has been reached at 32.0F', res)
 
+    def test_read_non_finite(self):
+        therm = Thermometer([Threshold('Freezing', 0.0)])
+        therm.read((-1.0, 'C'))
+        self.assertEqual(['Invalid Temperature'], therm.read((float('nan'), 'C')))
+        self.assertEqual(['Invalid Temperature'], therm.read((float('inf'), 'F')))
+        self.assertEqual(['-0.5C'], therm.read((-0.5, 'C')))
+
     def test_read_invalid_unit(self):
         data_points = [(32.9,'F'), (32.0,'G'), (-0.5,'C')]
         self.therm_c.set_fluctuations((0.9, 'f'))
@@ -216,10 +248,55 @@ class ThermometerTest(unittest.TestCase):
         for dp in data_points:
             result.extend(self.therm_c.read(dp))
 
-        self.assertEqual(len(result), 3)
+        # Invalid reading is ignored, so going from 0.5C to -0.5C jumps over the 0.0C thresholds
+        self.assertEqual(len(result), 5)
         self.assertEqual('0.5C', result[0])
         self.assertEqual('Invalid Unit', result[1])
-        self.assertEqual('-0.5C', result[2])
+        for res in result[2:]:
+            self.assertIn('threshold has been reached at 0.0C', res)
+
+    def test_read_crossing_up(self):
+        data_points = [(99.5,'C'), (100.5,'C')]
+        result = []
+        for dp in data_points:
+            result.extend(self.therm_c.read(dp))
+
+        self.assertEqual(['99.5C', 'Boiling threshold has been reached at 100.0C',
+                          'Boiling_2 threshold has been reached at 100.0C'], result)
+
+    def test_read_crossing_down(self):
+        data_points = [(100.5,'C'), (211.1,'F')]
+        result = []
+        for dp in data_points:
+            result.extend(self.therm_c.read(dp))
+
+        self.assertEqual(['100.5C', 'Boiling threshold has been reached at 100.0C'], result)
+
+    def test_read_crossing_multiple(self):
+        data_points = [(-1.0,'C'), (101.0,'C'), (-1.0,'C')]
+        result = []
+        for dp in data_points:
+            result.extend(self.therm_c.read(dp))
+
+        # Thresholds are triggered in the order they are crossed
+        self.assertEqual(['-1.0C',
+                          'Freezing threshold has been reached at 0.0C',
+                          'Freezing 2 threshold has been reached at 0.0C',
+                          'Freezing Fahrenheit threshold has been reached at 0.0C',
+                          'Boiling Fahrenheit fail threshold has been reached at 37.8C',
+                          'Boiling threshold has been reached at 100.0C',
+                          'Boiling_2 threshold has been reached at 100.0C',
+                          'Boiling threshold has been reached at 100.0C',
+                          'Boiling Fahrenheit fail threshold has been reached at 37.8C',
+                          'Freezing threshold has been reached at 0.0C',
+                          'Freezing 2 threshold has been reached at 0.0C',
+                          'Freezing 3 threshold has been reached at 0.0C'], result)
+
+    def test_read_crossing_many_thresholds(self):
+        therm = Thermometer([Threshold('T%d' % i, i / 100.0) for i in range(20000)])
+        self.assertEqual(therm.read((10.004, 'C')), ['10.0C'])
+        result = therm.read((10.055, 'C'))
+        self.assertEqual(['T%d threshold has been reached at %.1fC' % (i, i / 100.0) for i in range(1001, 1006)], result)
 
     def test_remove_threshold(self):
         self.assertEqual(len(self.therm_c.thresholds[0.0]), 4)
@@ -245,6 +322,1338 @@ class ThermometerTest(unittest.TestCase):
         self.assertEqual(len(self.therm_c.thresholds[0.0]), 4)
 
         self.assertFalse(self.therm_c.remove_thershold(32.0, TemperatureUnit.CELCIUS, 'Test 2'))
+
+    def test_shared_thresholds(self):
+        # therm_c and therm_f share the same threshold objects, triggering one does not affect the other
+        self.therm_c.read((0.5, 'C'))
+        self.assertEqual(3, len(self.therm_c.read((0.0, 'C'))))
+        self.assertTrue(self.therm_c.is_reached(self.thresholds[0]))
+        self.assertFalse(self.therm_f.is_reached(self.thresholds[0]))
+
+        self.therm_f.read((0.5, 'C'))
+        self.assertEqual(3, len(self.therm_f.read((0.0, 'C'))))
+
+    def test_default_thresholds(self):
+        therm = Thermometer()
+        therm.add_threshold(Threshold('test', 0.0))
+        self.assertEqual({}, Thermometer().thresholds)
+
+    def test_copy(self):
+        self.therm_f.set_fluctuations((0.5, 'C'))
+        self.therm_f.read((0.5, 'C'))
+        therm = self.therm_f.copy()
+        self.assertIs(therm.thresholds, self.therm_f.thresholds)
+        self.assertTrue(abs(therm._Thermometer__fluctuations_temp - 0.9) < 1E-5)
+
+        # Copy does not have any reading yet
+        self.assertEqual(['33.8F'], therm.read((1.0, 'C')))
+        self.assertEqual(3, len(self.therm_f.read((0.0, 'C'))))
+
+        # Changing thresholds of the copy does not change the original thermometer
+        self.assertTrue(therm.remove_thershold(0.0, TemperatureUnit.CELCIUS, 'Freezing'))
+        therm.add_threshold(Threshold('Warm', 20.0))
+        self.assertEqual(3, len(therm.thresholds[32.0]))
+        self.assertEqual(4, len(self.therm_f.thresholds[32.0]))
+        self.assertNotIn(68.0, self.therm_f.thresholds)
+
+    def test_fixed_point(self):
+        therm = Thermometer(self.thresholds, (0.5, 'c'), fixed_point=True)
+        self.assertEqual(4, len(therm.thresholds[0]))
+        self.assertEqual(2, len(therm.thresholds[100000]))
+        self.assertEqual(500, therm._Thermometer__fluctuations_temp)
+
+        data_points = [(0.5,'C'), (0.0,'C'), (-0.5,'C'), (0.0,'C'), (0.5,'C'), (1.0,'C'), (-0.5,'C'), (0.0,'C')]
+        self.therm_c.set_fluctuations((0.5, 'c'))
+        result, expected = [], []
+        for dp in data_points:
+            result.extend(therm.read(dp))
+            expected.extend(self.therm_c.read(dp))
+        self.assertEqual(expected, result)
+
+    def test_fixed_point_exact_match(self):
+        # 100F is 37.777...C, the reading is not exactly the threshold value, but the same number of milli-degrees
+        therm = Thermometer([Threshold('Fever', 100.0, unit=TemperatureUnit.FAHRENHEIT)], fixed_point=True)
+        self.assertEqual(['Fever threshold has been reached at 37.8C'], therm.read((37.778, 'C')))
+
+        therm = Thermometer([Threshold('Boiling', 100.0)], output_unit=TemperatureUnit.FAHRENHEIT, fixed_point=True)
+        self.assertEqual(['Boiling threshold has been reached at 212.0F'], therm.read((212.0004, 'F')))
+        self.assertTrue(therm.remove_thershold(100.0, TemperatureUnit.CELCIUS, 'Boiling'))
+
+    def test_fixed_point_copy(self):
+        therm = Thermometer(self.thresholds, (0.5, 'C'), fixed_point=True).copy()
+        self.assertEqual(500, therm._Thermometer__fluctuations_temp)
+        self.assertIn(0, therm.thresholds)
+
+    def test_noise_within_fluctuations_triggers_once(self):
+        therm = Thermometer([Threshold('Z', 0.0, direction=Direction.GREATER)], (0.5, 'C'))
+        result = []
+        for temp in [0.3, -0.3, 0.3, -0.3, 0.4, -0.45]:
+            result.extend(therm.read((temp, 'C')))
+        self.assertEqual(1, len([res for res in result if 'threshold has been reached' in res]))
+
+        # Leaving the fluctuations of the threshold value allows the next crossing to trigger it again
+        therm.read((0.6, 'C'))
+        self.assertEqual(['Z threshold has been reached at 0.0C'], therm.read((-0.1, 'C')))
+
+    def test_release_every_crossed_threshold_value(self):
+        therm = Thermometer([Threshold('Zero', 0.0), Threshold('Ten', 10.0)], (0.5, 'C'))
+        self.assertEqual(['-5.0C'], therm.read((-5.0, 'C')))
+        self.assertEqual(['Zero threshold has been reached at 0.0C', 'Ten threshold has been reached at 10.0C'],
+                         therm.read((15.0, 'C')))
+        self.assertEqual(['30.0C'], therm.read((30.0, 'C')))
+        self.assertEqual(['Ten threshold has been reached at 10.0C'], therm.read((0.3, 'C')))
+        self.assertEqual(['Zero threshold has been reached at 0.0C'], therm.read((-0.1, 'C')))
+
+    def test_release_outside_fluctuations_only(self):
+        thresholds = [Threshold('T%d' % i, float(i)) for i in range(10)]
+        therm = Thermometer(thresholds, (2.0, 'C'))
+        therm.read((-5.0, 'C'))
+        self.assertEqual(10, len(therm.read((12.0, 'C'))))
+        # 0 to 2 are released, 8 and 9 are released and crossed again, 3 to 7 are still in fluctuations
+        self.assertEqual(['T9 threshold has been reached at 9.0C', 'T8 threshold has been reached at 8.0C'], therm.read((5.0, 'C')))
+        self.assertEqual([3, 4, 5, 6, 7, 8, 9], [i for i, thresh in enumerate(thresholds) if therm.is_reached(thresh)])
+        self.assertEqual([3.0, 4.0, 5.0, 6.0, 7.0, 8.0, 9.0], therm._Thermometer__triggered)
+
+    def test_remove_last_threshold_at_value(self):
+        self.assertTrue(self.therm_c.remove_thershold(100.0, TemperatureUnit.FAHRENHEIT, 'Boiling Fahrenheit fail'))
+        self.assertNotIn(Temperature.convert_fahrenheit_to_celcius(100.0), self.therm_c.thresholds)
+
+        # Removed threshold value is not crossed anymore
+        data_points = [(30.0,'C'), (40.0,'C')]
+        result = []
+        for dp in data_points:
+            result.extend(self.therm_c.read(dp))
+        self.assertEqual(['30.0C', '40.0C'], result)
+
+    def test_add_remove_thresholds(self):
+        therm = Thermometer()
+        therm.add_thresholds(self.thresholds)
+        self.assertEqual(self.therm_c.thresholds, therm.thresholds)
+        self.assertEqual([0.0, Temperature.convert_fahrenheit_to_celcius(100.0), 100.0], therm._Thermometer__keys)
+
+        self.assertEqual(3, therm.remove_thresholds(['Freezing', 'Boiling', 'Boiling_2', 'Unknown']))
+        self.assertEqual(3, len(therm.thresholds[0.0]))
+        self.assertNotIn(100.0, therm.thresholds)
+        self.assertEqual([0.0, Temperature.convert_fahrenheit_to_celcius(100.0)], therm._Thermometer__keys)
+        self.assertEqual(0, therm.remove_thresholds(['Boiling']))
+
+    def test_replace_thresholds_keeps_reached(self):
+        self.therm_c.read((0.5, 'C'))
+        self.therm_c.read((0.0, 'C'))
+        self.assertTrue(self.therm_c.is_reached(self.thresholds[0]))
+
+        # Reloaded catalog: new objects, Freezing unchanged, Freezing 2 moved, Boiling removed, Warm added
+        catalog = [Threshold('Freezing', 0.0), Threshold('Freezing 2', 1.0), Threshold('Warm', 20.0)] + self.thresholds[3:]
+        del catalog[4]  # Boiling_2
+        self.assertEqual((2, 3), self.therm_c.replace_thresholds(catalog))
+        # The unchanged threshold is replaced by the new object, with the reached state of the old one
+        self.assertTrue(self.therm_c.is_reached(catalog[0]))
+        self.assertFalse(self.therm_c.is_reached(self.thresholds[0]))
+        self.assertIs(catalog[0], self.therm_c.thresholds[0.0][0])
+        self.assertEqual(['Freezing', 'Freezing 3', 'Freezing Fahrenheit'], [t.name for t in self.therm_c.thresholds[0.0]])
+        self.assertEqual([0.0, 1.0, 20.0, Temperature.convert_fahrenheit_to_celcius(100.0)], self.therm_c._Thermometer__keys)
+        self.assertEqual((0, 0), self.therm_c.replace_thresholds(catalog))
+
+        # The moved threshold is found at its new value
+        self.assertEqual(['Freezing 2 threshold has been reached at 1.0C'], self.therm_c.read((1.0, 'C')))
+
+        # Ids reported after the reload are the ids of the new catalog
+        self.therm_c.read((5.0, 'C'))
+        threshold_ids = [event.threshold.id for event in self.therm_c.read_events((0.0, 'C'))]
+        self.assertIn(catalog[0].id, threshold_ids)
+        self.assertNotIn(self.thresholds[0].id, threshold_ids)
+
+    def test_replace_thresholds_copy(self):
+        therm = self.therm_c.copy()
+        therm.replace_thresholds([Threshold('Warm', 20.0)])
+        self.assertEqual([20.0], list(therm.thresholds))
+        self.assertEqual(4, len(self.therm_c.thresholds[0.0]))
+        self.assertTrue(self.therm_c.remove_thershold(0.0, TemperatureUnit.CELCIUS, 'Freezing'))
      
+
+class EventTest(unittest.TestCase):
+    def test_str(self):
+        threshold = Threshold('Freezing', 0.0)
+        self.assertEqual('Invalid Unit', str(Event(EventKind.INVALID_UNIT)))
+        self.assertEqual('32.9F', str(Event(EventKind.READING, 0.5, TemperatureUnit.CELCIUS, TemperatureUnit.FAHRENHEIT)))
+        self.assertEqual('Freezing threshold has been reached at 0.0C',
+                         str(Event(EventKind.THRESHOLD, 0.0, TemperatureUnit.CELCIUS, TemperatureUnit.CELCIUS, threshold)))
+
+    def test_read_events(self):
+        thresholds = make_thresholds()
+        therm = Thermometer(thresholds)
+        self.assertEqual([EventKind.READING], [e.kind for e in therm.read_events((0.5, 'C'))])
+
+        events = therm.read_events((32.0, 'F'))
+        self.assertEqual([EventKind.THRESHOLD] * 3, [e.kind for e in events])
+        self.assertEqual(thresholds[0], events[0].threshold)
+        self.assertEqual(0.0, events[0].temperature)
+
+        self.assertEqual([EventKind.INVALID_UNIT], [e.kind for e in therm.read_events((0.5, 'G'))])
+
+    def test_read_events_without_readings(self):
+        therm = Thermometer(make_thresholds())
+        self.assertEqual([], therm.read_events((0.5, 'C'), readings=False))
+        self.assertEqual(3, len(therm.read_events((0.0, 'C'), readings=False)))
+        self.assertEqual([], therm.read_events((-0.5, 'C'), readings=False))
+
+    def test_read_same_as_read_events(self):
+        values, units = make_readings(3000, seed=3)
+        data_pts = list(zip(values, units)) + [(float('nan'), 'C'), (1.0, 'X'), (2.0, 'C', 5), (3.0, 'C', 4)]
+        thresholds = make_thresholds()
+        for output_unit in TemperatureUnit:
+            for fixed_point in (False, True):
+                therm = Thermometer(thresholds, (0.5, 'C'), output_unit, fixed_point)
+                expected = Thermometer(thresholds, (0.5, 'C'), output_unit, fixed_point)
+                for data_pt in data_pts:
+                    self.assertEqual([str(event) for event in expected.read_events(data_pt)], therm.read(data_pt))
+
+    def test_output_unit_is_kept(self):
+        therm = Thermometer(make_thresholds())
+        event = therm.read_events((0.5, 'C'))[0]
+        therm.output_unit = TemperatureUnit.FAHRENHEIT
+        self.assertEqual('0.5C', str(event))
+        self.assertEqual('32.9F', str(therm.read_events((0.5, 'C'))[0]))
+
+
+def make_thresholds():
+    return [
+        Threshold('Freezing', 0.0, unit=TemperatureUnit.CELCIUS),
+        Threshold('Boiling', 100.0,  unit=TemperatureUnit.CELCIUS),
+        Threshold('Freezing 2', 0.0,  unit=TemperatureUnit.CELCIUS),
+        Threshold('Freezing 3', 0.0,  unit=TemperatureUnit.CELCIUS, direction=Direction.GREATER),
+        Threshold('Boiling_2', 100.0,  unit=TemperatureUnit.CELCIUS, direction=Direction.LESSER),
+        Threshold('Boiling Fahrenheit fail' , 100.0, unit=TemperatureUnit.FAHRENHEIT),
+        Threshold('Freezing Fahrenheit', 32.0, unit=TemperatureUnit.FAHRENHEIT, direction=Direction.LESSER)
+    ]
+
+
+def make_readings(n, seed=0, units='CFcfG'):
+    rand = Random(seed)
+    temp = 0.0
+    values, unit_list = [], []
+    for _ in range(n):
+        temp += rand.choice([-1.0, -0.5, 0.0, 0.5, 1.0]) * rand.choice([1, 1, 1, 10])
+        unit = rand.choice(units)
+        values.append(temp if unit in 'Cc' else Temperature.convert_celcius_to_fahrenheit(temp))
+        unit_list.append(unit)
+    return values, unit_list
+
+
+@unittest.skipIf(np is None, 'numpy is not installed')
+class ThermometerReadManyTest(unittest.TestCase):
+    def check_same_as_read(self, values, units, output_unit, fluctuations, fixed_point=False):
+        thresholds_1, thresholds_2 = make_thresholds(), make_thresholds()
+        therm_1 = Thermometer(thresholds_1, fluctuations, output_unit=output_unit, fixed_point=fixed_point)
+        therm_2 = Thermometer(thresholds_2, fluctuations, output_unit=output_unit, fixed_point=fixed_point)
+
+        expected = []
+        for i, dp in enumerate(zip(values, units)):
+            for res in therm_1.read(dp):
+                if 'threshold has been reached' in res:
+                    expected.append((i, res.split(' threshold')[0]))
+
+        names = {thresh.id: thresh.name for thresh in thresholds_2}
+        sample_index, threshold_id = therm_2.read_many(np.array(values), np.array(units))
+        self.assertEqual(expected, [(i, names[t]) for i, t in zip(sample_index.tolist(), threshold_id.tolist())])
+
+        self.assertEqual(therm_1._Thermometer__prev_data, therm_2._Thermometer__prev_data)
+        self.assertEqual(therm_1._Thermometer__triggered, therm_2._Thermometer__triggered)
+        self.assertEqual([therm_1.is_reached(t) for t in thresholds_1], [therm_2.is_reached(t) for t in thresholds_2])
+
+    def test_read_many_celcius(self):
+        values, units = make_readings(2000, seed=1)
+        self.check_same_as_read(values, units, TemperatureUnit.CELCIUS, (0.5, 'C'))
+
+    def test_read_many_fahrenheit(self):
+        values, units = make_readings(2000, seed=2)
+        self.check_same_as_read(values, units, TemperatureUnit.FAHRENHEIT, (0.9, 'F'))
+
+    def test_read_many_no_fluctuations(self):
+        values, units = make_readings(2000, seed=3)
+        self.check_same_as_read(values, units, TemperatureUnit.CELCIUS, (0.0, 'C'))
+
+    def test_read_many_fluctuations_of_each_threshold_value(self):
+        therm = Thermometer([Threshold('Z', 0.0, direction=Direction.GREATER)], (0.5, 'C'))
+        sample_index, _ = therm.read_many([0.3, -0.3, 0.3, -0.3, 0.6, 0.2, -0.1], ['C'] * 7)
+        self.assertEqual([1, 6], sample_index.tolist())
+
+        zero, ten = Threshold('Zero', 0.0), Threshold('Ten', 10.0)
+        therm = Thermometer([zero, ten], (0.5, 'C'))
+        sample_index, threshold_id = therm.read_many([-5.0, 15.0, 30.0, 0.3, -0.1], 'C')
+        self.assertEqual([(1, zero.id), (1, ten.id), (3, ten.id), (4, zero.id)],
+                         list(zip(sample_index.tolist(), threshold_id.tolist())))
+
+    def test_read_many_fixed_point(self):
+        values, units = make_readings(2000, seed=7)
+        self.check_same_as_read(values, units, TemperatureUnit.FAHRENHEIT, (0.5, 'C'), fixed_point=True)
+
+    def test_read_many_single_unit(self):
+        therm = Thermometer(make_thresholds())
+        sample_index, threshold_id = therm.read_many([0.5, 0.0, -0.5, 0.0], 'C')
+        self.assertEqual([1, 1, 1, 3, 3, 3], sample_index.tolist())
+        self.assertEqual(6, len(threshold_id))
+
+    def test_read_many_continues_read(self):
+        therm = Thermometer(make_thresholds())
+        therm.read((0.5, 'C'))
+        sample_index, _ = therm.read_many([0.0], ['C'])
+        self.assertEqual([0, 0, 0], sample_index.tolist())
+        self.assertEqual(0.0, therm._Thermometer__prev_data)
+
+    def test_read_many_empty(self):
+        therm = Thermometer(make_thresholds())
+        sample_index, threshold_id = therm.read_many([1.0, 2.0], ['G', 'X'])
+        self.assertEqual(0, len(sample_index))
+        self.assertIsNone(therm._Thermometer__prev_data)
+
+    def test_read_many_non_finite(self):
+        values, units = [-1.0, float('nan'), -0.5, float('inf'), 0.5], ['C', 'C', 'C', 'F', 'C']
+        thresholds = make_thresholds()
+        therm = Thermometer(thresholds)
+        expected = [(i, event.threshold.id) for i, data_pt in enumerate(zip(values, units))
+                    for event in therm.read_events(data_pt, False) if event.kind == EventKind.THRESHOLD]
+        sample_index, threshold_id = Thermometer(thresholds).read_many(values, units)
+        self.assertEqual(expected, list(zip(sample_index.tolist(), threshold_id.tolist())))
+        self.assertEqual([4], sorted(set(sample_index.tolist())))
+
+
+@unittest.skipIf(np is None, 'numpy is not installed')
+class ThermometerBankTest(unittest.TestCase):
+    def test_fluctuations_of_each_threshold_value(self):
+        bank = ThermometerBank(2, [Threshold('Zero', 0.0), Threshold('Ten', 10.0)], (0.5, 'C'))
+        sample_index, threshold_index = bank.read([0, 1, 0, 1, 0, 1, 0, 1, 0, 1],
+                                                  [0.3, -5.0, -0.3, 15.0, 0.3, 30.0, -0.3, 0.3, 0.6, -0.1], 'C')
+        self.assertEqual([(2, 0), (3, 0), (3, 1), (7, 1), (8, 0), (9, 0)],
+                         list(zip(sample_index.tolist(), threshold_index.tolist())))
+
+    def test_same_as_thermometers(self):
+        size = 20
+        output_units = [TemperatureUnit.CELCIUS, TemperatureUnit.FAHRENHEIT] * (size // 2)
+        therms = [Thermometer(make_thresholds(), (0.5, 'C'), output_unit=unit) for unit in output_units]
+        bank = ThermometerBank(size, make_thresholds(), (0.5, 'C'), output_unit=output_units)
+
+        rand = Random(4)
+        values, units = make_readings(3000, seed=4)
+        sensor_ids = [rand.randrange(size // 4) * 4 + rand.randrange(2) for _ in values]
+        for start in range(0, len(values), 300):
+            batch = slice(start, start + 300)
+            expected = []
+            for i, sensor in enumerate(sensor_ids[batch]):
+                for res in therms[sensor].read((values[batch][i], units[batch][i])):
+                    if 'threshold has been reached' in res:
+                        expected.append((i, res.split(' threshold')[0]))
+
+            sample_index, threshold_index = bank.read(sensor_ids[batch], values[batch], units[batch])
+            result = [(i, bank.thresholds[t].name) for i, t in zip(sample_index.tolist(), threshold_index.tolist())]
+            self.assertEqual(expected, result)
+
+        prev_data = [therm._Thermometer__prev_data for therm in therms]
+        self.assertEqual(prev_data, [None if np.isnan(p) else p for p in bank._ThermometerBank__prev_data.tolist()])
+
+    def test_set_fluctuations(self):
+        bank = ThermometerBank(2, make_thresholds(), output_unit=[TemperatureUnit.CELCIUS, TemperatureUnit.FAHRENHEIT])
+        bank.set_fluctuations((0.9, 'F'))
+        fluctuations = bank._ThermometerBank__fluctuations
+        self.assertTrue(abs(fluctuations[0] - 0.5) < 1E-5)
+        self.assertTrue(abs(fluctuations[1] - 0.9) < 1E-5)
+
+        bank.set_fluctuations((1.0, 'C'), sensor_ids=[1])
+        self.assertTrue(abs(fluctuations[0] - 0.5) < 1E-5)
+        self.assertTrue(abs(fluctuations[1] - 1.8) < 1E-5)
+
+    def test_invalid_unit(self):
+        bank = ThermometerBank(1, make_thresholds())
+        sample_index, _ = bank.read([0, 0, 0], [0.5, 0.0, -0.5], ['C', 'G', 'C'])
+        self.assertEqual([2, 2, 2], sample_index.tolist())
+
+    def test_non_finite(self):
+        bank = ThermometerBank(1, make_thresholds())
+        sample_index, _ = bank.read([0, 0, 0], [-1.0, np.nan, np.inf], 'C')
+        self.assertEqual([], sample_index.tolist())
+
+
+class MainTest(unittest.TestCase):
+    def run_main(self, argv, stdin=''):
+        import main
+        stdin, stdout, stderr = io.StringIO(stdin), io.StringIO(), io.StringIO()
+        self.assertEqual(0, main.main(argv, stdin, stdout, stderr))
+        return stdout.getvalue().splitlines(), stderr.getvalue()
+
+    def test_csv_stdin(self):
+        output, report = self.run_main(['--output-unit', 'C'], '0.5,C\n0.0,C\nbad line\n\n-0.5,C\n32,F\n')
+        self.assertEqual(6, len(output))
+        self.assertEqual('0.5C', output[0])
+        self.assertIn('Freezing threshold has been reached at 0.0C', output[1])
+        self.assertIn('4 readings', report)
+        self.assertIn('1 lines could not be parsed', report)
+
+    def test_nan(self):
+        output, _ = self.run_main(['--events-only', '--quiet'], '-1,C\nnan,C\n-inf,C\n')
+        self.assertEqual(['Invalid Temperature', 'Invalid Temperature'], output)
+
+    def test_events_only(self):
+        output, _ = self.run_main(['--events-only', '--threshold', 'Warm:20:C:LESSER', '--quiet'],
+                                  '19,C\n21,C\n19,C\n70,F\n21,G\n')
+        self.assertEqual(['Warm threshold has been reached at 68.0F', 'Warm threshold has been reached at 68.0F', 'Invalid Unit'], output)
+
+    def test_csv_file(self):
+        import main
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'readings.csv')
+            with open(path, 'w') as f:
+                for i in range(3 * main.WRITE_BLOCK):
+                    f.write('%.1f,C\n' % (10 + i % 10))
+            output, _ = self.run_main([path, '--output-unit', 'C', '--quiet'])
+        self.assertEqual(3 * main.WRITE_BLOCK, len(output))
+        self.assertEqual('17.0C', output[-1])
+
+    def test_binary_file(self):
+        import main
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'readings.bin')
+            with open(path, 'wb') as f:
+                for data_pt in [(0.5, b'C'), (32.0, b'F'), (-0.5, b'C')]:
+                    f.write(main.BINARY_RECORD.pack(*data_pt))
+            output, _ = self.run_main([path, '--format', 'binary', '--output-unit', 'C', '--quiet'])
+        self.assertEqual(5, len(output))
+        self.assertEqual('-0.5C', output[-1])
+
+    def test_binlog_file(self):
+        import binlog
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'readings.bin')
+            with binlog.LogWriter(path) as writer:
+                for i, (temperature, unit) in enumerate([(0.5, b'C'), (32.0, b'F'), (-0.5, b'C'), (1.0, b'G')]):
+                    writer.write(float(i), 0, temperature, unit)
+            output, _ = self.run_main([path, '--format', 'binlog', '--output-unit', 'C', '--quiet'])
+        self.assertEqual(6, len(output))
+        self.assertEqual(['-0.5C', 'Invalid Unit'], output[-2:])
+        with self.assertRaises(SystemExit):
+            self.run_main(['--format', 'binlog'])
+
+    def test_binlog_sensors(self):
+        import binlog
+        import main
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'readings.bin')
+            with binlog.LogWriter(path) as writer:
+                writer.write_many([1.0, 2.0, 3.0, 4.0], [1, 2, 1, 2], [1.0, -1.0, -1.0, 1.0], 'C')
+            # Readings of several sensors are not mixed in one thermometer
+            stdout, stderr = io.StringIO(), io.StringIO()
+            self.assertEqual(2, main.main([path, '--format', 'binlog', '--quiet'], stdout=stdout, stderr=stderr))
+            self.assertEqual('', stdout.getvalue())
+            self.assertIn('2 sensors', stderr.getvalue())
+            output, _ = self.run_main([path, '--format', 'binlog', '--sensor', '2', '--output-unit', 'C', '--quiet'])
+            self.assertEqual(['-1.0C', 'Freezing threshold has been reached at 0.0C'], output[:2])
+            with binlog.LogReader(path) as reader:
+                data_pts = list(main.parse_binlog(reader.records, {'skipped': 0}))
+            self.assertEqual([((1.0, 'C'), 1.0), ((-1.0, 'C'), 2.0)], data_pts[:2])
+        with self.assertRaises(SystemExit):
+            self.run_main(['--sensor', '1'])
+
+
+class IngestionServiceTest(unittest.TestCase):
+    def setUp(self):
+        import asyncio
+        import service
+        self.asyncio = asyncio
+        self.service = service
+
+    def collect(self, service, count):
+        async def get_all():
+            return [await service.events.get() for _ in range(count)]
+        return self.asyncio.wait_for(get_all(), 5)
+
+    def test_feed(self):
+        async def run():
+            service = self.service.IngestionService(Thermometer(make_thresholds()), shards=2)
+            await service.start()
+            for temp in [0.5, 0.0, -0.5, 0.0]:
+                await service.feed('a', (temp, 'C'))
+                await service.feed('b', (temp + 100.0, 'C'))
+            await service.feed('a', (1.0, 'G'))
+            await service.join()
+            events = await self.collect(service, 9)
+            await service.stop()
+            return service, events
+
+        service, events = self.asyncio.run(run())
+        self.assertEqual(6, len([e for sensor, e in events if sensor == 'a']))
+        self.assertEqual(['Boiling', 'Boiling', 'Boiling_2'], [e.threshold.name for sensor, e in events if sensor == 'b'])
+        self.assertEqual(1, service.stats['invalid'])
+        self.assertEqual(9, len(service.latencies))
+
+    def test_unix_socket(self):
+        async def run(path):
+            service = self.service.IngestionService(Thermometer(make_thresholds()), shards=3, queue_size=2, events_size=2)
+            await service.start()
+            await service.serve_unix(path)
+            _, writer = await self.asyncio.open_unix_connection(path)
+            writer.write(b'bad line\n')
+            # Each sensor crosses the freezing point 19 times, triggering 3 thresholds each time
+            for i in range(20):
+                for sensor in range(5):
+                    writer.write(('s%d,%.1f,C\n' % (sensor, 0.5 if i % 2 else -0.5)).encode())
+            await writer.drain()
+            events = await self.collect(service, 5 * 19 * 3)
+            writer.close()
+            await service.stop()
+            return service, events
+
+        with tempfile.TemporaryDirectory() as directory:
+            service, events = self.asyncio.run(run(os.path.join(directory, 'feed.sock')))
+        for sensor in range(5):
+            names = [e.threshold.name for s, e in events if s == 's%d' % sensor]
+            self.assertEqual(['Freezing', 'Freezing 2', 'Freezing Fahrenheit', 'Freezing', 'Freezing 2', 'Freezing 3'] * 9 +
+                             ['Freezing', 'Freezing 2', 'Freezing Fahrenheit'], names)
+        self.assertEqual(100, service.stats['readings'])
+        self.assertEqual(1, service.stats['invalid'])
+
+    def test_udp_drop(self):
+        async def run():
+            service = self.service.IngestionService(Thermometer(make_thresholds()), shards=1, queue_size=1)
+            self.assertTrue(service.feed_nowait('a', (0.5, 'C')))
+            self.assertFalse(service.feed_nowait('a', (0.0, 'C')))
+            return service
+
+        self.assertEqual(1, self.asyncio.run(run()).stats['dropped'])
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(51, self.service.percentile(values, 50))
+        self.assertEqual(100, self.service.percentile(values, 99))
+
+
+@unittest.skipIf(np is None, 'numpy is not installed')
+class ShardedExecutorTest(unittest.TestCase):
+    def test_same_as_thermometers(self):
+        from sharding import ShardedExecutor
+
+        values, units = make_readings(600, seed=5)
+        readings = [(i % 7, dp) for i, dp in enumerate(zip(values, units))]
+        template = Thermometer(make_thresholds(), (0.5, 'C'), output_unit=TemperatureUnit.FAHRENHEIT)
+
+        therms = {}
+        expected = []
+        for i, (sensor_id, dp) in enumerate(readings):
+            therm = therms.setdefault(sensor_id, template.copy())
+            expected.extend((i, sensor_id, str(event)) for event in therm.read_events(dp, readings=False))
+
+        with ShardedExecutor(template, workers=3) as executor:
+            result = list(executor.read_stream(readings, batch_size=100))
+        self.assertEqual(expected, [(i, sensor_id, str(event)) for i, sensor_id, event in result])
+        # Events refer to the thresholds of the template
+        thresholds = [thresh for thresholds in template.thresholds.values() for thresh in thresholds]
+        self.assertTrue(all(event.threshold in thresholds for _, _, event in result if event.kind == EventKind.THRESHOLD))
+
+    def test_read_arrays(self):
+        from sharding import ShardedExecutor
+
+        values, units = make_readings(300, seed=6)
+        sensor_ids = [i % 5 for i in range(len(values))]
+        template = Thermometer(make_thresholds(), (0.5, 'C'))
+        with ShardedExecutor(template, workers=2) as executor:
+            expected = [(i, sensor_id, str(event)) for i, sensor_id, event in executor.read(list(zip(sensor_ids, zip(values, units))))]
+        # Columns of a binary log, with bytes units
+        with ShardedExecutor(template, workers=2) as executor:
+            result = executor.read_arrays(np.array(sensor_ids), np.array(values), np.array(units, dtype='S1'))
+        self.assertEqual(expected, [(i, sensor_id, str(event)) for i, sensor_id, event in result])
+        self.assertTrue(expected)
+
+
+@unittest.skipIf(np is None, 'numpy is not installed')
+class BinaryLogTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'readings.bin')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_write_read(self):
+        import binlog
+        with binlog.LogWriter(self.path, buffer_size=2) as writer:
+            writer.write(1.0, 3, 0.5, b'C')
+            writer.write(2.0, 4, 32.0, b'F')
+            writer.write(3.0, 3, -0.5, b'C')
+            writer.write_many([4.0, 5.0], [4, 3], [33.0, 0.0], ['F', 'C'])
+
+        with binlog.LogReader(self.path) as reader:
+            self.assertEqual(5, len(reader))
+            self.assertEqual([1.0, 2.0, 3.0, 4.0, 5.0], reader.records['timestamp'].tolist())
+            self.assertEqual([3, 4, 3, 4, 3], reader.records['sensor'].tolist())
+            self.assertEqual([0.5, 32.0, -0.5, 33.0, 0.0], reader.records['value'].tolist())
+            self.assertEqual([b'C', b'F', b'C', b'F', b'C'], reader.records['unit'].tolist())
+            self.assertEqual(2, len(list(reader.blocks(3))))
+
+    def test_float32(self):
+        import binlog
+        with binlog.LogWriter(self.path, value_size=4) as writer:
+            writer.write_many(0.0, 1, np.arange(10), 'C')
+        self.assertEqual(16 + 10 * 17, os.path.getsize(self.path))
+        with binlog.LogReader(self.path) as reader:
+            self.assertEqual(np.float32, reader.records['value'].dtype)
+            self.assertEqual(list(range(10)), reader.records['value'].tolist())
+
+    def test_not_a_log(self):
+        import binlog
+        with open(self.path, 'wb') as f:
+            f.write(b'0.5,C\n' * 10)
+        with self.assertRaises(ValueError):
+            binlog.LogReader(self.path)
+
+    def test_replay(self):
+        import binlog
+        values, units = make_readings(1000, seed=6, units='CF')
+        with binlog.LogWriter(self.path) as writer:
+            writer.write_many(np.arange(len(values)), np.arange(len(values)) % 3, values, units)
+
+        expected = Thermometer(make_thresholds(), (0.5, 'C')).read_many(values, units)
+        with binlog.LogReader(self.path) as reader:
+            result = list(binlog.replay(reader, Thermometer(make_thresholds(), (0.5, 'C')), block_size=300))
+        self.assertEqual(expected[0].tolist(), np.concatenate([sample_index for sample_index, _ in result]).tolist())
+
+        # The timestamps of the records are given to read_many: only the readings of the last 50 seconds are in the window
+        with binlog.LogReader(self.path) as reader:
+            therm = Thermometer(make_thresholds(), (0.5, 'C'))
+            therm.enable_rolling_stats(len(values), seconds=50.0)
+            list(binlog.replay(reader, therm, block_size=300))
+        self.assertEqual(50, therm.rolling_stats()['count'])
+
+        bank = ThermometerBank(3, make_thresholds(), (0.5, 'C'))
+        expected = bank.read(np.arange(len(values)) % 3, values, units)
+        with binlog.LogReader(self.path) as reader:
+            bank = ThermometerBank(3, make_thresholds(), (0.5, 'C'))
+            result = list(binlog.replay_bank(reader, bank, block_size=300))
+        self.assertEqual(expected[0].tolist(), np.concatenate([sample_index for sample_index, _ in result]).tolist())
+        self.assertEqual(expected[1].tolist(), np.concatenate([index for _, index in result]).tolist())
+
+    def test_convert(self):
+        import binlog
+        with binlog.LogWriter(self.path) as writer:
+            self.assertEqual((3, 1), binlog.convert(['0.5,C\n', '10.0,7,32.0,F\n', 'header\n', '\n', '1,C\n'], writer))
+        with binlog.LogReader(self.path) as reader:
+            self.assertEqual([0, 7, 0], reader.records['sensor'].tolist())
+            self.assertEqual([b'C', b'F', b'C'], reader.records['unit'].tolist())
+
+
+class BenchmarkTest(unittest.TestCase):
+    def test_run_all(self):
+        import benchmark
+        results = benchmark.run_all(50, threshold_counts=[1, 10])
+        self.assertIn('read/oscillation_inside/10', results)
+        self.assertIn('format_temperature', results)
+        for metric in ['readings_per_sec', 'peak_memory_bytes', 'latency_p50_us', 'latency_p99_us']:
+            self.assertGreater(results['read/mixed_units/1'][metric], 0)
+
+    def test_oscillation_inside_triggers_once(self):
+        import benchmark
+        data_pts, fluctuations = benchmark.oscillation_inside(2000, Random(0))
+        therm = Thermometer([Threshold('Freezing', 0.0)], fluctuations)
+        self.assertEqual(1, sum(len(therm.read_events(data_pt, False)) for data_pt in data_pts))
+
+    def test_compare(self):
+        import benchmark
+        before = {'results': {'read': {'readings_per_sec': 1000.0, 'latency_p99_us': 10.0}}}
+        after = {'results': {'read': {'readings_per_sec': 950.0, 'latency_p99_us': 20.0}}}
+        self.assertEqual([('read', 'latency_p99_us', 10.0, 20.0, 1.0)], benchmark.compare(before, after, 0.1))
+
+        after['results']['read']['readings_per_sec'] = 800.0
+        self.assertEqual(['latency_p99_us', 'readings_per_sec'], [r[1] for r in benchmark.compare(before, after, 0.1)])
+        self.assertEqual([], benchmark.compare(after, before, 0.1))
+
+
+class MetricsTest(unittest.TestCase):
+    def test_counters(self):
+        from metrics import ThermometerMetrics
+        therm = Thermometer(make_thresholds(), (0.5, 'C'))
+        metrics = ThermometerMetrics('boiler', sample_every=2)
+        metrics.attach(therm)
+
+        result = []
+        for dp in [(0.5,'C'), (0.0,'C'), (-0.5,'C'), (0.0,'C'), (1.0,'G')]:
+            result.extend(therm.read(dp))
+        self.assertEqual(7, len(result))
+        self.assertEqual(5, metrics.readings)
+        self.assertEqual(1, metrics.invalid_units)
+        self.assertEqual({'Freezing': 1, 'Freezing 2': 1, 'Freezing 3': 1, 'Freezing Fahrenheit': 1}, dict(metrics.triggers))
+        self.assertEqual(2, metrics.suppressed)  # Freezing and Freezing 2 at the 4th reading
+        self.assertEqual(2, metrics.latency_count)
+        self.assertEqual(2, sum(metrics.latency_buckets))
+
+    @unittest.skipIf(np is None, 'numpy is not installed')
+    def test_read_many(self):
+        from metrics import ThermometerMetrics
+        therm = ThermometerMetrics().attach(Thermometer(make_thresholds(), (0.5, 'C')))
+        sample_index, _ = therm.read_many([0.5, 0.0, -0.5, 0.0, 1.0], ['C', 'C', 'C', 'C', 'G'])
+        self.assertEqual(4, len(sample_index))
+        self.assertEqual(5, therm.metrics.readings)
+        self.assertEqual(1, therm.metrics.invalid_units)
+        self.assertEqual(4, sum(therm.metrics.triggers.values()))
+        self.assertEqual(2, therm.metrics.suppressed)
+
+    def test_shared_metrics(self):
+        from metrics import ThermometerMetrics
+        metrics = ThermometerMetrics('fleet', sample_every=1)
+        thermometers = [metrics.attach(Thermometer(make_thresholds())) for _ in range(3)]
+        for therm in thermometers:
+            therm.read((0.5, 'C'))
+            therm.read((0.0, 'C'))
+        self.assertEqual(6, metrics.readings)
+        self.assertEqual(3, metrics.triggers['Freezing'])
+        self.assertEqual(2, thermometers[0].metrics.readings)  # Counters of every thermometer, added up by metrics
+        self.assertEqual(6, metrics.latency_count)
+        self.assertEqual(6, sum(metrics.latency_buckets))
+
+    def test_detach(self):
+        from metrics import ThermometerMetrics
+        therm = Thermometer(make_thresholds())
+        metrics = ThermometerMetrics()
+        metrics.attach(therm)
+        therm.read((0.5, 'C'))
+        ThermometerMetrics.detach(therm)
+        therm.read((0.0, 'C'))
+        self.assertEqual(1, metrics.readings)
+        self.assertIsNone(therm.metrics)
+        self.assertNotIn('read_events', vars(therm))
+
+    def test_prometheus_export(self):
+        from metrics import PrometheusExporter, ThermometerMetrics
+        therm = ThermometerMetrics('boiler "1"', sample_every=1).attach(Thermometer(make_thresholds()))
+        for dp in [(0.5,'C'), (0.0,'C')]:
+            therm.read(dp)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'metrics.prom')
+            PrometheusExporter(path).export([therm.metrics])
+            with open(path) as f:
+                text = f.read()
+        self.assertIn('thermometer_readings_total{thermometer="boiler \\"1\\""} 2\n', text)
+        self.assertIn('thermometer_triggers_total{thermometer="boiler \\"1\\"",threshold="Freezing"} 1\n', text)
+        self.assertIn('thermometer_read_seconds_bucket{thermometer="boiler \\"1\\"",le="+Inf"} 2\n', text)
+        self.assertIn('thermometer_read_seconds_count{thermometer="boiler \\"1\\""} 2\n', text)
+        self.assertIn('# TYPE thermometer_read_seconds histogram\n', text)
+
+
+class RollingStatsTest(unittest.TestCase):
+    def check_window(self, stats, window):
+        self.assertEqual(len(window), stats.count)
+        self.assertEqual(min(window), stats.min)
+        self.assertEqual(max(window), stats.max)
+        mean = sum(window) / len(window)
+        self.assertAlmostEqual(mean, stats.mean)
+        self.assertAlmostEqual((sum((v - mean) ** 2 for v in window) / len(window)) ** 0.5, stats.stddev)
+
+    def test_empty(self):
+        from rolling import RollingStats
+        stats = RollingStats(10)
+        self.assertEqual(0, stats.count)
+        self.assertIsNone(stats.min)
+        self.assertIsNone(stats.stddev)
+
+    def test_count_window(self):
+        from rolling import RollingStats
+        rand = Random(8)
+        stats = RollingStats(20)
+        values = []
+        for _ in range(500):
+            values.append(rand.uniform(-10.0, 10.0))
+            stats.add(values[-1])
+            self.check_window(stats, values[-20:])
+
+    def test_time_window(self):
+        from rolling import RollingStats
+        stats = RollingStats(100, seconds=10.0)
+        values, timestamps = [], []
+        for i in range(200):
+            values.append(i % 13)
+            timestamps.append(i * 0.5)
+            stats.add(values[-1], timestamps[-1])
+            self.check_window(stats, [v for v, t in zip(values, timestamps) if t > timestamps[-1] - 10.0])
+
+    @unittest.skipIf(np is None, 'numpy is not installed')
+    def test_add_many(self):
+        from rolling import RollingStats
+        rand = Random(9)
+        stats = RollingStats(50)
+        values = []
+        for size in [3, 40, 120, 1, 0, 49]:
+            block = [rand.uniform(-10.0, 10.0) for _ in range(size)]
+            stats.add_many(np.array(block))
+            values.extend(block)
+            self.check_window(stats, values[-50:])
+            for _ in range(30):
+                values.append(rand.uniform(-10.0, 10.0))
+                stats.add(values[-1])
+                self.check_window(stats, values[-50:])
+
+    @unittest.skipIf(np is None, 'numpy is not installed')
+    def test_add_many_time_window(self):
+        from rolling import RollingStats
+        stats = RollingStats(100, seconds=10.0)
+        for i in range(30):
+            stats.add(float(i), timestamp=float(i))
+        stats.add_many(np.array([100.0, 101.0]), timestamps=np.array([35.0, 36.0]))
+        self.check_window(stats, [27.0, 28.0, 29.0, 100.0, 101.0])
+
+    def test_thermometer(self):
+        therm = Thermometer(make_thresholds(), output_unit=TemperatureUnit.FAHRENHEIT)
+        self.assertIsNone(therm.rolling_stats())
+        therm.enable_rolling_stats(3)
+        for dp in [(0.0, 'C'), (10.0, 'C'), (212.0, 'F'), (20.0, 'C')]:
+            therm.read(dp)
+        stats = therm.rolling_stats()
+        self.assertEqual(3, stats['count'])
+        self.assertAlmostEqual(50.0, stats['min'])
+        self.assertAlmostEqual(212.0, stats['max'])
+        self.assertAlmostEqual(110.0, stats['mean'])
+
+        therm.output_unit = TemperatureUnit.CELCIUS
+        stats = therm.rolling_stats()
+        self.assertAlmostEqual(10.0, stats['min'])
+        mean = 130 / 3.0
+        self.assertAlmostEqual(mean, stats['mean'])
+        self.assertAlmostEqual((((10 - mean) ** 2 + (100 - mean) ** 2 + (20 - mean) ** 2) / 3.0) ** 0.5, stats['stddev'])
+
+    def test_thermometer_timestamps(self):
+        therm = Thermometer(make_thresholds())
+        therm.enable_rolling_stats(10, seconds=10.0)
+        for i, temp in enumerate([1.0, 2.0, 3.0, 4.0]):
+            therm.read((temp, 'C'), i * 5.0)
+        # Only the readings of the last 10 seconds (at 10s and 15s) are in the window
+        self.assertEqual(2, therm.rolling_stats()['count'])
+        self.assertAlmostEqual(3.0, therm.rolling_stats()['min'])
+
+    @unittest.skipIf(np is None, 'numpy is not installed')
+    def test_thermometer_read_many_timestamps(self):
+        therm = Thermometer(make_thresholds())
+        therm.enable_rolling_stats(10, seconds=10.0)
+        therm.read_many([1.0, 2.0, 3.0, 4.0, 5.0], ['C', 'C', 'G', 'C', 'C'], np.array([0.0, 5.0, 8.0, 10.0, 15.0]))
+        stats = therm.rolling_stats()
+        self.assertEqual(2, stats['count'])
+        self.assertAlmostEqual(4.0, stats['min'])
+        self.assertAlmostEqual(5.0, stats['max'])
+
+    @unittest.skipIf(np is None, 'numpy is not installed')
+    def test_thermometer_read_many_fixed_point(self):
+        therm = Thermometer(make_thresholds(), fixed_point=True)
+        therm.enable_rolling_stats(4)
+        therm.read_many([1.0, 2.0, 3.0, 4.0, 41.0], ['C', 'C', 'G', 'C', 'F'])
+        stats = therm.rolling_stats()
+        self.assertEqual(4, stats['count'])
+        self.assertAlmostEqual(1.0, stats['min'])
+        self.assertAlmostEqual(5.0, stats['max'])
+        self.assertAlmostEqual(3.0, stats['mean'])
+
+
+@unittest.skipIf(np is None, 'numpy is not installed')
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'thermometers.snap')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def make_thermometers(self, thresholds):
+        values, units = make_readings(200)
+        thermometers = {
+            'celcius': Thermometer(thresholds, (0.5, 'C')),
+            7: Thermometer(thresholds[:3], (1.0, 'F'), output_unit=TemperatureUnit.FAHRENHEIT),
+            'fixed': Thermometer(thresholds, (0.5, 'C'), fixed_point=True),
+        }
+        thermometers['celcius'].set_cooldown(5.0)
+        for therm in thermometers.values():
+            for i, data_pt in enumerate(zip(values[:100], units[:100])):
+                therm.read(data_pt, float(i))
+        return thermometers, list(zip(values[100:], units[100:]))
+
+    def test_save_load(self):
+        import snapshot
+        thresholds = make_thresholds()
+        thermometers, data_pts = self.make_thermometers(thresholds)
+        snapshot.save(thermometers, self.path)
+
+        for restored in [snapshot.load(self.path, thresholds), snapshot.load(self.path)]:
+            self.assertEqual(list(thermometers), list(restored))
+            for key, therm in thermometers.items():
+                self.assertEqual(therm.get_state(), restored[key].get_state())
+                self.assertEqual([[t.name for t in ts] for ts in therm.thresholds.values()],
+                                 [[t.name for t in ts] for ts in restored[key].thresholds.values()])
+        # Thresholds are the given ones, and the restored thermometers keep reading as the saved ones would
+        self.assertIs(thresholds[0], restored_threshold(snapshot.load(self.path, thresholds)['celcius'], 'Freezing'))
+        restored = snapshot.load(self.path)
+        self.assertTrue(restored['celcius']._Thermometer__last_triggered)
+        for key, therm in thermometers.items():
+            self.assertEqual([therm.read(dp, 100.0 + i) for i, dp in enumerate(data_pts)],
+                             [restored[key].read(dp, 100.0 + i) for i, dp in enumerate(data_pts)])
+
+    def test_save_load_order(self):
+        import snapshot
+        therm = Thermometer(make_thresholds())
+        therm.read((1.0, 'C', 5))
+        snapshot.save({'ordered': therm}, self.path)
+        # A reading older than the last applied one is still ignored after a restart
+        restored = snapshot.load(self.path)['ordered']
+        self.assertEqual([], restored.read((-5.0, 'C', 4)))
+        self.assertEqual(['2.0C'], restored.read((2.0, 'C', 6)))
+
+        # Sequence numbers keep their precision above 2**53, timestamps stay floats
+        therm.read((1.0, 'C', 2 ** 60 + 1))
+        therm_float = Thermometer(make_thresholds())
+        therm_float.read((1.0, 'C', 1.5))
+        snapshot.save({'ordered': therm, 'timestamp': therm_float}, self.path)
+        restored = snapshot.load(self.path)
+        self.assertEqual([], restored['ordered'].read((2.0, 'C', 2 ** 60 + 1)))
+        self.assertEqual(['2.0C'], restored['ordered'].read((2.0, 'C', 2 ** 60 + 2)))
+        self.assertEqual(1.5, restored['timestamp'].get_state()[-1])
+
+    def test_restored_thresholds_get_new_ids(self):
+        import snapshot
+        thresholds = make_thresholds()
+        snapshot.save({'a': Thermometer(thresholds)}, self.path)
+        restored = restored_threshold(snapshot.load(self.path)['a'], 'Boiling')
+        self.assertEqual(thresholds[1].id, restored.id)
+        self.assertGreater(Threshold('New', 1.0).id, max(t.id for t in thresholds))
+
+    def test_many_thermometers_share_thresholds(self):
+        import snapshot
+        template = Thermometer(make_thresholds(), (0.5, 'C'))
+        thermometers = {}
+        for i in range(2000):
+            thermometers[i] = template.copy()
+            thermometers[i].read((float(i % 5 - 2), 'C'))
+        snapshot.save(thermometers, self.path)
+        restored = snapshot.load(self.path)
+        self.assertEqual(2000, len(restored))
+        self.assertIs(restored[0].thresholds, restored[1999].thresholds)
+        for i in [0, 1, 2, 1999]:
+            self.assertEqual(thermometers[i].get_state(), restored[i].get_state())
+
+    def test_invalid_file(self):
+        import snapshot
+        with open(self.path, 'wb') as f:
+            f.write(b'\0' * 64)
+        self.assertRaises(ValueError, snapshot.load, self.path)
+
+    def test_checkpointer(self):
+        import snapshot
+        thermometers, _ = self.make_thermometers(make_thresholds())
+        checkpointer = snapshot.Checkpointer(thermometers, self.path, interval=3600)
+        checkpointer.start()
+        checkpointer.checkpoint()
+        states = {key: therm.get_state() for key, therm in thermometers.items()}
+        for therm in thermometers.values():
+            therm.read((50.0, 'C'))
+        checkpointer.stop()
+        self.assertIsNone(checkpointer.error)
+        self.assertGreaterEqual(checkpointer.checkpoints, 1)
+        restored = snapshot.load(self.path)
+        self.assertEqual({key: therm.get_state() for key, therm in thermometers.items()},
+                         {key: therm.get_state() for key, therm in restored.items()})
+        self.assertNotEqual(states, {key: therm.get_state() for key, therm in restored.items()})
+
+    def test_checkpointer_sensors_added(self):
+        import snapshot
+        self.addCleanup(sys.setswitchinterval, sys.getswitchinterval())
+        sys.setswitchinterval(1E-6)
+        template = Thermometer(make_thresholds(), (0.5, 'C'))
+        thermometers = {}
+        checkpointer = snapshot.Checkpointer(thermometers, self.path, interval=0.001)
+        checkpointer.start()
+        for i in range(20000):
+            thermometers[i] = template.copy()
+        checkpointer.stop()
+        self.assertIsNone(checkpointer.error)
+        self.assertEqual(20000, len(snapshot.load(self.path)))
+
+    def test_checkpointer_error(self):
+        import snapshot
+        class Broken:
+            thresholds = {}
+            def get_state(self):
+                raise RuntimeError("broken")
+        thermometers = {'broken': Broken()}
+        checkpointer = snapshot.Checkpointer(thermometers, self.path, interval=0.001)
+        checkpointer.start()
+        deadline = time.monotonic() + 5
+        while checkpointer.error is None and time.monotonic() < deadline:
+            time.sleep(0.001)
+        self.assertIsInstance(checkpointer.error, RuntimeError)
+        # The thread keeps checkpointing after a failed capture
+        del thermometers['broken']
+        thermometers['a'] = Thermometer(make_thresholds())
+        checkpoints = checkpointer.checkpoints
+        while checkpointer.checkpoints == checkpoints and time.monotonic() < deadline:
+            time.sleep(0.001)
+        checkpointer.stop()
+        self.assertEqual(['a'], list(snapshot.load(self.path)))
+
+
+class CallbackDispatcherTest(unittest.TestCase):
+    def make_dispatcher(self, **kwargs):
+        from dispatcher import CallbackDispatcher
+        dispatcher = CallbackDispatcher(**kwargs)
+        self.addCleanup(dispatcher.stop)
+        return dispatcher
+
+    def test_callbacks_in_order(self):
+        thresholds = make_thresholds()
+        dispatcher = self.make_dispatcher(workers=2)
+        calls = []
+        dispatcher.subscribe(thresholds[0], lambda event: calls.append(('Freezing', str(event))))
+        dispatcher.subscribe(thresholds[1], lambda event: calls.append(('Boiling', str(event))))
+        therm = dispatcher.attach(Thermometer(thresholds))
+        for temp in [0.0, 1.0, -1.0, 50.0, 100.0, 0.0]:
+            therm.read((temp, 'C'))
+        dispatcher.join()
+        self.assertEqual(['Freezing threshold has been reached at 0.0C'] * 4,
+                         [event for name, event in calls if name == 'Freezing'])
+        self.assertEqual(['Boiling threshold has been reached at 100.0C'],
+                         [event for name, event in calls if name == 'Boiling'])
+        self.assertEqual(5, dispatcher.dispatched)
+
+    def test_copy_and_read_many(self):
+        thresholds = make_thresholds()
+        dispatcher = self.make_dispatcher()
+        calls = []
+        dispatcher.subscribe(thresholds[1], calls.append)
+        therm = dispatcher.attach(Thermometer(thresholds)).copy()
+        if np is not None:
+            therm.read_many([90.0, 101.0], ['C', 'C'])
+        else:
+            therm.read((90.0, 'C'))
+            therm.read((101.0, 'C'))
+        dispatcher.join()
+        self.assertEqual(['Boiling threshold has been reached at 100.0C'], [str(event) for event in calls])
+
+    def block(self, dispatcher, threshold):
+        release = threading.Event()
+        started = threading.Event()
+        def slow(event):
+            started.set()
+            release.wait(5)
+        dispatcher.subscribe(threshold, slow)
+        return started, release
+
+    def test_drop(self):
+        thresh = Threshold('Freezing', 0.0)
+        dispatcher = self.make_dispatcher(workers=1, queue_size=2, policy='drop')
+        started, release = self.block(dispatcher, thresh)
+        therm = dispatcher.attach(Thermometer([thresh]))
+        therm.read((0.0, 'C'))
+        started.wait(5)
+        for temp in [2.0, -2.0, 2.0, -2.0]:
+            therm.read((temp, 'C'))
+        release.set()
+        dispatcher.join()
+        self.assertEqual(3, dispatcher.dispatched)  # The one being handled and 2 in the queue
+        self.assertEqual(1, dispatcher.dropped)
+
+    def test_coalesce(self):
+        thresh, other = Threshold('Freezing', 0.0), Threshold('Boiling', 100.0)
+        dispatcher = self.make_dispatcher(workers=1, queue_size=2, policy='coalesce')
+        started, release = self.block(dispatcher, thresh)
+        calls = []
+        dispatcher.subscribe(other, calls.append)
+        dispatcher.subscribe(thresh, calls.append)
+        therm = dispatcher.attach(Thermometer([thresh, other]))
+        therm.read((0.0, 'C'))
+        started.wait(5)
+        for temp in [50.0, 100.0, 0.0, 50.0, -20.0]:  # Boiling is queued, then Freezing at 0.0C and 0.0C again
+            therm.read((temp, 'C'))
+        release.set()
+        dispatcher.join()
+        self.assertEqual(3, dispatcher.dispatched)
+        self.assertEqual(1, dispatcher.coalesced)
+        self.assertEqual(0, dispatcher.dropped)
+        self.assertEqual([thresh, other, thresh], [event.threshold for event in calls])
+
+    def test_block(self):
+        thresh = Threshold('Freezing', 0.0)
+        dispatcher = self.make_dispatcher(workers=1, queue_size=1, policy='block')
+        calls = []
+        dispatcher.subscribe(thresh, lambda event: calls.append(event) or time.sleep(0.001))
+        therm = dispatcher.attach(Thermometer([thresh]))
+        for temp in [0.0, 2.0, -2.0, 2.0, -2.0, 2.0]:
+            therm.read((temp, 'C'))
+        dispatcher.join()
+        self.assertEqual(5, len(calls))
+        self.assertEqual(0, dispatcher.dropped)
+
+    def test_callback_error(self):
+        thresh = Threshold('Freezing', 0.0)
+        dispatcher = self.make_dispatcher(workers=1)
+        calls = []
+        def fail(event):
+            raise RuntimeError("paging failed")
+        dispatcher.subscribe(thresh, fail)
+        dispatcher.subscribe(thresh, calls.append)
+        therm = dispatcher.attach(Thermometer([thresh]))
+        therm.read((0.0, 'C'))
+        dispatcher.join()
+        dispatcher.unsubscribe(thresh, fail)
+        therm.read((2.0, 'C'))
+        therm.read((-2.0, 'C'))
+        dispatcher.join()
+        self.assertEqual(1, dispatcher.errors)
+        self.assertIsInstance(dispatcher.error, RuntimeError)
+        self.assertEqual(2, len(calls))
+
+
+@unittest.skipIf(np is None, 'numpy is not installed')
+class BacktestTest(unittest.TestCase):
+    def make_configurations(self):
+        return [
+            ('default', make_thresholds(), (0.5, 'C')),
+            ('wide', make_thresholds()[:2], (5.0, 'F')),
+            ('rising', [Threshold('Warm', 20.0, direction=Direction.GREATER), Threshold('Hot', 40.0)], (0.0, 'C')),
+            ('empty', [], (0.0, 'C')),
+        ]
+
+    def test_same_as_read_many(self):
+        import backtest
+        values, units = make_readings(3000)
+        for fixed_point in [False, True]:
+            configurations = self.make_configurations()
+            results = backtest.backtest(values, units, configurations, fixed_point=fixed_point)
+            self.assertEqual([name for name, _, _ in configurations], [result['name'] for result in results])
+            for (name, thresholds, fluctuations), result in zip(configurations, results):
+                sample_index, threshold_id = Thermometer(thresholds, fluctuations, fixed_point=fixed_point).read_many(values, units)
+                self.assertEqual(sample_index.tolist(), result['sample_index'].tolist())
+                self.assertEqual(threshold_id.tolist(), result['threshold_id'].tolist())
+                self.assertEqual(len(sample_index), sum(result['triggers'].values()))
+            self.assertEqual({}, results[3]['triggers'])
+
+    def test_times_and_table(self):
+        import backtest
+        configurations = [('one', [Threshold('Freezing', 0.0)], (0.5, 'C'))]
+        # 0.2C is still in the fluctuations of the freezing point, 33.8F leaves them and 30.2F crosses it again
+        results = backtest.backtest([1.0, -1.0, 0.2, 33.8, 30.2], ['C', 'C', 'C', 'F', 'F'], configurations,
+                                    timestamps=[10.0, 20.0, 30.0, 40.0, 50.0])
+        self.assertEqual({'Freezing': 2}, results[0]['triggers'])
+        self.assertEqual([20.0, 50.0], results[0]['times'].tolist())
+        self.assertEqual(['configuration', 'threshold', 'triggers', 'first', 'last'], backtest.format_table(results).split('\n')[0].split())
+        self.assertEqual(['one', 'Freezing', '2', '20.0', '50.0'], backtest.format_table(results).split('\n')[1].split())
+
+    def test_main(self):
+        import backtest
+        import binlog
+        import json
+        with tempfile.TemporaryDirectory() as directory:
+            log_path, config_path = os.path.join(directory, 'log.bin'), os.path.join(directory, 'configs.json')
+            with binlog.LogWriter(log_path) as writer:
+                writer.write_many([1.0, 2.0, 3.0, 4.0], [1, 2, 1, 1], [-1.0, 5.0, 1.0, 101.0], 'C')
+            with open(config_path, 'w') as f:
+                json.dump({'a': {'thresholds': ['Freezing:0:C'], 'fluctuations': '0.5C'},
+                           'b': {'thresholds': ['Boiling:100:C:lesser']}}, f)
+            stdout, stderr = io.StringIO(), io.StringIO()
+            self.assertEqual(0, backtest.main([log_path, config_path, '--sensor', '1'], stdout, stderr))
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(['a', 'Freezing', '1', '3.0', '3.0'], lines[1].split())
+        self.assertEqual(['b', 'Boiling', '1', '4.0', '4.0'], lines[2].split())
+        self.assertIn('2 configurations, 3 readings', stderr.getvalue())
+
+    def test_main_sensors(self):
+        import backtest
+        import binlog
+        import json
+        with tempfile.TemporaryDirectory() as directory:
+            log_path, config_path = os.path.join(directory, 'log.bin'), os.path.join(directory, 'configs.json')
+            with binlog.LogWriter(log_path) as writer:
+                writer.write_many([1.0, 2.0], [1, 2], [-1.0, 5.0], 'C')
+            with open(config_path, 'w') as f:
+                json.dump({'a': {'thresholds': ['Freezing:0:C']}}, f)
+            stdout, stderr = io.StringIO(), io.StringIO()
+            self.assertEqual(2, backtest.main([log_path, config_path], stdout, stderr))
+        self.assertEqual('', stdout.getvalue())
+        self.assertIn('2 sensors', stderr.getvalue())
+
+
+class ConcurrentReadTest(unittest.TestCase):
+    def setUp(self):
+        # Switch threads often, so readings of the threads are interleaved
+        self.addCleanup(sys.setswitchinterval, sys.getswitchinterval())
+        sys.setswitchinterval(1E-6)
+
+    def test_out_of_order(self):
+        therm = Thermometer(make_thresholds())
+        self.assertEqual(4, len(therm.read((0.0, 'C', 2))))
+        self.assertEqual([], therm.read((-5.0, 'C', 1)))
+        self.assertEqual([], therm.read((-5.0, 'C', 2)))
+        self.assertEqual(['1.0C'], therm.read((1.0, 'C', 3)))
+        self.assertEqual(['2.0C'], therm.read((2.0, 'C')))  # Readings without order are always applied
+
+    def test_out_of_order_metrics(self):
+        from metrics import ThermometerMetrics, PrometheusExporter
+        metrics = ThermometerMetrics('t')
+        therm = metrics.attach(Thermometer(make_thresholds()))
+        therm.read((1.0, 'C', 10.0))
+        therm.read((2.0, 'C', 9.5))
+        self.assertEqual(1, metrics.out_of_order)
+        self.assertIn('thermometer_out_of_order_total{thermometer="t"} 1', PrometheusExporter('-').format([metrics]))
+
+    def test_redundant_collectors(self):
+        # Every thread feeds the same readings to the same thermometer, each reading should be applied once
+        values, units = make_readings(2000, units='CF')
+        data_pts = [(value, unit, i) for i, (value, unit) in enumerate(zip(values, units))]
+        from metrics import ThermometerMetrics
+        metrics = ThermometerMetrics(sample_every=7)
+        therm = metrics.attach(Thermometer(make_thresholds(), (0.5, 'C')))
+        therm.enable_locking()
+        applied = [[] for _ in range(4)]
+        def collect(results):
+            for data_pt in data_pts:
+                result = therm.read(data_pt)
+                if result:
+                    results.append((data_pt[2], result))
+        threads = [threading.Thread(target=collect, args=(results,)) for results in applied]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        applied = sorted(sum(applied, []))
+        self.assertEqual(len(set(seq for seq, _ in applied)), len(applied))  # No reading applied twice
+        expected = Thermometer(make_thresholds(), (0.5, 'C'))
+        self.assertEqual([result for _, result in applied], [expected.read(data_pts[seq]) for seq, _ in applied])
+        # Metrics of the threads are all counted
+        self.assertEqual(4 * len(data_pts), metrics.readings)
+        self.assertEqual(3 * len(data_pts), metrics.out_of_order)
+        self.assertEqual(sum(len([r for r in result if 'threshold' in r]) for _, result in applied), sum(metrics.triggers.values()))
+
+    def test_striped_thermometers(self):
+        from striped import StripedThermometers, generate_readings
+        template = Thermometer(make_thresholds(), (0.5, 'C'))
+        readings = list(generate_readings(50, 5000))
+        striped = StripedThermometers(template, stripes=8)
+        results = {}
+        def feed(part):
+            for sensor_id, data_pt in part:
+                results.setdefault(sensor_id, []).extend(striped.read(sensor_id, data_pt))
+        # Every sensor is fed by one thread, so no reading is out of order
+        threads = [threading.Thread(target=feed, args=([r for r in readings if r[0] % 4 == i],)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        expected, sequential = {}, {}
+        for sensor_id, data_pt in readings:
+            therm = sequential.setdefault(sensor_id, Thermometer(make_thresholds(), (0.5, 'C')))
+            expected.setdefault(sensor_id, []).extend(therm.read(data_pt))
+        self.assertEqual(expected, results)
+        self.assertEqual(50, len(striped.thermometers))
+        self.assertIs(striped.get(0).lock, striped.get(8).lock)
+        self.assertIsNot(striped.get(0).lock, striped.get(1).lock)
+
+    def test_run_threads(self):
+        from striped import StripedThermometers, generate_readings, run_threads
+        striped = StripedThermometers(Thermometer(make_thresholds(), (0.5, 'C')))
+        self.assertGreater(run_threads(striped, list(generate_readings(20, 2000)), 3), 0)
+        self.assertEqual(20, len(striped.thermometers))
+
+
+class CooldownTest(unittest.TestCase):
+    def test_cooldown(self):
+        therm = Thermometer([Threshold('Freezing', 0.0)], (0.5, 'C'))
+        therm.set_cooldown(60.0)
+        result = []
+        for i, temp in enumerate([1.0, -1.0, 1.0, -1.0, 1.0, -1.0]):
+            result.append(therm.read((temp, 'C'), i * 20.0))
+        # Triggered at 20s, suppressed at 40s and 60s, triggered again at 80s (60s later), suppressed at 100s
+        self.assertEqual([['1.0C'], ['Freezing threshold has been reached at 0.0C'], ['1.0C'], ['-1.0C'],
+                          ['Freezing threshold has been reached at 0.0C'], ['-1.0C']], result)
+
+        # Readings without timestamp are not affected by the cooldown, and the order of a reading is not its time
+        self.assertEqual(['Freezing threshold has been reached at 0.0C'], therm.read((1.0, 'C')))
+        self.assertEqual(['Freezing threshold has been reached at 0.0C'], therm.read((-1.0, 'C', 1)))
+
+    def test_cooldown_crossing(self):
+        therm = Thermometer([Threshold('Freezing', 0.0)], (0.5, 'C'))
+        therm.set_cooldown(10.0)
+        self.assertEqual(['Freezing threshold has been reached at 0.0C'], therm.read((0.0, 'C'), 0.0))
+        therm.read((1.0, 'C'), 1.0)
+        # Crossed again within the cooldown: not triggered, and not triggered later while the temperature stays there
+        result = [therm.read((0.0, 'C'), timestamp) for timestamp in (5.0, 6.0, 12.0)]
+        self.assertEqual([['0.0C']] * 3, result)
+        # A new crossing after the cooldown triggers it
+        therm.read((1.0, 'C'), 13.0)
+        self.assertEqual(['Freezing threshold has been reached at 0.0C'], therm.read((0.0, 'C'), 14.0))
+
+    def test_cooldown_metrics_and_copy(self):
+        from metrics import ThermometerMetrics
+        metrics = ThermometerMetrics()
+        therm = Thermometer([Threshold('Freezing', 0.0)])
+        therm.set_cooldown(10.0)
+        therm = metrics.attach(therm.copy())
+        for i, temp in enumerate([1.0, -1.0, 1.0, -1.0]):
+            therm.read((temp, 'C'), float(i))
+        self.assertEqual(2, metrics.suppressed)
+        self.assertEqual(1, metrics.triggers['Freezing'])
+
+    @unittest.skipIf(np is None, 'numpy is not installed')
+    def test_read_many_timestamps(self):
+        values, units = make_readings(2000, units='CF')
+        timestamps = np.arange(2000) * 0.5
+        thresholds = make_thresholds()
+        therm = Thermometer(thresholds, (0.5, 'C'))
+        therm.set_cooldown(30.0)
+        expected = []
+        for i, (data_pt, timestamp) in enumerate(zip(zip(values, units), timestamps.tolist())):
+            expected.extend((i, event.threshold.id) for event in therm.read_events(data_pt, False, timestamp))
+
+        therm = Thermometer(thresholds, (0.5, 'C'))
+        therm.set_cooldown(30.0)
+        sample_index, threshold_id = therm.read_many(values, units, timestamps)
+        self.assertEqual(expected, list(zip(sample_index.tolist(), threshold_id.tolist())))
+
+        import backtest
+        results = backtest.backtest(values, units, [('cooldown', make_thresholds(), (0.5, 'C'), 30.0),
+                                                    ('none', make_thresholds(), (0.5, 'C'))], timestamps)
+        self.assertEqual(len(expected), len(results[0]['sample_index']))
+        self.assertGreater(len(results[1]['sample_index']), len(results[0]['sample_index']))
+
+
+class EventCoalescerTest(unittest.TestCase):
+    def test_coalesce(self):
+        from coalesce import EventCoalescer
+        freezing, boiling = Threshold('Freezing', 0.0), Threshold('Boiling', 100.0)
+        def trigger(thresh):
+            return Event(EventKind.THRESHOLD, thresh.thresh_val_c, TemperatureUnit.CELCIUS, TemperatureUnit.CELCIUS, thresh)
+
+        coalescer = EventCoalescer(10.0)
+        self.assertEqual([], coalescer.add(trigger(freezing), 0.0))
+        self.assertEqual([], coalescer.add(trigger(freezing), 3.0))
+        self.assertEqual([], coalescer.add(trigger(boiling), 4.0))
+        reading = Event(EventKind.READING, 5.0, TemperatureUnit.CELCIUS, TemperatureUnit.CELCIUS)
+        self.assertEqual([reading], coalescer.add(reading, 5.0))
+        self.assertEqual([], coalescer.add(trigger(freezing), 9.0))
+        self.assertEqual([], coalescer.add(trigger(freezing), 9.5, key='other sensor'))
+
+        ready = coalescer.add(trigger(freezing), 10.0)
+        self.assertEqual(['Freezing threshold has been reached at 0.0C 3 times'], [str(event) for event in ready])
+        self.assertEqual(['Boiling threshold has been reached at 100.0C'], [str(e) for e in coalescer.flush(14.0)])
+        self.assertEqual([1, 1], [event.count for event in coalescer.flush()])
+        self.assertEqual([], coalescer.flush())
+
+    def test_noisy_sensor(self):
+        from coalesce import EventCoalescer
+        therm = Thermometer([Threshold('Freezing', 0.0)])
+        coalescer = EventCoalescer(60.0)
+        events = []
+        for i in range(1000):
+            for event in therm.read_events((1.0 if i % 2 else -1.0, 'C', float(i)), False):
+                events.extend(coalescer.add(event, float(i)))
+        events.extend(coalescer.flush())
+        self.assertEqual(999, sum(event.count for event in events))
+        self.assertEqual(17, len(events))
+
+
+def restored_threshold(therm, name):
+    return next(t for ts in therm.thresholds.values() for t in ts if t.name == name)
+
+
 if __name__ == '__main__':
     unittest.main()